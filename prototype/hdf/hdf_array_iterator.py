@@ -8,12 +8,20 @@
 resize the arrays into blocks that are of the right size so that they do not have to be read into memory.
 '''
 
+from bisect import bisect_right
 from operator import mul
 from pyon.core.exception import NotFound, BadRequest
 from pyon.public import log
 import itertools
 
-def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bounds = None):
+def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bounds = None, aligned_blocks = False):
+    """
+    Generator yielding, for each block of the variables, a dict var name -> {'current_slice', 'range', 'values'}.
+
+    With aligned_blocks, the BlockReader is used: blocks are aligned to the HDF5 chunk layout of the datasets and the
+    values are views into a reused buffer, valid until the next block is requested. Otherwise blocks come from an
+    ArrayIterator of concatenate_size elements.
+    """
 
 
     import h5py, numpy
@@ -26,6 +34,7 @@ def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bou
         raise NotFound('The concatenation size was not provided')
 
     open_files = []
+    gen = None
 
     try:
         for hdf_file in hdf_files:
@@ -52,19 +61,21 @@ def acquire_data( hdf_files = None, var_names=None, concatenate_size = None, bou
 
             open_files.append(file)
 
-        gen = _acquire_hdf_data(open_hdf_files=open_files, var_names=var_names, concatenate_size=concatenate_size, bounds=bounds)
+        gen = _acquire_hdf_data(open_hdf_files=open_files, var_names=var_names, concatenate_size=concatenate_size, bounds=bounds, aligned_blocks=aligned_blocks)
 
         # run the generator yielding to the caller
         for item in gen:
             yield item
 
     finally:
-        # always clean up!
+        # always clean up! Close the generator first, so that it is done with the files before they are closed
+        if gen is not None:
+            gen.close()
         for file in open_files:
             file.close()
 
 
-def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size = None, bounds = None):
+def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size = None, bounds = None, aligned_blocks = False):
 
 
     import h5py, numpy
@@ -160,6 +171,17 @@ def _acquire_hdf_data( open_hdf_files = None, var_names=None, concatenate_size =
     if len(dataset_lists_by_name.keys()) == 0:
         raise NotFound('No dataset for the variables provided were found in the hdf files.')
 
+    if aligned_blocks:
+        virtual_dsets = dict((vname, VirtualDataset(dset_list)) for vname, dset_list in dataset_lists_by_name.iteritems())
+        if bounds:
+            for virtual_dset in virtual_dsets.itervalues():
+                check_bounds(bounds, virtual_dset)
+
+        reader = BlockReader(virtual_dsets, concatenate_size, bounds=bounds)
+        for block in reader:
+            yield block
+        return
+
     for vname, dset_list in dataset_lists_by_name.iteritems():
 
         # Create the dataset list object that behaves like a dataset
@@ -209,93 +231,271 @@ def check_bounds(bounds, virtual_dset):
                          'than the how many are actually present in the data.')
 
 
-class VirtualDataset(object):
+class BlockReader(object):
+    """
+    Reads several variables, each a VirtualDataset over per-file h5py datasets, in blocks of records (along the
+    first dimension). A block holds up to concatenate_size elements of each variable, at least one record, and is
+    rounded to whole HDF5 chunks of the datasets: block boundaries are placed at multiples of the block length from
+    the start of each file, so every read is a single chunk-aligned read_direct from one file.
 
+    Blocks are read into one preallocated buffer per variable. The yielded values are views into these buffers:
+    they are overwritten once the next block is requested, copy them to keep them.
+    """
 
-    def __init__(self, var_list):
+    def __init__(self, virtual_dsets, concatenate_size, bounds=None):
 
-        import h5py, numpy
+        import numpy
 
-        self._vars = []
+        if not virtual_dsets:
+            raise NotFound('No datasets to read from.')
 
-        self._records = 0
+        self._names = virtual_dsets.keys()
+        self._vdsets = [virtual_dsets[name] for name in self._names]
 
-        self._starts = []
-        self._stops = []
+        for vdset in self._vdsets:
+            if not vdset.shape:
+                raise BadRequest('Scalar datasets can not be read in blocks.')
 
+        records = min(vdset.shape[0] for vdset in self._vdsets)
 
-        agg_shape = None
-        for var in var_list:
+        #-------------------------------------------------------------------------------------------------------
+        # normalize the bounds to one slice per dimension
+        #-------------------------------------------------------------------------------------------------------
 
-            vv = {}
-            vv['data'] = var
+        if bounds is None:
+            bounds = ()
+        elif not isinstance(bounds, tuple):
+            bounds = (bounds,)
 
-            shape = var.shape
-            vv['shape'] = shape
+        rec_slice = _fix_slice(bounds[0] if bounds else slice(None))
+        self._start, self._stop, step = rec_slice.indices(records)
+        if step != 1:
+            raise BadRequest('Strided bounds on the record dimension are not supported when reading in blocks.')
 
-            # set the agg shape if not already set
-            agg_shape = agg_shape or shape[1:]
-            # assert that it is the same
-            assert agg_shape == shape[1:]
+        self._agg_slices = []
+        self._agg_shapes = []
+        row_size = 1
+        for vdset in self._vdsets:
+            agg_slices = tuple(_fix_slice(slc) for slc in bounds[1:])
+            agg_slices += (slice(None),) * (len(vdset.shape) - 1 - len(agg_slices))
+            agg_shape = tuple(len(xrange(*slc.indices(dim))) for slc, dim in zip(agg_slices, vdset.shape[1:]))
+            self._agg_slices.append(agg_slices)
+            self._agg_shapes.append(agg_shape)
+            row_size = max(row_size, reduce(mul, agg_shape, 1))
 
-            vv['records'] = shape[0]
+        self.block_records = max(concatenate_size // row_size, 1)
 
-            self._starts.append(self._records)
+        self._blocks = self._plan_blocks()
+        max_block = max([stop - start for start, stop in self._blocks] or [0])
 
-            self._records += shape[0]
+        # one buffer per variable, reused for every block
+        self._buffers = [numpy.empty((max_block,) + agg_shape, dtype=vdset.dtype)
+                         for vdset, agg_shape in zip(self._vdsets, self._agg_shapes)]
 
-            self._stops.append(self._records - 1 )
+    @property
+    def blocks(self):
+        """
+        The (start, stop) record ranges of the blocks to read
+        """
+        return list(self._blocks)
 
-            self._vars.append(vv)
+    def _plan_blocks(self):
+        """
+        Places block boundaries at the start of each file and, within a file, at multiples of the block length
+        rounded to the chunk length of the file's datasets. Returns the ranges between boundaries within bounds.
+        """
+        boundaries = set([self._start, self._stop])
 
-        self._agg_shape = agg_shape
+        for vdset in self._vdsets:
+            for file_start, dset in zip(vdset.starts, vdset.datasets):
+                chunk = dset.chunks[0] if dset.chunks else 1
+                step = max(self.block_records - self.block_records % chunk, chunk)
 
-        self._shape = (self._records, ) + self._agg_shape
+                first = max(file_start, self._start)
+                last = min(file_start + dset.shape[0], self._stop)
 
+                # next boundary at or after the first record to read
+                pos = file_start + -(-(first - file_start) // step) * step
+                boundaries.add(first)
+                while pos < last:
+                    boundaries.add(pos)
+                    pos += step
 
+        boundaries = sorted(b for b in boundaries if self._start <= b <= self._stop)
+        return zip(boundaries[:-1], boundaries[1:])
 
+    def _read_block(self, start, stop):
+        """
+        Reads the records start to stop of all variables into the buffers
+        """
+        for vdset, agg_slices, buf in zip(self._vdsets, self._agg_slices, self._buffers):
+            index = bisect_right(vdset.starts, start) - 1
+            local = start - vdset.starts[index]
+            source_sel = (slice(local, local + stop - start),) + agg_slices
+            vdset.datasets[index].read_direct(buf, source_sel, (slice(0, stop - start),))
 
+    def __iter__(self):
 
-    def __getitem__(self, index):
-        import h5py, numpy
+        import numpy
 
-        assert len(index) == len(self.shape)
+        out_dict = {}
+        for start, stop in self._blocks:
+            self._read_block(start, stop)
 
-        get_start = index[0].start
+            for name, agg_slices, buf in zip(self._names, self._agg_slices, self._buffers):
+                values = buf[:stop - start]
+                out_dict[name] = {'current_slice' : (slice(start, stop, 1),) + agg_slices,
+                                  'range' : (numpy.nanmin(values), numpy.nanmax(values)),
+                                  'values' : values}
 
-        get_stop = index[0].stop
+            yield out_dict
 
-        assert get_stop > get_start
 
-        agg_slices = index[1:]
+def _fix_slice(index):
+    """
+    Returns a slice for a slice or an integer index
+    """
+    if isinstance(index, (int, long)):
+        return slice(index, index + 1, 1)
+    return index
 
-        for start, stop, var in zip(self._starts, self._stops, self._vars):
 
-            if stop < get_start:
-                continue
+class VirtualDataset(object):
+    """
+    Behaves like one dataset that is the concatenation along the first dimension of a list of datasets with the
+    same remaining dimensions (h5py datasets of several files, or arrays). Keeps an index of the cumulative record
+    offsets of the datasets, so a selection is resolved with a binary search for the datasets it covers and read
+    directly into one output array.
+
+    The record dimension can be selected with an integer, a slice with any step or an integer or boolean array
+    (fancy indexing); the other dimensions with anything the underlying datasets accept.
+    """
+
+    def __init__(self, var_list):
 
-            if start > get_stop:
-                continue
+        self._datasets = list(var_list)
 
-            elif start <= get_start and stop >= get_start:
-                # found the first of several chunks
+        agg_shape = None
+        for var in self._datasets:
+            # set the agg shape if not already set and check that all are the same
+            if agg_shape is None:
+                agg_shape = var.shape[1:]
+            elif agg_shape != var.shape[1:]:
+                raise BadRequest('Datasets to aggregate have different shapes: %s and %s' % (agg_shape, var.shape[1:]))
 
-                slc = slice(get_start-start, get_stop - start)
+        # Cumulative record offsets: dataset i holds the records _offsets[i] to _offsets[i+1]
+        self._offsets = [0]
+        for var in self._datasets:
+            self._offsets.append(self._offsets[-1] + var.shape[0])
 
-                aggregate = var['data'][(slc,) + agg_slices]
+        self._starts = self._offsets[:-1]
+        self._records = self._offsets[-1]
 
+        self._agg_shape = agg_shape or ()
 
-            elif start > get_start and start < get_stop:
-                # this is the last bit of the chunk
+        self._shape = (self._records, ) + self._agg_shape
 
-                slc = slice(0, get_stop - start)
+    def __getitem__(self, index):
+        import numpy
+
+        if not isinstance(index, tuple):
+            index = (index,)
+        if any(idx is Ellipsis for idx in index):
+            pos = index.index(Ellipsis)
+            index = index[:pos] + (slice(None),) * (len(self.shape) - len(index) + 1) + index[pos+1:]
+        if len(index) > len(self.shape):
+            raise IndexError('Too many indices for a dataset of shape %s' % (self.shape,))
+
+        rec_index = index[0] if index else slice(None)
+        agg_index = tuple(index[1:])
+        agg_index += (slice(None),) * (len(self._agg_shape) - len(agg_index))
+
+        # Shape of the selection in the other dimensions, without reading or allocating anything
+        agg_out_shape = numpy.empty((0,) + self._agg_shape, dtype=self.dtype)[(slice(None),) + agg_index].shape[1:]
+
+        # read_direct needs selections that do not drop dimensions
+        direct = all(isinstance(idx, slice) for idx in agg_index)
+
+        if isinstance(rec_index, (int, long, numpy.integer)):
+            rec = int(rec_index)
+            if rec < 0:
+                rec += self._records
+            if not 0 <= rec < self._records:
+                raise IndexError('Index %s out of range for %s records' % (rec_index, self._records))
+            num = bisect_right(self._starts, rec) - 1
+            return self._datasets[num][(rec - self._starts[num],) + agg_index]
+
+        if isinstance(rec_index, slice):
+            start, stop, step = rec_index.indices(self._records)
+            if step > 0:
+                return self._get_slice(start, stop, step, agg_index, agg_out_shape, direct)
+            rec_index = numpy.arange(start, stop, step)
+
+        return self._get_fancy(rec_index, agg_index, agg_out_shape)
+
+    def _get_slice(self, start, stop, step, agg_index, agg_out_shape, direct):
+        """
+        Reads the records start:stop:step (step > 0) from the datasets that hold them
+        """
+        import numpy
+
+        count = len(xrange(start, stop, step))
+        out = numpy.empty((count,) + agg_out_shape, dtype=self.dtype)
+        if not count:
+            return out
+
+        pos = 0
+        num = bisect_right(self._starts, start) - 1
+        rec = start
+        while pos < count:
+            ds_start, ds_stop = self._offsets[num], self._offsets[num + 1]
+            if rec < ds_stop:
+                # records of this dataset in the selection
+                num_recs = len(xrange(rec, min(stop, ds_stop), step))
+                source_sel = (slice(rec - ds_start, rec - ds_start + (num_recs - 1) * step + 1, step),) + agg_index
+                self._read_into(self._datasets[num], source_sel, out, slice(pos, pos + num_recs), direct)
+                pos += num_recs
+                rec += num_recs * step
+            num += 1
 
-                new = var['data'][(slc,) + agg_slices]
-                aggregate = numpy.concatenate((aggregate, new))
+        return out
 
+    def _get_fancy(self, rec_index, agg_index, agg_out_shape):
+        """
+        Reads the records of an integer or boolean index array, grouped by the dataset that holds them
+        """
+        import numpy
+
+        recs = numpy.asarray(rec_index)
+        if recs.dtype == bool:
+            if recs.shape != (self._records,):
+                raise IndexError('Boolean index of shape %s does not match %s records' % (recs.shape, self._records))
+            recs = numpy.nonzero(recs)[0]
+        recs = recs.astype(numpy.int64).ravel()
+        recs = numpy.where(recs < 0, recs + self._records, recs)
+        if recs.size and (recs.min() < 0 or recs.max() >= self._records):
+            raise IndexError('Index out of range for %s records' % self._records)
+
+        out = numpy.empty((recs.size,) + agg_out_shape, dtype=self.dtype)
+        if not recs.size:
+            return out
+
+        nums = numpy.searchsorted(self._starts, recs, side='right') - 1
+        for num in numpy.unique(nums):
+            positions = numpy.nonzero(nums == num)[0]
+            local = recs[positions] - self._starts[num]
+            # h5py needs increasing, unique indices
+            unique_local, inverse = numpy.unique(local, return_inverse=True)
+            data = self._datasets[num][(list(unique_local),) + agg_index]
+            out[positions] = data[inverse]
 
-        return aggregate
+        return out
 
+    def _read_into(self, dataset, source_sel, out, dest_slice, direct):
+        if direct and hasattr(dataset, 'read_direct'):
+            dataset.read_direct(out, source_sel, (dest_slice,))
+        else:
+            out[dest_slice] = dataset[source_sel]
 
     @property
     def __array_interface__(self):
@@ -305,6 +505,21 @@ class VirtualDataset(object):
     def shape(self):
         return self._shape
 
+    @property
+    def starts(self):
+        """
+        The index of the first record of each dataset
+        """
+        return self._starts
+
+    @property
+    def datasets(self):
+        return self._datasets
+
+    @property
+    def dtype(self):
+        return self._datasets[0].dtype if self._datasets else None
+
     @property
     def size(self):
         # No good built in product function. http://stackoverflow.com/questions/2104782/returning-the-product-of-a-list
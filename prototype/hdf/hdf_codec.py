@@ -357,7 +357,15 @@ class HDFDecoder(object):
         # This is dangerous - I don't like implementing del!!!
 
         # Clean up files!
-        FileSystem.unlink(self.filename)
+        self.close()
+
+    def close(self):
+        """
+        Delete the temporary file
+        """
+        if self.filename:
+            FileSystem.unlink(self.filename)
+            self.filename = None
 
 
     def list_datasets(self):
@@ -426,15 +434,38 @@ class HDFDecoder(object):
         #   raise HDFDecoderException("Error while trying to open file. ")
 
         # read array from the hdf file
-        nparray = numpy.array(h5pyfile['/' + name])
-
-        # hdf close
-        h5pyfile.close()
+        try:
+            nparray = numpy.array(h5pyfile['/' + name])
+        finally:
+            # hdf close
+            h5pyfile.close()
 
         # Do not remove the file here!
 
         return nparray
 
+    def read_all_datasets(self):
+        """
+        read all datasets in the hdf file into arrays, opening the file once
+
+        @retval datasets Dict of dataset name, of the form '/group/subgroup/dataset', to numpy array
+        """
+        import numpy, h5py
+
+        datasets = {}
+
+        def read_dataset(name, node):
+            if isinstance(node, h5py.Dataset):
+                datasets['/' + name] = numpy.array(node)
+
+        h5pyfile = h5py.File(self.filename, mode = 'r', driver='core')
+        try:
+            h5pyfile.visititems(read_dataset)
+        finally:
+            h5pyfile.close()
+
+        return datasets
+
     #@todo Do resource clean up on the file - in a close method or some other way?
 
 
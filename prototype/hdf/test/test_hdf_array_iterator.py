@@ -7,7 +7,7 @@
 '''
 
 import os
-from prototype.hdf.hdf_array_iterator import acquire_data
+from prototype.hdf.hdf_array_iterator import acquire_data, VirtualDataset
 
 from nose.plugins.attrib import attr
 from pyon.util.int_test import IonIntegrationTestCase
@@ -32,6 +32,37 @@ class HDFArrayIteratorUnitTest(IonUnitTestCase):
         self.assertRaises(TypeError, acquire_data(['anything'], [], [], []))
         h5mock.File.close.assert_called_once_with()
 
+    def test_virtual_dataset_indexing(self):
+        import numpy
+
+        arrays = [numpy.arange(30).reshape(10,3), numpy.arange(0).reshape(0,3), numpy.arange(30,45).reshape(5,3),
+                  numpy.arange(45,66).reshape(7,3)]
+        data = numpy.concatenate(arrays)
+        vdset = VirtualDataset(arrays)
+
+        self.assertEquals(vdset.shape, (22,3))
+        self.assertEquals(vdset.starts, [0,10,10,15])
+
+        for index in [(slice(2,18), slice(None)), slice(8,12), slice(None,None,4), slice(3,20,7), slice(None,None,-3),
+                      slice(15,15), (slice(1,21,2), 1), (slice(9,16), slice(0,3,2)), Ellipsis, (Ellipsis, 2),
+                      [21,0,10,10,14,-1], numpy.array([], dtype=int), data[:,0] % 4 == 0, (numpy.arange(22)[::5], 2)]:
+            result = vdset[index]
+            self.assertEquals(result.shape, data[index].shape)
+            self.assertTrue((result == data[index]).all())
+
+        self.assertTrue((vdset[12] == data[12]).all())
+        self.assertEquals(vdset[-1, 2], data[-1, 2])
+
+        with self.assertRaises(IndexError):
+            vdset[22]
+        with self.assertRaises(IndexError):
+            vdset[[0, 22]]
+        with self.assertRaises(IndexError):
+            vdset[0, 0, 0]
+
+        with self.assertRaises(BadRequest):
+            VirtualDataset([numpy.zeros((2,3)), numpy.zeros((2,4))])
+
 
 @attr('INT', group='dm')
 class HDFArrayIteratorTest_1d(IonIntegrationTestCase):
@@ -403,6 +434,92 @@ class HDFArrayIteratorTest_1d(IonIntegrationTestCase):
 
 
 
+    def test_virtual_dataset(self):
+
+        import numpy, h5py
+
+        files = [h5py.File(fname, 'r') for fname in self.fnames]
+        try:
+            vdset = VirtualDataset([file['fields/temperature'] for file in files])
+
+            self.assertEquals(vdset.shape, (150,))
+            self.assertTrue((vdset[3:63] == self.t_result[3:63]).all())
+            self.assertTrue((vdset[40:140:9] == self.t_result[40:140:9]).all())
+            self.assertTrue((vdset[[149, 3, 60, 60, 99]] == self.t_result[[149, 3, 60, 60, 99]]).all())
+            self.assertEquals(vdset[100], self.t_result[100])
+        finally:
+            for file in files:
+                file.close()
+
+    def test_aligned_blocks(self):
+
+        import numpy, h5py
+
+        #---------------------------------------------------------------------------------------------------
+        # Blocks do not straddle files; values are views into reused buffers
+        #---------------------------------------------------------------------------------------------------
+
+        generator = acquire_data(hdf_files = self.fnames,
+            var_names =  ['temperature', 'salinity', 'pressure'],
+            concatenate_size = 26,
+            bounds = (slice(3,63)),
+            aligned_blocks = True
+        )
+
+        slices = []
+        temperature = []
+        buffers = set()
+        for out in generator:
+            slices.append(out['temperature']['current_slice'][0])
+            temperature.append(out['temperature']['values'].copy())
+            self.assertTrue((out['salinity']['values'] == self.s_result[slices[-1]]).all())
+            buffers.add(out['temperature']['values'].__array_interface__['data'][0])
+
+        self.assertEquals(slices, [slice(3,26,1), slice(26,50,1), slice(50,63,1)])
+        self.assertTrue((numpy.concatenate(temperature) == self.t_result[3:63]).all())
+        # All blocks are read into the same buffer
+        self.assertEquals(len(buffers), 1)
+
+        #---------------------------------------------------------------------------------------------------
+        # Blocks are aligned to the chunk layout of the datasets
+        #---------------------------------------------------------------------------------------------------
+
+        chunked_fnames = [FileSystem.get_url(FS.TEMP, 'chunked%d.hdf5' % (i+1)) for i in range(3)]
+        try:
+            for fname, s in zip(chunked_fnames, self.salinity):
+                file = h5py.File(fname, 'w')
+                file.create_group('fields').create_dataset("salinity", data=s, chunks=(10,))
+                file.close()
+
+            generator = acquire_data(hdf_files = chunked_fnames,
+                var_names =  ['salinity'],
+                concatenate_size = 25,
+                aligned_blocks = True
+            )
+
+            slices = []
+            for out in generator:
+                slc = out['salinity']['current_slice'][0]
+                self.assertTrue((out['salinity']['values'] == self.s_result[slc]).all())
+                slices.append((slc.start, slc.stop))
+
+            self.assertEquals(slices, [(0,20), (20,40), (40,50), (50,70), (70,90), (90,100), (100,120), (120,140), (140,150)])
+
+            # Closing the generator early closes the files
+            generator = acquire_data(hdf_files = chunked_fnames,
+                var_names =  ['salinity'],
+                concatenate_size = 10,
+                aligned_blocks = True
+            )
+            out = generator.next()
+            self.assertTrue((out['salinity']['values'] == self.s_result[0:10]).all())
+            generator.close()
+
+        finally:
+            for fname in chunked_fnames:
+                FileSystem.unlink(fname)
+
+
 @attr('INT', group='dm')
 class HDFArrayIteratorTest_2d(IonIntegrationTestCase):
 
@@ -690,4 +807,22 @@ class HDFArrayIteratorTest_2d(IonIntegrationTestCase):
 #
 #        self.check_pieces_3_variables_2d(generator, bounds, concatenate_size)
 
+    def test_aligned_blocks(self):
+
+        import numpy
+
+        # Blocks hold whole records: 26 elements of 6 selected columns are 4 records
+        generator = acquire_data(hdf_files = self.fnames,
+            var_names =  ['temperature', 'salinity', 'pressure'],
+            concatenate_size = 26,
+            bounds = (slice(2,12), slice(2,8)),
+            aligned_blocks = True
+        )
+
+        salinity = []
+        for out in generator:
+            self.assertEquals(out['salinity']['current_slice'][1:], (slice(2,8),))
+            self.assertTrue(out['salinity']['values'].shape[0] <= 4)
+            salinity.append(out['salinity']['values'].copy())
 
+        self.assertTrue((numpy.concatenate(salinity) == self.s_result[2:12, 2:8]).all())
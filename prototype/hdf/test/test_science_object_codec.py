@@ -197,6 +197,23 @@ class TestScienceObjectCodec(PyonTestCase):
 
         self.assertEqual(sha1(nparray.tostring()), sha1(self.known_array.tostring()) ) # works for arbitrarily shaped arrays
 
+    def test_read_all_datasets(self):
+        """
+        Read all datasets of an hdf string in one pass
+        """
+        hdfencoder = HDFEncoder()
+        hdfencoder.add_hdf_dataset(self.path_to_dataset, self.known_array)
+        hdfencoder.add_hdf_dataset('fields/other', numpy.arange(5))
+        hdf_string = hdfencoder.encoder_close()
+
+        hdfdecoder = HDFDecoder(hdf_string)
+        datasets = hdfdecoder.read_all_datasets()
+        hdfdecoder.close()
+
+        self.assertEqual(set(datasets.keys()), set(['/' + self.path_to_dataset, '/fields/other']))
+        self.assertEqual(sha1(datasets['/' + self.path_to_dataset].tostring()), sha1(self.known_array.tostring()))
+        self.assertTrue((datasets['/fields/other'] == numpy.arange(5)).all())
+
     def test_decode_encode(self):
         """
         Try a decode-encode sequence and compare if its the same string
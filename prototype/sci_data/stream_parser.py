@@ -15,6 +15,10 @@ from prototype.hdf.hdf_codec import HDFDecoder, HDFDecoderException
 from pyon.util.log import log
 
 class PointSupplementStreamParser(object):
+    """
+    Reads the field values of a point supplement. The hdf string is decoded once, on first access, into arrays for all
+    datasets, which are cached for the life of the parser.
+    """
 
     def __init__(self, stream_definition=None, stream_granule=None):
         """
@@ -25,25 +29,62 @@ class PointSupplementStreamParser(object):
 
         self._stream_granule = stream_granule
 
-        data_stream_id = stream_granule.data_stream_id
-        data_stream = stream_granule.identifiables[data_stream_id]
-
-        hdf_string = data_stream.values
-
-        self._decoder = HDFDecoder(hdf_string)
+        # Dict of hdf path to array, decoded on first access
+        self._datasets = None
 
 
     def get_values(self, field_name=''):
+        """
+        Returns a copy of the array of values of a field, which the caller may modify
+        """
 
         hdf_path = self._get_hdf_path(field_name)
 
+        datasets = self._decode()
+
         try:
-            array = self._decoder.read_hdf_dataset(hdf_path)
+            array = datasets[_dataset_key(hdf_path)]
         except KeyError, ke:
-            log.warn('Could not find requested dataset. Datasets present in hdf file: "%s"', self._decoder.list_datasets())
+            log.warn('Could not find requested dataset. Datasets present in hdf file: "%s"', sorted(datasets.keys()))
             raise ke
 
-        return array
+        return array.copy()
+
+    def get_all_values(self):
+        """
+        Returns a dict of field name to the array of values, for all fields of the stream definition with values in
+        this supplement. The arrays are not copied: they are shared with later calls and read only.
+        """
+
+        datasets = self._decode()
+
+        values = {}
+        for field_name in self.list_field_names():
+            key = _dataset_key(self._get_hdf_path(field_name))
+            if key in datasets:
+                values[field_name] = datasets[key]
+
+        return values
+
+    def _decode(self):
+
+        if self._datasets is None:
+
+            data_stream_id = self._stream_granule.data_stream_id
+            data_stream = self._stream_granule.identifiables[data_stream_id]
+
+            decoder = HDFDecoder(data_stream.values)
+            try:
+                datasets = decoder.read_all_datasets()
+            finally:
+                decoder.close()
+
+            for array in datasets.itervalues():
+                array.flags.writeable = False
+
+            self._datasets = datasets
+
+        return self._datasets
 
     def _get_hdf_path(self, field_name):
 
@@ -71,3 +112,13 @@ class PointSupplementStreamParser(object):
 
         return identifiables[data_record_id].field_ids
 
+
+def _dataset_key(hdf_path):
+    """
+    Returns the name of a dataset as HDFDecoder.read_all_datasets has it for a path as given to read_hdf_dataset
+    """
+    # if a data group name is not provided, the default data group name is 'data'
+    if hdf_path.find('/')==-1:
+        hdf_path = 'data/' + hdf_path
+
+    return '/' + hdf_path.lstrip('/')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+'''
+@file prototype/sci_data/test/test_stream_parser.py
+@brief Tests for the point supplement stream parser
+'''
+
+__license__ = 'Apache 2.0'
+
+from mock import patch
+from nose.plugins.attrib import attr
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.file_sys import FileSystem
+
+try:
+    import h5py
+    import numpy
+except ImportError:
+    from unittest import SkipTest
+    raise SkipTest('Numpy or h5py not installed')
+
+from prototype.hdf.hdf_codec import HDFDecoder
+from prototype.sci_data.stream_defs import ctd_stream_definition, ctd_stream_packet
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
+
+
+@attr('UNIT', group='dm')
+class PointSupplementStreamParserTest(PyonTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # This test does not start a container so we have to hack creating a FileSystem singleton instance
+        FileSystem(DotDict())
+
+    def setUp(self):
+        self.t = [10.0, 10.5, 11.0, 11.5]
+        self.p = [1.0, 2.0, 3.0, 4.0]
+        self.c = [30.0, 31.0, 32.0, 33.0]
+        self.granule = ctd_stream_packet(stream_id='ctd_stream', c=self.c, t=self.t, p=self.p,
+                                         lat=[41.5], lon=[-70.7], time=[1, 2, 3, 4])
+        self.parser = PointSupplementStreamParser(stream_definition=ctd_stream_definition(stream_id='ctd_stream'),
+                                                  stream_granule=self.granule)
+
+    def test_decode_once(self):
+
+        with patch('prototype.sci_data.stream_parser.HDFDecoder', wraps=HDFDecoder) as decoder_cls:
+            temperature = self.parser.get_values('temperature')
+            pressure = self.parser.get_values('pressure')
+            self.parser.get_all_values()
+            self.parser.get_values('temperature')
+
+        self.assertEquals(decoder_cls.call_count, 1)
+        self.assertTrue((temperature == numpy.array(self.t)).all())
+        self.assertTrue((pressure == numpy.array(self.p)).all())
+
+    def test_get_values_copy(self):
+
+        temperature = self.parser.get_values('temperature')
+        self.assertTrue(temperature.flags.writeable)
+        temperature[0] = -1.0
+
+        # The cached values are not changed by the caller
+        self.assertEquals(self.parser.get_values('temperature')[0], self.t[0])
+        self.assertIsNot(self.parser.get_values('temperature'), self.parser.get_values('temperature'))
+
+    def test_get_all_values(self):
+
+        values = self.parser.get_all_values()
+
+        self.assertTrue(set(['temperature', 'pressure', 'conductivity']) <= set(values))
+        self.assertTrue(set(values) <= set(self.parser.list_field_names()))
+        for field_name, array in values.iteritems():
+            self.assertFalse(array.flags.writeable)
+            self.assertTrue((array == self.parser.get_values(field_name)).all())
+        self.assertTrue((values['conductivity'] == numpy.array(self.c)).all())
+
+        # Shared between calls
+        self.assertIs(self.parser.get_all_values()['temperature'], values['temperature'])
+
+    def test_unknown_field(self):
+
+        self.assertRaises(KeyError, self.parser.get_values, 'no_such_field')
@@ -217,7 +217,9 @@ class ProcManager(object):
         listen_name = get_safe(config, "process.listen_name") or name
 
         service_instance.stream_subscriber_registrar = StreamSubscriberRegistrar(process=service_instance, node=self.container.node)
-        sub = service_instance.stream_subscriber_registrar.create_subscriber(exchange_name=listen_name)
+        batch_size = get_safe(config, "process.batch.size") if hasattr(service_instance, 'call_process_batch') else None
+        sub = service_instance.stream_subscriber_registrar.create_subscriber(exchange_name=listen_name,
+            batch_size=batch_size, batch_timeout=get_safe(config, "process.batch.timeout"))
 
         # Add publishers if any...
         publish_streams = get_safe(config, "process.publish_streams")
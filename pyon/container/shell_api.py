@@ -217,6 +217,31 @@ def lsdir(qname='/', truncate=True):
     else:
         print "\n".join(["%s: %s" % tup for tup in detable])
 
+def dsstats(reset=False):
+    """Prints datastore call statistics per datastore and method.
+    Requires container.datastore.instrumentation.enabled
+    @param reset if True, clears the statistics after printing
+    """
+    from pyon.datastore.instrumentation import HISTOGRAM_BOUNDS
+    ds_stats = container.datastore_manager.ds_stats
+    if not ds_stats:
+        print "Datastore instrumentation not enabled (container.datastore.instrumentation.enabled)"
+        return
+
+    print "Datastore call statistics"
+    print "-------------------------"
+    table = [("datastore", "method", "count", "errors", "avg ms", "p95 ms", "max ms", "docs", "bytes")]
+    stats = ds_stats.get_stats()
+    for ds_name in sorted(stats.keys()):
+        for method, mstats in sorted(stats[ds_name].iteritems()):
+            p95 = ds_stats.get_percentile(mstats['histogram'], 95)
+            p95 = "<=%s" % p95 if p95 else ">%s" % HISTOGRAM_BOUNDS[-1]
+            table.append((ds_name, method, mstats['count'], mstats['errors'], "%.1f" % (mstats['time_avg'] * 1000),
+                          p95, "%.1f" % (mstats['time_max'] * 1000), mstats['docs'], mstats['bytes']))
+    print pprint_table(table)
+    if reset:
+        ds_stats.reset()
+
 def spawn(proc, procname=None):
     procmod, proccls = proc.rsplit('.', 1)
     procname = procname or proccls
@@ -229,7 +254,7 @@ def ionhelp():
     print "Available variables: %s" % ", ".join(sorted(public_vars.keys()))
 
 # This defines the public API of functions
-public_api = [ionhelp,ps,procs,ms,apps,svc_defs,obj_defs,type_defs,lsdir,spawn]
+public_api = [ionhelp,ps,procs,ms,apps,svc_defs,obj_defs,type_defs,lsdir,dsstats,spawn]
 public_vars = None
 
 def get_proc():
@@ -25,6 +25,11 @@ def decode_ion( obj):
         # Shape is currently implicit because tolist encoding makes a list of lists for a 2d array.
         return numpy.array(obj['content'],dtype=numpy.dtype(obj['header']['type']))
 
+    elif "__ion_buffer__" in obj:
+        # Structured array: raw buffer with field descriptions (tuples come back as lists)
+        dtype = numpy.dtype([tuple(tuple(item) if isinstance(item, list) else item for item in field) for field in obj['header']['descr']])
+        return numpy.fromstring(obj['content'], dtype=dtype).reshape(obj['header']['shape'])
+
     elif '__complex__' in obj:
         return complex(obj['real'], obj['imag'])
         ## Always return object
@@ -45,6 +50,11 @@ def encode_ion( obj):
     if isinstance(obj, numpy.ndarray):
         if obj.ndim == 0:
             raise ValueError('Can not encode a numpy array with rank 0')
+        if obj.dtype.names:
+            if obj.dtype.hasobject:
+                raise ValueError('Can not encode a structured numpy array with object fields')
+            # Structured arrays (e.g. packed record dictionaries) are sent as one buffer
+            return {"header":{"descr":obj.dtype.descr,"nd":obj.ndim,"shape":obj.shape},"content":obj.tostring(),"__ion_buffer__":True}
         return {"header":{"type":str(obj.dtype),"nd":obj.ndim,"shape":obj.shape},"content":obj.tolist(),"__ion_array__":True}
 
     if isinstance(obj, complex):
@@ -158,10 +158,29 @@ class NumpyMsgPackTestCase(unittest.TestCase, PackRunBase ):
         PackRunBase.__init__(self,*args, **kwargs)
 
 
+class StructuredArrayMsgPackTestCase(unittest.TestCase):
+
+    def test_structured_array(self):
+        array = numpy.zeros(10, dtype=[('h0', 'float64'), ('h1', 'int16', (3,)), ('h2', 'complex64')])
+        array['h0'] = numpy.random.standard_normal(10)
+        array['h1'] = numpy.arange(30).reshape(10, 3)
+
+        msg = packb(array, default=encode_ion)
+        new_array = unpackb(msg, object_hook=decode_ion)
+
+        assert_equals(new_array.dtype, array.dtype)
+        assert_equals(new_array.shape, array.shape)
+        assert_equals(sha1(array.tostring()), sha1(new_array.tostring()))
+
+        # Encoded as one buffer, not a list of values
+        assert_true(len(msg) < array.nbytes + 200)
+
+        # Views into the decoded buffer are writable
+        new_array['h0'][0] = 1.0
+
 
 if __name__ == '__main__':
 
     pb = PackRunBase()
 
     pb.test_all()
-
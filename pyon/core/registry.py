@@ -15,29 +15,62 @@ import interface.messages
 model_classes = {}
 message_classes = {}
 
+# Type hierarchy indexes, built once by build_type_index() when the IonObjectRegistry initializes.
+# Object type -> frozenset of object types extending it (including itself)
+subtypes_index = {}
+# Object type -> frozenset of object types it extends (including itself)
+supertypes_index = {}
+
+def build_type_index():
+    """
+    Computes the subtype and supertype indexes of all object types in model_classes.
+    """
+    class_names = {}
+    for name, clzz in model_classes.iteritems():
+        class_names.setdefault(clzz, []).append(name)
+
+    subtypes = dict((name, set()) for name in model_classes)
+    supertypes = {}
+    for name, clzz in model_classes.iteritems():
+        supers = set()
+        for base in inspect.getmro(clzz):
+            supers.update(class_names.get(base, []))
+        supertypes[name] = frozenset(supers)
+        for base_name in supers:
+            subtypes[base_name].add(name)
+
+    subtypes_index.clear()
+    subtypes_index.update((name, frozenset(subs)) for name, subs in subtypes.iteritems())
+    supertypes_index.clear()
+    supertypes_index.update(supertypes)
+
 def getextends(type):
     """
     Returns a list of classes that the object with the given type extends.
     @param type (str) Object type
     @retval List of object types that are extended by given type
     """
-    ret = []
-    base_clzz = model_classes[type]
-    for name in model_classes:
-        clzz = model_classes[name]
-        bases = inspect.getmro(clzz)
-        if base_clzz in bases:
-            ret.append(name)
-    return ret
+    return list(subtypes_index[type])
 
-def issubtype(obj_type, base_type):
-    obj_cls = model_classes.get(obj_type, None)
-    base_cls = model_classes.get(base_type, None)
+def getsubtypes(type, leaves_only=False):
+    """
+    Returns the set of object types that extend the given type, including the type itself.
+    @param type (str) Object type
+    @param leaves_only (bool) If True, only return types that are not extended by other types
+    @retval frozenset of object types
+    """
+    if leaves_only:
+        return frozenset(name for name in subtypes_index[type] if len(subtypes_index[name]) == 1)
+    return subtypes_index[type]
 
-    if obj_cls and base_cls:
-        return base_cls in obj_cls.__mro__
+def getsupertypes(type):
+    """
+    Returns the set of object types that the given type extends, including the type itself.
+    """
+    return supertypes_index[type]
 
-    return False
+def issubtype(obj_type, base_type):
+    return base_type in supertypes_index.get(obj_type, ())
 
 def get_message_class_parm_type(service_name, service_operation, parameter, in_out):
     """
@@ -107,6 +140,7 @@ class IonObjectRegistry(object):
         classes = inspect.getmembers(interface.messages, inspect.isclass)
         for name, clzz in classes:
             message_classes[name] = clzz
+        build_type_index()
 
         from pyon.core.bootstrap import CFG
         self.validate_setattr = CFG.get_safe('validate.setattr', False)
@@ -40,6 +40,21 @@ class ObjectTest(IonIntegrationTestCase):
             assignment_failed = True
         self.assertTrue(assignment_failed)
 
+    def test_type_index(self):
+        from pyon.core.registry import getextends, getsubtypes, getsupertypes, issubtype
+        self.assertIn('SampleObject', getextends('IonObjectBase'))
+        self.assertIn('SampleObject', getsubtypes('SampleObject'))
+        self.assertIn('IonObjectBase', getsupertypes('SampleObject'))
+        self.assertTrue(issubtype('SampleObject', 'IonObjectBase'))
+        self.assertFalse(issubtype('IonObjectBase', 'SampleObject'))
+        self.assertFalse(issubtype('NonExistentType', 'IonObjectBase'))
+
+        self.assertTrue(issubtype('InstrumentDevice', 'Resource'))
+        leaf_types = getsubtypes('Resource', leaves_only=True)
+        self.assertIn('InstrumentDevice', getsubtypes('Resource'))
+        self.assertNotIn('Resource', leaf_types)
+        self.assertTrue(all([getsubtypes(rt) == frozenset([rt]) for rt in leaf_types]))
+
     def test_bootstrap(self):
         """ Use the factory and singleton from bootstrap.py/public.py """
         obj = IonObject('SampleObject')
@@ -86,7 +86,24 @@ function(doc) {
     emit(doc.s, doc.o);
   }
 }""",
-        }
+        },
+        # For batched multi-hop traversal with exact keys= lookup
+        'by_subpred':{
+            'map':"""
+function(doc) {
+  if (doc.type_ == "Association") {
+    emit([doc.s, doc.p], doc);
+  }
+}""",
+        },
+        'by_objpred':{
+            'map':"""
+function(doc) {
+  if (doc.type_ == "Association") {
+    emit([doc.o, doc.p], doc);
+  }
+}""",
+        },
     },
 
     # Pure ION object related views
@@ -155,6 +172,15 @@ function(doc) {
   if (doc.type_ && doc.type_!="Association") {
     emit([doc.name, doc.type_, doc.lcstate], null);
   }
+}""",
+        },
+        # For lookup of resources of several types (e.g. all subtypes of a base type) with keys=
+        'by_restype':{
+            'map':"""
+function(doc) {
+  if (doc.type_ && doc.type_!="Association") {
+    emit([doc.type_], null);
+  }
 }""",
         },
     },
@@ -233,6 +259,31 @@ function(doc) {
   if (doc.origin) {
     emit([doc.origin, doc.type_, doc.ts_created]);
   }
+}""",
+        },
+        # Composite views for find_events, see EVENT_QUERY_VIEWS in pyon/event/event.py
+        'by_typesub':{
+            'map':"""
+function(doc) {
+  if (doc.origin) {
+    emit([doc.type_, doc.sub_type, doc.ts_created]);
+  }
+}""",
+        },
+        'by_origintype_type':{
+            'map':"""
+function(doc) {
+  if (doc.origin) {
+    emit([doc.origin_type, doc.type_, doc.ts_created]);
+  }
+}""",
+        },
+        'by_origintype_time':{
+            'map':"""
+function(doc) {
+  if (doc.origin) {
+    emit([doc.origin_type, doc.ts_created]);
+  }
 }""",
         },
     },
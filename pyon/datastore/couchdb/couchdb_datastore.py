@@ -3,8 +3,9 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+from collections import OrderedDict
 from uuid import uuid4
-import hashlib
+import time
 
 import couchdb
 from couchdb.client import ViewResults, Row
@@ -15,7 +16,9 @@ from pyon.core.exception import BadRequest, Conflict, NotFound
 from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.couchdb.couchdb_config import get_couchdb_views
+from pyon.datastore.couchdb.couchdb_pool import get_session_pool
 from pyon.ion.resource import CommonResourceLifeCycleSM
+from pyon.util.containers import content_hash
 from pyon.util.log import log
 from pyon.util.arg_check import validate_is_instance
 from pyon.core.bootstrap import CFG
@@ -31,17 +34,7 @@ def sha1hex(doc):
     """
     Compare the content of the doc without its id or revision...
     """
-    doc_id = doc.pop('_id',None)
-    doc_rev = doc.get('_rev',None)
-    doc_string = str(doc)
-
-    if doc_id is not None:
-        doc['_id'] = doc_id
-
-    if doc_rev is not None:
-        doc['_rev'] = doc_rev
-
-    return hashlib.sha1(doc_string).hexdigest().upper()
+    return content_hash(doc).upper()
 
 class CouchDB_DataStore(DataStore):
     """
@@ -66,7 +59,12 @@ class CouchDB_DataStore(DataStore):
         #connection_str = "http://%s:%s" % (self.host, self.port)
         # TODO: Security risk to emit password into log. Remove later.
         log.info('Connecting to CouchDB server: %s' % connection_str)
-        self.server = couchdb.Server(connection_str)
+        # All datastores of the container share a bounded keep-alive connection pool per server
+        self._pool = get_session_pool(connection_str)
+        self._pool_ref = bool(self._pool)
+        if self._pool_ref:
+            self._pool.add_ref()
+        self.server = couchdb.Server(connection_str, session=self._pool)
 
         # Datastore specialization (views)
         self.profile = profile
@@ -77,11 +75,30 @@ class CouchDB_DataStore(DataStore):
         self._io_deserializer   = IonObjectDeserializer(obj_registry=get_obj_registry())
         self._datastore_cache = {}
 
+        # (datastore_name, id) -> (rev, content hash) of recently read and written docs,
+        # to skip updates that do not change the content. Off by default: every head
+        # read then pays for a content hash, and an unchanged doc with a stale _rev is
+        # not checked against CouchDB, so it returns the stale rev instead of Conflict.
+        self._hash_cache_size = CFG.get_safe('container.datastore.noop_update_cache', 0)
+        self._hash_cache = OrderedDict()
+
     def close(self):
         log.info("Closing connection to CouchDB")
+        if self._pool:
+            # Shared pool: idle connections are closed when the last datastore releases it
+            if self._pool_ref:
+                self._pool.release_ref()
+                self._pool_ref = False
+            return
         map(lambda x: map(lambda y: y.close(), x), self.server.resource.session.conns.values())
         self.server.resource.session.conns = {}     # just in case we try to reuse this, for some reason
 
+    def get_pool_stats(self):
+        """
+        Returns wait-queue and request timing statistics of the shared connection pool
+        """
+        return self._pool.get_stats() if self._pool else {}
+
     def _get_datastore(self, datastore_name=None):
         datastore_name = datastore_name or self.datastore_name
 
@@ -220,6 +237,8 @@ class CouchDB_DataStore(DataStore):
         # Update docs.  CouchDB will assign versions to docs.
         db,_ = self._get_datastore()
         res = db.update(docs)
+        if self.view_warmer:
+            self.view_warmer.notify_bulk_write(self, len(docs))
         if not all([success for success, oid, rev in res]):
             errors = ["%s:%s" % (oid, rev) for success, oid, rev in res if not success]
             log.error('create_doc_mult had errors. Successful: %s, Errors: %s' % (len(res) - len(errors), "\n".join(errors)))
@@ -244,6 +263,8 @@ class CouchDB_DataStore(DataStore):
             doc = ds.get(doc_id)
             if doc is None:
                 raise NotFound('Object with id %s does not exist.' % str(doc_id))
+            if self._hash_cache_size:
+                self._put_doc_hash(datastore_name, doc_id, doc['_rev'], content_hash(doc))
         else:
             log.debug('Reading version %s of object %s/%s' ,rev_id, datastore_name, doc_id)
             doc = ds.get(doc_id, rev=rev_id)
@@ -252,24 +273,24 @@ class CouchDB_DataStore(DataStore):
         log.debug('read doc contents: %s', doc)
         return doc
 
-    def read_mult(self, object_ids, datastore_name=""):
+    def read_mult(self, object_ids, datastore_name="", strict=True):
         if any([not isinstance(object_id, str) for object_id in object_ids]):
             raise BadRequest("Object id param is not string")
-        docs = self.read_doc_mult(object_ids, datastore_name)
+        docs = self.read_doc_mult(object_ids, datastore_name, strict)
         # Convert docs into Ion objects
-        obj_list = [self._persistence_dict_to_ion_object(doc) for doc in docs]
+        obj_list = [self._persistence_dict_to_ion_object(doc) if doc is not None else None for doc in docs]
         return obj_list
 
-    def read_doc_mult(self, object_ids, datastore_name=""):
+    def read_doc_mult(self, object_ids, datastore_name="", strict=True):
         ds, datastore_name = self._get_datastore(datastore_name)
         log.info('Reading head version of objects %s/%s' % (datastore_name, object_ids))
         docs = ds.view("_all_docs", keys=object_ids, include_docs=True)
         # Check for docs not found
         notfound_list = ['Object with id %s does not exist.' % str(row.key) for row in docs if row.doc is None]
-        if notfound_list:
+        if notfound_list and strict:
             raise NotFound("\n".join(notfound_list))
 
-        doc_list = [row.doc.copy() for row in docs]
+        doc_list = [row.doc.copy() if row.doc is not None else None for row in docs]
         return doc_list
     
     def update(self, obj, datastore_name=""):
@@ -278,6 +299,12 @@ class CouchDB_DataStore(DataStore):
         return self.update_doc(self._ion_object_to_persistence_dict(obj))
 
     def update_doc(self, doc, datastore_name=""):
+        """
+        Saves doc. If container.datastore.noop_update_cache is set and doc has the same
+        _rev and content as when this datastore last read or wrote it, returns
+        (_id, _rev) without writing. Such a skipped update does not raise Conflict
+        when another writer updated the doc since.
+        """
         ds, datastore_name = self._get_datastore(datastore_name)
         if '_id' not in doc:
             raise BadRequest("Doc must have '_id'")
@@ -285,14 +312,52 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest("Doc must have '_rev'")
 
         log.debug('update doc contents: %s', doc)
+        doc_hash = None
+        if self._hash_cache_size:
+            doc_hash = content_hash(doc)
+            if self._hash_cache.get((datastore_name, doc['_id']), None) == (doc['_rev'], doc_hash):
+                # Same revision and content as last read or written: saves a write and view update
+                log.debug('Update of doc %s skipped, content not modified', doc['_id'])
+                return (doc['_id'], doc['_rev'])
         try:
             res = ds.save(doc)
         except ResourceConflict:
             raise Conflict('Object not based on most current version')
         log.debug('Update result: %s', str(res))
         id, version = res
+        if doc_hash:
+            self._put_doc_hash(datastore_name, id, version, doc_hash)
         return (id, version)
 
+    def _put_doc_hash(self, datastore_name, doc_id, rev, doc_hash):
+        key = (datastore_name, doc_id)
+        self._hash_cache.pop(key, None)
+        self._hash_cache[key] = (rev, doc_hash)
+        if len(self._hash_cache) > self._hash_cache_size:
+            self._hash_cache.popitem(last=False)
+
+    def update_mult(self, objects):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects])
+
+    def update_doc_mult(self, docs):
+        if type(docs) is not list:
+            raise BadRequest("Invalid type for docs:%s" % type(docs))
+        if not all(["_id" in doc and "_rev" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_id' and '_rev'")
+
+        db,_ = self._get_datastore()
+        res = db.update(docs)
+        if self.view_warmer:
+            self.view_warmer.notify_bulk_write(self, len(docs))
+        if not all([success for success, oid, rev in res]):
+            errors = ["%s:%s" % (oid, rev) for success, oid, rev in res if not success]
+            log.error('update_doc_mult had errors. Successful: %s, Errors: %s' % (len(res) - len(errors), "\n".join(errors)))
+        else:
+            log.debug('update_doc_mult result: %s', str(res))
+        return res
+
     def delete(self, obj, datastore_name="", del_associations=False):
         if not isinstance(obj, IonObjectBase) and not isinstance(obj, str):
             raise BadRequest("Obj param is not instance of IonObjectBase or string id")
@@ -320,6 +385,7 @@ class CouchDB_DataStore(DataStore):
             log.warn("XXXXXXX Attempt to delete object %s that still has associations" % doc_id)
 #           raise BadRequest("Object cannot be deleted until associations are broken")
 
+        self._hash_cache.pop((datastore_name, doc_id), None)
         try:
             if type(doc) is str:
                 del ds[doc_id]
@@ -366,6 +432,53 @@ class CouchDB_DataStore(DataStore):
 
     _refresh_views = _update_views
 
+    def warm_views(self, datastore_name=""):
+        """
+        Queries one view per design document (all views of a design share one index),
+        which blocks until CouchDB has brought the index up to date.
+        """
+        ds, datastore_name = self._get_datastore(datastore_name)
+        ds_views = get_couchdb_views(self.profile)
+
+        view_stats = {}
+        for design, viewdef in ds_views.iteritems():
+            if not viewdef:
+                continue
+            start_time = time.time()
+            try:
+                len(ds.view(self._get_viewname(design, sorted(viewdef)[0]), limit=0))
+            except ResourceNotFound:
+                log.debug("View %s/_design/%s not defined", datastore_name, design)
+                continue
+            warm_time = time.time() - start_time
+            for viewname in viewdef:
+                view_stats["%s/%s" % (design, viewname)] = dict(warm_time=warm_time)
+
+        for view_name, lag in self.get_view_lag(datastore_name).iteritems():
+            if view_name in view_stats:
+                view_stats[view_name]['lag'] = lag
+        return view_stats
+
+    def get_view_lag(self, datastore_name=""):
+        """
+        Returns the difference between the datastore update sequence and the sequence
+        indexed by each view, i.e. the number of updates a non-stale query has to index first.
+        """
+        ds, datastore_name = self._get_datastore(datastore_name)
+        ds_views = get_couchdb_views(self.profile)
+
+        db_seq = ds.info()['update_seq']
+        view_lag = {}
+        for design, viewdef in ds_views.iteritems():
+            try:
+                _, _, design_info = ds.resource.get_json("_design/%s/_info" % design)
+            except ResourceNotFound:
+                continue
+            lag = max(db_seq - design_info['view_index']['update_seq'], 0)
+            for viewname in viewdef:
+                view_lag["%s/%s" % (design, viewname)] = lag
+        return view_lag
+
     def _delete_views(self, datastore_name="", profile=None):
         ds, datastore_name = self._get_datastore(datastore_name)
 
@@ -384,6 +497,10 @@ class CouchDB_DataStore(DataStore):
         @see http://wiki.apache.org/couchdb/HTTP_view_API
         """
         view_args = dict((k, v) for k,v in all_args.iteritems() if k in ('descending', 'stale', 'skip', 'inclusive_end', 'update_seq'))
+        # stale=ok: return the current index without updating it;
+        # stale=update_after: same, but trigger an index update after the query
+        if view_args.get('stale', None) not in (None, 'ok', 'update_after'):
+            raise BadRequest("Invalid stale view option: %s" % view_args['stale'])
         limit = int(all_args.get('limit', 0))
         if limit>0:
             view_args['limit'] = limit
@@ -414,8 +531,14 @@ class CouchDB_DataStore(DataStore):
         else:
             return self.read_mult(ids), assocs
 
-
-
+    def _find_associations_by_ids(self, resource_ids, predicate, reverse=False):
+        ds, datastore_name = self._get_datastore()
+        view_name = "by_objpred" if reverse else "by_subpred"
+        keys = [[res_id, predicate] for res_id in resource_ids]
+        rows = ds.view(self._get_viewname("association", view_name), keys=keys)
+        assocs = [self._persistence_dict_to_ion_object(row.value) for row in rows]
+        log.debug("_find_associations_by_ids() found %s associations for %s ids", len(assocs), len(resource_ids))
+        return assocs
 
     def find_objects(self, subject, predicate=None, object_type=None, id_only=False, **kwargs):
         log.debug("find_objects(subject=%s, predicate=%s, object_type=%s, id_only=%s" ,subject, predicate, object_type, id_only)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""Shared, bounded HTTP connection pool for CouchDB datastores"""
+
+__license__ = 'Apache 2.0'
+
+import threading
+import time
+
+import gevent
+from gevent import coros
+from couchdb.http import Session
+
+from pyon.core.bootstrap import CFG
+from pyon.core.exception import Timeout
+from pyon.datastore.instrumentation import add_payload_bytes
+from pyon.util.log import log
+
+
+class PooledSession(Session):
+    """
+    couchdb-python HTTP session with a bounded number of keep-alive connections per server.
+    Greenlets requesting a connection while all are in use wait in a queue until one is
+    returned. Keeps wait-queue and per-request timing statistics.
+    """
+
+    def __init__(self, max_connections=20, wait_timeout=None, slow_request=None, **kwargs):
+        Session.__init__(self, **kwargs)
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self.slow_request = slow_request
+        self._slots = coros.Semaphore(max_connections)
+        self._active = set()        # Connections checked out of the pool
+        self._checkout = {}         # greenlet -> list of connections checked out by it
+        self._refs = 0
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats = dict(waiting=0, waiting_max=0, waits=0, wait_time=0.0, wait_time_max=0.0,
+                           connections_opened=0, requests={})
+
+    def get_stats(self):
+        """
+        Returns a dict with the pool state, wait-queue metrics and per HTTP method request
+        timing (count, errors, time_avg, time_max in seconds).
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['requests'] = dict((method, dict(mstats)) for method, mstats in self._stats['requests'].iteritems())
+        stats['max_connections'] = self.max_connections
+        stats['active'] = len(self._active)
+        stats['idle'] = sum(len(conns) for conns in self.conns.values())
+        stats['wait_time_avg'] = stats['wait_time'] / stats['waits'] if stats['waits'] else 0.0
+        for mstats in stats['requests'].itervalues():
+            mstats['time_avg'] = mstats['time'] / mstats['count'] if mstats['count'] else 0.0
+        return stats
+
+    def add_ref(self):
+        self._refs += 1
+
+    def release_ref(self):
+        """
+        Releases one user of the pool. When the last user is gone, idle connections are closed.
+        The pool remains usable and reopens connections on demand.
+        """
+        self._refs = max(self._refs - 1, 0)
+        if not self._refs:
+            self.close_idle()
+
+    def close_idle(self):
+        self.lock.acquire()
+        try:
+            conns, self.conns = self.conns, {}
+        finally:
+            self.lock.release()
+        for conn_list in conns.values():
+            for conn in conn_list:
+                conn.close()
+
+    def request(self, method, url, body=None, headers=None, credentials=None, num_redirects=0):
+        greenlet = gevent.getcurrent()
+        checkout = self._checkout.setdefault(greenlet, [])
+        num_checkout = len(checkout)
+        start_time = time.time()
+        failed = False
+        try:
+            status, resp_headers, data = Session.request(self, method, url, body=body, headers=headers,
+                                                         credentials=credentials, num_redirects=num_redirects)
+            # Attribute the payload size to the instrumented datastore call, if any
+            add_payload_bytes((len(body) if isinstance(body, basestring) else 0) +
+                              int(resp_headers.get('content-length', None) or 0))
+            return status, resp_headers, data
+        except Exception:
+            failed = True
+            # Connections taken by this request and not returned would leak their pool slot
+            for conn in checkout[num_checkout:]:
+                if conn in self._active:
+                    conn.close()
+                    self._release_connection(conn)
+            raise
+        finally:
+            del checkout[num_checkout:]
+            if not checkout:
+                self._checkout.pop(greenlet, None)
+            self._add_request_stats(method, url, time.time() - start_time, failed)
+
+    def _get_connection(self, url):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._stats['waiting'] += 1
+                self._stats['waiting_max'] = max(self._stats['waiting_max'], self._stats['waiting'])
+            start_time = time.time()
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                wait_time = time.time() - start_time
+                with self._stats_lock:
+                    self._stats['waiting'] -= 1
+                    self._stats['waits'] += 1
+                    self._stats['wait_time'] += wait_time
+                    self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            if not acquired:
+                raise Timeout("No CouchDB connection available after %s sec (max_connections=%s)" % (
+                    self.wait_timeout, self.max_connections))
+
+        try:
+            num_idle = sum(len(conns) for conns in self.conns.values())
+            conn = Session._get_connection(self, url)
+            if sum(len(conns) for conns in self.conns.values()) == num_idle:
+                with self._stats_lock:
+                    self._stats['connections_opened'] += 1
+        except Exception:
+            self._slots.release()
+            raise
+        self._active.add(conn)
+        self._checkout.setdefault(gevent.getcurrent(), []).append(conn)
+        return conn
+
+    def _return_connection(self, url, conn):
+        if conn not in self._active:
+            return
+        Session._return_connection(self, url, conn)
+        self._release_connection(conn)
+
+    def _release_connection(self, conn):
+        self._active.discard(conn)
+        self._slots.release()
+
+    def _add_request_stats(self, method, url, req_time, failed):
+        with self._stats_lock:
+            mstats = self._stats['requests'].setdefault(method, dict(count=0, errors=0, time=0.0, time_max=0.0))
+            mstats['count'] += 1
+            mstats['time'] += req_time
+            mstats['time_max'] = max(mstats['time_max'], req_time)
+            if failed:
+                mstats['errors'] += 1
+        if self.slow_request and req_time * 1000 > self.slow_request:
+            log.info("Slow CouchDB request: %s %s took %.1f ms", method, url.split('?', 1)[0], req_time * 1000)
+
+
+# Pools shared by all CouchDB datastores in the container, keyed by server URL
+_session_pools = {}
+
+def get_session_pool(server_url):
+    """
+    Returns the shared connection pool for given CouchDB server URL, or None if pooling is
+    disabled. Configuration in server.couchdb.pool: enabled, max_connections, wait_timeout
+    (sec, None waits forever), timeout (socket timeout, sec), slow_request (ms, logs slower requests)
+    """
+    pool_cfg = CFG.get_safe('server.couchdb.pool', None) or {}
+    if not pool_cfg.get('enabled', True):
+        return None
+    pool = _session_pools.get(server_url, None)
+    if pool is None:
+        pool = PooledSession(max_connections=int(pool_cfg.get('max_connections', 20)),
+                             wait_timeout=pool_cfg.get('wait_timeout', None),
+                             slow_request=pool_cfg.get('slow_request', None),
+                             timeout=pool_cfg.get('timeout', None))
+        _session_pools[server_url] = pool
+    return pool
+
+def get_pool_stats():
+    """
+    Returns connection pool statistics for all CouchDB servers, keyed by host:port
+    """
+    return dict((server_url.rsplit('@', 1)[-1], pool.get_stats()) for server_url, pool in _session_pools.iteritems())
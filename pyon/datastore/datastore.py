@@ -3,7 +3,12 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
-from pyon.core.bootstrap import get_sys_name
+import simplejson
+import time
+import yaml
+from uuid import uuid4
+
+from pyon.core.bootstrap import get_sys_name, CFG
 from pyon.core.exception import BadRequest, NotFound
 from pyon.ion.resource import AT
 from pyon.util.containers import DotDict, get_ion_ts, get_safe
@@ -20,6 +25,9 @@ class DataStore(object):
     DS_PROFILE_LIST = ['OBJECTS','RESOURCES','DIRECTORY','STATE','EVENTS','EXAMPLES','SCIDATA','BASIC']
     DS_PROFILE = DotDict(zip(DS_PROFILE_LIST, DS_PROFILE_LIST))
 
+    # Set by the DatastoreManager; notified of bulk writes
+    view_warmer = None
+
     def close(self):
         """
         Close any connections required for this datastore.
@@ -116,18 +124,30 @@ class DataStore(object):
         """
         pass
 
-    def read_mult(self, object_ids, datastore_name=""):
+    def read_mult(self, object_ids, datastore_name="", strict=True):
         """"
-        Fetch multiple Ion object instances, HEAD rev.
+        Fetch multiple Ion object instances, HEAD rev. If strict is False,
+        missing objects are returned as None instead of raising NotFound.
         """
         pass
 
-    def read_doc_mult(self, object_ids, datastore_name=""):
+    def read_doc_mult(self, object_ids, datastore_name="", strict=True):
         """"
-        Fetch a raw doc instances, HEAD rev.
+        Fetch a raw doc instances, HEAD rev. If strict is False,
+        missing docs are returned as None instead of raising NotFound.
         """
         pass
 
+    def read_mult_existing(self, object_ids):
+        """
+        Returns dict of object id to object for all given ids that exist,
+        read with one bulk read.
+        """
+        if not object_ids:
+            return {}
+        return dict((object_id, obj) for object_id, obj in zip(object_ids, self.read_mult(object_ids, strict=False))
+                    if obj is not None)
+
     def update(self, obj, datastore_name=""):
         """
         Update an existing Ion object in the data store.  The '_rev' value
@@ -144,6 +164,20 @@ class DataStore(object):
         """
         pass
 
+    def update_mult(self, objects):
+        """
+        Update more than one existing Ion object.
+        """
+        pass
+
+    def update_doc_mult(self, docs):
+        """
+        Update multiple existing raw docs. Each doc must have the most recent
+        '_rev'; docs that conflict are not updated.
+        Returns list of (Success, Oid, rev or error)
+        """
+        pass
+
     def delete(self, obj, datastore_name=""):
         """
         Remove all versions of specified Ion object from the data store.
@@ -195,31 +229,7 @@ class DataStore(object):
             raise BadRequest("Unsupported assoc_type: %s" % assoc_type)
 
         # Check that subject and object type are permitted by association definition
-        # Note: Need import here, so that import orders are not screwed up
-        from pyon.core.registry import getextends
-        from pyon.ion.resource import Predicates
-        from pyon.core.bootstrap import IonObject
-
-        try:
-            pt = Predicates.get(predicate)
-        except AttributeError:
-            raise BadRequest("Predicate unknown %s" % predicate)
-        if not st in pt['domain']:
-            found_st = False
-            for domt in pt['domain']:
-                if st in getextends(domt):
-                    found_st = True
-                    break
-            if not found_st:
-                raise BadRequest("Illegal subject type %s for predicate %s" % (st, predicate))
-        if not ot in pt['range']:
-            found_ot = False
-            for rant in pt['range']:
-                if ot in getextends(rant):
-                    found_ot = True
-                    break
-            if not found_ot:
-                raise BadRequest("Illegal object type %s for predicate %s" % (ot, predicate))
+        self._check_association_types(st, predicate, ot)
 
         # Finally, ensure this isn't a duplicate
         assoc_list = self.find_associations(subject, predicate, obj, assoc_type, False)
@@ -231,6 +241,9 @@ class DataStore(object):
                 if subject._rev == assoc.srv and object._rev == assoc.orv:
                     raise BadRequest("Association between %s and %s with predicate %s and type %s already exists" % (subject, obj, predicate, assoc_type))
 
+        # Note: Need import here, so that import orders are not screwed up
+        from pyon.core.bootstrap import IonObject
+
         assoc = IonObject("Association",
                           at=assoc_type,
                           s=subject_id, st=st, srv=subject._rev,
@@ -239,6 +252,113 @@ class DataStore(object):
                           ts=get_ion_ts())
         return self.create(assoc)
 
+    def _check_association_types(self, st, predicate, ot):
+        """
+        Raises BadRequest if subject type st or object type ot are not permitted by the
+        domain or range of the association predicate.
+        """
+        # Note: Need import here, so that import orders are not screwed up
+        from pyon.core.registry import issubtype
+        from pyon.ion.resource import Predicates
+
+        try:
+            pt = Predicates.get(predicate)
+        except AttributeError:
+            raise BadRequest("Predicate unknown %s" % predicate)
+        if not st in pt['domain'] and not any(issubtype(st, domt) for domt in pt['domain']):
+            raise BadRequest("Illegal subject type %s for predicate %s" % (st, predicate))
+        if not ot in pt['range'] and not any(issubtype(ot, rant) for rant in pt['range']):
+            raise BadRequest("Illegal object type %s for predicate %s" % (ot, predicate))
+
+    def create_association_mult(self, assoc_list):
+        """
+        Creates many associations with a minimal number of datastore calls: one read_mult
+        for all subjects and objects given by id, one batched view query for the duplicate
+        check and one bulk create. Entries in assoc_list are tuples (subject, predicate, obj)
+        or (subject, predicate, obj, assoc_type), with subject/obj as in create_association.
+        @retval list with one tuple per entry, in order: (True, assoc_id, assoc_rev) if created,
+                (False, None, exception) with the exception create_association would raise otherwise
+        """
+        if type(assoc_list) is not list:
+            raise BadRequest("assoc_list must be a list")
+        results = [None] * len(assoc_list)
+
+        # Resolve all subjects and objects given by id with one read
+        read_ids = set()
+        for entry in assoc_list:
+            if type(entry) in (list, tuple) and len(entry) in (3, 4):
+                read_ids.update(res for res in (entry[0], entry[2]) if type(res) is str and res)
+        read_objs = self.read_mult_existing(list(read_ids))
+
+        from pyon.core.bootstrap import IonObject
+
+        checked_types = {}
+        candidates = []
+        for i, entry in enumerate(assoc_list):
+            try:
+                if type(entry) not in (list, tuple) or len(entry) not in (3, 4):
+                    raise BadRequest("Association entry must be a tuple (subject, predicate, obj[, assoc_type])")
+                subject, predicate, obj = entry[:3]
+                assoc_type = (entry[3] if len(entry) == 4 else None) or AT.H2H
+                if not subject or not predicate or not obj:
+                    raise BadRequest("Association must have all elements set")
+                subject = self._resolve_association_end(subject, read_objs, "Subject")
+                obj = self._resolve_association_end(obj, read_objs, "Object")
+                if not assoc_type in AT:
+                    raise BadRequest("Unsupported assoc_type: %s" % assoc_type)
+
+                st, ot = type(subject).__name__, type(obj).__name__
+                if (st, predicate, ot) not in checked_types:
+                    try:
+                        self._check_association_types(st, predicate, ot)
+                        checked_types[(st, predicate, ot)] = None
+                    except BadRequest as ex:
+                        checked_types[(st, predicate, ot)] = ex
+                if checked_types[(st, predicate, ot)]:
+                    raise checked_types[(st, predicate, ot)]
+
+                assoc = IonObject("Association",
+                                  at=assoc_type,
+                                  s=subject._id, st=st, srv=subject._rev,
+                                  p=predicate,
+                                  o=obj._id, ot=ot, orv=obj._rev,
+                                  ts=get_ion_ts())
+                candidates.append((i, assoc))
+            except (BadRequest, NotFound) as ex:
+                results[i] = (False, None, ex)
+
+        # Duplicate check against existing associations and within this batch
+        existing = {}
+        if candidates:
+            keys = [list(k) for k in set((assoc.s, assoc.p) for i, assoc in candidates)]
+            for row in self.find_by_view("association", "by_subpred", keys=keys, id_only=False):
+                existing.setdefault((row[2].s, row[2].p, row[2].o, row[2].at), []).append(row[2])
+        new_assocs = []
+        for i, assoc in candidates:
+            dup_key = (assoc.s, assoc.p, assoc.o, assoc.at)
+            if any(assoc.at == AT.H2H or (assoc.srv == dup.srv and assoc.orv == dup.orv) for dup in existing.get(dup_key, [])):
+                results[i] = (False, None, BadRequest("Association between %s and %s with predicate %s and type %s already exists" % (
+                    assoc.s, assoc.o, assoc.p, assoc.at)))
+            else:
+                existing.setdefault(dup_key, []).append(assoc)
+                new_assocs.append((i, assoc))
+
+        if new_assocs:
+            create_res = self.create_mult([assoc for i, assoc in new_assocs])
+            for (i, assoc), (success, assoc_id, assoc_rev) in zip(new_assocs, create_res):
+                results[i] = (True, assoc_id, assoc_rev) if success else (False, None, BadRequest("Association create failed: %s" % assoc_rev))
+
+        return results
+
+    def _resolve_association_end(self, res, read_objs, role):
+        if type(res) is str:
+            if res not in read_objs:
+                raise NotFound("Object with id %s does not exist." % res)
+            return read_objs[res]
+        if "_id" not in res or "_rev" not in res:
+            raise BadRequest("%s id or rev not available" % role)
+        return res
+
     def delete_association(self, association=''):
         """
         Delete an association between two IonObjects
@@ -273,6 +393,85 @@ class DataStore(object):
         """
         pass
 
+    def traverse(self, start, path, reverse=False, id_only=False):
+        """
+        Walks the association graph breadth-first, starting at the given resource id (or list of
+        resource ids) and following the given path of predicates. Each path entry is either a
+        predicate or a tuple (predicate, restype) that narrows the resources reached in this hop
+        to the given type. With reverse == True, associations are followed from object to subject.
+        Performs one batched association query per hop instead of one query per resource.
+        Returns a tuple (list_of_objects, list_of_assoc_lists) if id_only == False, or
+        (list_of_object_ids, list_of_assoc_lists) if id_only == True. The objects are the ones
+        reached after the last hop; list_of_assoc_lists contains the associations per hop.
+        """
+        if not start:
+            raise BadRequest("Must provide start")
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if not path:
+            raise BadRequest("Must provide path")
+
+        level_ids = [start] if isinstance(start, basestring) else list(start)
+        level_assocs = []
+        for hop in path:
+            if isinstance(hop, (list, tuple)):
+                predicate, restype = hop
+            else:
+                predicate, restype = hop, None
+            if not predicate:
+                raise BadRequest("Path entry must provide predicate")
+
+            if not level_ids:
+                level_assocs.append([])
+                continue
+
+            assocs = self._find_associations_by_ids(level_ids, predicate, reverse)
+            if restype:
+                assocs = [assoc for assoc in assocs if (assoc.st if reverse else assoc.ot) == restype]
+
+            next_ids, seen_ids = [], set()
+            for assoc in assocs:
+                target_id = assoc.s if reverse else assoc.o
+                if target_id not in seen_ids:
+                    seen_ids.add(target_id)
+                    next_ids.append(target_id)
+
+            level_assocs.append(assocs)
+            level_ids = next_ids
+
+        log.debug("traverse() found %s objects in %s hops", len(level_ids), len(path))
+        if id_only or not level_ids:
+            return (level_ids, level_assocs)
+
+        return (self.read_mult(level_ids), level_assocs)
+
+    def find_res_by_subtypes(self, restype, id_only=False):
+        """
+        Returns resources of the given type and of all types extending it, using one
+        query with the expanded list of types (see registry.getsubtypes).
+        @retval tuple (list of resource objects or ids, list of dicts with type and id)
+        """
+        from pyon.core.registry import getsubtypes
+        if not restype:
+            raise BadRequest("Must provide restype")
+        try:
+            restypes = sorted(getsubtypes(restype))
+        except KeyError:
+            raise BadRequest("Unknown resource type: %s" % restype)
+        rows = self.find_by_view("resource", "by_restype", keys=[[rt] for rt in restypes], id_only=id_only)
+        res_assocs = [dict(type=row_key[0], id=res_id) for res_id, row_key, res_obj in rows]
+        if id_only:
+            return ([res_id for res_id, row_key, res_obj in rows], res_assocs)
+        return ([res_obj for res_id, row_key, res_obj in rows], res_assocs)
+
+    def _find_associations_by_ids(self, resource_ids, predicate, reverse=False):
+        """
+        Returns the list of associations with given predicate that have any of the given
+        resource ids as subject (or as object if reverse == True). Back-ends should perform
+        this with a single batched query.
+        """
+        pass
+
     def find_resources(self, restype="", lcstate="", name="", id_only=True):
         if name:
             if lcstate:
@@ -293,6 +492,170 @@ class DataStore(object):
         """
         pass
 
+    def bulk_preload(self, docs, batch_size=1000, concurrency=4, build_views=True):
+        """
+        Bulk preload mode: writes a stream of documents and associations (dicts or IonObjects,
+        e.g. from iter_preload_file) in batches of batch_size docs, with up to concurrency
+        batch writes in flight, and builds the views once at the end. Docs without _id get
+        a new id; docs whose id exists already are reported as errors.
+        @retval dict with num_docs, num_errors, errors (up to 100), write_time, view_time, docs_per_sec
+        """
+        from gevent.pool import Pool
+        from pyon.core.object import IonObjectBase
+        stats = dict(num_docs=0, num_errors=0, errors=[], write_time=0.0, view_time=0.0, docs_per_sec=0.0)
+
+        def write_batch(batch):
+            object_ids = [doc.pop("_id") for doc in batch]
+            try:
+                res = self.create_doc_mult(batch, object_ids)
+            except Exception as ex:
+                res = [(False, oid, str(ex)) for oid in object_ids]
+            errors = ["%s:%s" % (oid, rev) for success, oid, rev in res if not success]
+            stats['num_docs'] += len(res)
+            stats['num_errors'] += len(errors)
+            stats['errors'].extend(errors[:100 - len(stats['errors'])])
+
+        # Bulk writes would trigger view updates while loading
+        view_warmer, self.view_warmer = self.view_warmer, None
+        pool = Pool(concurrency)
+        start_time = time.time()
+        try:
+            batch = []
+            for doc in docs:
+                if isinstance(doc, IonObjectBase):
+                    doc = self._ion_object_to_persistence_dict(doc)
+                else:
+                    doc = dict(doc)
+                doc.pop("_rev", None)
+                doc["_id"] = str(doc.get("_id", None) or uuid4().hex)
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    pool.spawn(write_batch, batch)      # Blocks while concurrency writes are in flight
+                    batch = []
+            if batch:
+                pool.spawn(write_batch, batch)
+            pool.join()
+        finally:
+            self.view_warmer = view_warmer
+        stats['write_time'] = time.time() - start_time
+
+        if build_views:
+            start_time = time.time()
+            self.warm_views()
+            stats['view_time'] = time.time() - start_time
+        total_time = stats['write_time'] + stats['view_time']
+        stats['docs_per_sec'] = stats['num_docs'] / total_time if total_time else 0.0
+        log.info("bulk_preload() wrote %s docs (%s errors) in %.2f sec, views %.2f sec: %.0f docs/sec",
+                 stats['num_docs'], stats['num_errors'], stats['write_time'], stats['view_time'], stats['docs_per_sec'])
+        return stats
+
+    def warm_views(self, datastore_name=""):
+        """
+        Brings the indexes of all views of the datastore's profile up to date.
+        Back-ends that maintain their indexes on write do nothing here.
+        @retval dict of view name to dict with warm_time (sec) and lag
+        """
+        return {}
+
+    def get_view_lag(self, datastore_name=""):
+        """
+        Returns the index lag per view, as number of datastore updates not yet indexed
+        """
+        return {}
+
+
+def iter_preload_file(filename):
+    """
+    Generator for bulk_preload returning the docs from a YAML file (documents containing a
+    doc or a list of docs) or a JSON lines file (one doc per line; blank and # lines skipped).
+    Associations are docs with type_ Association.
+    """
+    with open(filename, "r") as f:
+        if filename.endswith((".yml", ".yaml")):
+            for entry in yaml.safe_load_all(f):
+                if type(entry) is list:
+                    for doc in entry:
+                        yield doc
+                elif entry:
+                    yield entry
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield simplejson.loads(line)
+
+
+class ViewWarmer(object):
+    """
+    Background service that touches all views of datastores after startup and after
+    large bulk writes, so that queries do not block on view index rebuilds.
+    Requests for the same datastore arriving within delay seconds are coalesced.
+    """
+    def __init__(self, bulk_threshold=1000, delay=2.0):
+        self.bulk_threshold = bulk_threshold
+        self.delay = delay
+        self._queue = None
+        self._scheduled = set()
+        self._warm_gl = None
+        self._view_stats = {}
+
+    def start(self):
+        if self._warm_gl:
+            return
+        from gevent.queue import Queue
+        from pyon.util.async import spawn
+        self._queue = Queue()
+        self._warm_gl = spawn(self._run)
+
+    def stop(self):
+        if self._warm_gl:
+            self._warm_gl.kill()
+            self._warm_gl = None
+        self._scheduled.clear()
+
+    def schedule(self, datastore):
+        """
+        Requests a warm-up of all views of the given datastore instance
+        """
+        if not self._warm_gl or datastore.datastore_name in self._scheduled:
+            return
+        self._scheduled.add(datastore.datastore_name)
+        self._queue.put(datastore)
+
+    def notify_bulk_write(self, datastore, num_docs):
+        if num_docs >= self.bulk_threshold:
+            self.schedule(datastore)
+
+    def get_stats(self):
+        """
+        Returns the result of the last warm-up per datastore: for each view warm_time (sec),
+        lag (updates not yet indexed after the warm-up) and ts of the warm-up
+        """
+        return dict((ds_name, dict(views)) for ds_name, views in self._view_stats.iteritems())
+
+    def _run(self):
+        import gevent
+        while True:
+            datastore = self._queue.get()
+            gevent.sleep(self.delay)
+            self._scheduled.discard(datastore.datastore_name)
+            self.warm(datastore)
+
+    def warm(self, datastore):
+        try:
+            view_stats = datastore.warm_views()
+        except Exception as ex:
+            log.warn("View warm-up of datastore %s failed: %s", datastore.datastore_name, ex)
+            return
+        ts = get_ion_ts()
+        for vstats in view_stats.itervalues():
+            vstats['ts'] = ts
+        if view_stats:
+            self._view_stats[datastore.datastore_name] = view_stats
+            log.debug("View warm-up of datastore %s: %s views, %.2f sec", datastore.datastore_name,
+                      len(view_stats), sum(vstats['warm_time'] for vstats in view_stats.itervalues()))
+
+
 class DatastoreManager(object):
     """
     Container manager for datastore instances.
@@ -301,6 +664,18 @@ class DatastoreManager(object):
     def __init__(self):
         self._datastores = {}
 
+        # Datastore call statistics; if disabled, datastores are used without proxy
+        self.ds_stats = None
+        if CFG.get_safe('container.datastore.instrumentation.enabled', False):
+            from pyon.datastore.instrumentation import DatastoreStats
+            self.ds_stats = DatastoreStats()
+
+        warmer_cfg = CFG.get_safe('container.datastore.view_warmer', None) or {}
+        self.view_warmer = None
+        if warmer_cfg.get('enabled', True):
+            self.view_warmer = ViewWarmer(bulk_threshold=int(warmer_cfg.get('bulk_threshold', 1000)),
+                                          delay=float(warmer_cfg.get('delay', 2.0)))
+
     @classmethod
     def get_scoped_name(cls, ds_name):
         return ("%s_%s" % (get_sys_name(), ds_name)).lower()
@@ -323,6 +698,9 @@ class DatastoreManager(object):
         # Create a datastore instance
         log.info("get_datastore(): Create instance of store '%s' as database=%s" % (ds_name, scoped_name))
         new_ds = DatastoreManager.get_datastore_instance(ds_name, profile)
+        if self.ds_stats:
+            from pyon.datastore.instrumentation import InstrumentedDataStore
+            new_ds = InstrumentedDataStore(new_ds, ds_name, self.ds_stats)
 
         # Create store if not existing
         if not new_ds.datastore_exists(scoped_name):
@@ -336,6 +714,11 @@ class DatastoreManager(object):
         new_ds.local_name = ds_name
         new_ds.ds_profile = profile
 
+        # Build view indexes in the background, instead of on first query
+        if self.view_warmer:
+            new_ds.view_warmer = self.view_warmer
+            self.view_warmer.schedule(new_ds)
+
         self._datastores[ds_name] = new_ds
 
         return new_ds
@@ -345,11 +728,25 @@ class DatastoreManager(object):
         scoped_name = DatastoreManager.get_scoped_name(ds_name)
 
         # Use inline import to prevent circular import dependency
-        from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
-        new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile)
+        server_type = CFG.get_safe('container.datastore.server_type', 'couchdb')
+        if server_type == 'couchdb':
+            from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+            new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile)
+        elif server_type == 'sqlite':
+            from pyon.datastore.sqlite.sqlite_datastore import SQLite_DataStore
+            new_ds = SQLite_DataStore(datastore_name=scoped_name, profile=profile)
+        else:
+            raise BadRequest("Unknown datastore server type: %s" % server_type)
 
         return new_ds
 
+    def get_stats(self):
+        """
+        Returns datastore call statistics per datastore and method (see DatastoreStats),
+        or None if instrumentation is disabled (container.datastore.instrumentation.enabled)
+        """
+        return self.ds_stats.get_stats() if self.ds_stats else None
+
     @classmethod
     def exists(cls, ds_name, scoped=True, config=None):
         if scoped:
@@ -358,10 +755,15 @@ class DatastoreManager(object):
         return generic_ds.datastore_exists(ds_name)
 
     def start(self):
-        pass
+        if self.view_warmer:
+            self.view_warmer.start()
+            for ds in self._datastores.itervalues():
+                self.view_warmer.schedule(ds)
 
     def stop(self):
         log.debug("DatastoreManager.stop() [%d datastores]", len(self._datastores))
+        if self.view_warmer:
+            self.view_warmer.stop()
         for x in self._datastores.itervalues():
             try:
                 x.close()
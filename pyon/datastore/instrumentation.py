@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""Instrumentation of DataStore calls: counts, latency histograms, doc counts and payload bytes"""
+
+__license__ = 'Apache 2.0'
+
+import time
+from bisect import bisect_left
+
+from gevent import getcurrent
+
+
+# Upper bounds (msec) of the latency histogram buckets; the last bucket counts slower calls
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# greenlet -> stack of payload byte counters of the instrumented calls in progress
+_active_calls = {}
+
+def add_payload_bytes(num_bytes):
+    """
+    Adds to the payload bytes of the instrumented datastore call in progress in the current
+    greenlet, if any. Called by back-ends that know the size of what goes over the wire.
+    """
+    if _active_calls:
+        stack = _active_calls.get(getcurrent(), None)
+        if stack:
+            stack[-1][0] += num_bytes
+
+
+class DatastoreStats(object):
+    """
+    Collects statistics of datastore calls per datastore and method
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._stats = {}
+
+    def add(self, ds_name, method, call_time, num_docs, num_bytes, failed):
+        entry = self._stats.get((ds_name, method), None)
+        if entry is None:
+            entry = dict(count=0, errors=0, time=0.0, time_max=0.0, docs=0, bytes=0,
+                         histogram=[0] * (len(HISTOGRAM_BOUNDS) + 1))
+            self._stats[(ds_name, method)] = entry
+        entry['count'] += 1
+        entry['time'] += call_time
+        if call_time > entry['time_max']:
+            entry['time_max'] = call_time
+        entry['docs'] += num_docs
+        entry['bytes'] += num_bytes
+        entry['histogram'][bisect_left(HISTOGRAM_BOUNDS, call_time * 1000)] += 1
+        if failed:
+            entry['errors'] += 1
+
+    def get_stats(self):
+        """
+        Returns a dict datastore name -> method -> dict with count, errors, time, time_avg,
+        time_max (sec), docs, bytes and histogram (call counts per HISTOGRAM_BOUNDS bucket)
+        """
+        stats = {}
+        for (ds_name, method), entry in self._stats.items():
+            mstats = dict(entry, histogram=list(entry['histogram']), time_avg=entry['time'] / entry['count'])
+            stats.setdefault(ds_name, {})[method] = mstats
+        return stats
+
+    def get_totals(self):
+        """
+        Returns a dict with count, errors, time, docs and bytes summed over all calls
+        """
+        totals = dict(count=0, errors=0, time=0.0, docs=0, bytes=0)
+        for entry in self._stats.values():
+            for key in totals:
+                totals[key] += entry[key]
+        return totals
+
+    @staticmethod
+    def get_percentile(histogram, percentile):
+        """
+        Returns the upper bound (msec) of the histogram bucket containing the given percentile,
+        or None if it is in the overflow bucket
+        """
+        threshold = sum(histogram) * percentile / 100.0
+        num_calls = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS, histogram):
+            num_calls += count
+            if num_calls >= threshold:
+                return bound
+        return None
+
+
+class InstrumentedDataStore(object):
+    """
+    Proxy for a DataStore instance that records statistics of all public method calls.
+    Calls within the datastore (e.g. create_mult calling create_doc_mult) are not counted
+    separately. Attribute access and assignment go to the datastore instance.
+    """
+    def __init__(self, datastore, ds_name, ds_stats):
+        object.__setattr__(self, '_datastore', datastore)
+        object.__setattr__(self, '_ds_name', ds_name)
+        object.__setattr__(self, '_ds_stats', ds_stats)
+
+    def __getattr__(self, name):
+        attr = getattr(self._datastore, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        wrapper = self._wrap(name, attr)
+        # Cache the wrapper, so that further calls do not go through __getattr__
+        object.__setattr__(self, name, wrapper)
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._datastore, name, value)
+
+    def __repr__(self):
+        return "InstrumentedDataStore(%r)" % self._datastore
+
+    def _wrap(self, name, method):
+        ds_name, ds_stats = self._ds_name, self._ds_stats
+
+        def instrumented_call(*args, **kwargs):
+            greenlet = getcurrent()
+            stack = _active_calls.setdefault(greenlet, [])
+            payload = [0]
+            stack.append(payload)
+            start_time = time.time()
+            res, failed = None, True
+            try:
+                res = method(*args, **kwargs)
+                failed = False
+                return res
+            finally:
+                stack.pop()
+                if not stack:
+                    _active_calls.pop(greenlet, None)
+                ds_stats.add(ds_name, name, time.time() - start_time,
+                             0 if failed else _count_docs(args, res), payload[0], failed)
+
+        instrumented_call.__name__ = name
+        instrumented_call.__doc__ = method.__doc__
+        return instrumented_call
+
+
+def _count_docs(args, res):
+    """
+    Returns the number of docs a call handled: the length of the result list (e.g. read_mult,
+    find_by_view, create_doc_mult) or of the first list in a result tuple (e.g. find_objects),
+    else the length of a list argument, else 1
+    """
+    if type(res) is list:
+        return len(res)
+    if type(res) is tuple and res and type(res[0]) is list:
+        return len(res[0])
+    if args and type(args[0]) in (list, tuple):
+        return len(args[0])
+    return 1
@@ -12,16 +12,134 @@ from pyon.datastore.datastore import DataStore
 from pyon.ion.resource import CommonResourceLifeCycleSM
 from pyon.util.log import log
 
+# Token for non-inclusive key range upper bounds, same as in CouchDB_DataStore
+END_MARKER = "ZZZZZZ"
+
+def _collation_key(value):
+    """
+    Returns a sort key for a view key that approximates CouchDB view collation:
+    null < booleans < numbers < strings (lower case first) < arrays < objects
+    """
+    if value is None:
+        return (0,)
+    elif type(value) is bool:
+        return (1, value)
+    elif isinstance(value, (int, long, float)):
+        return (2, value)
+    elif isinstance(value, basestring):
+        return (3, value.lower(), value.swapcase())
+    elif isinstance(value, (list, tuple)):
+        return (4, [_collation_key(v) for v in value])
+    return (5, sorted((k, _collation_key(v)) for k, v in value.iteritems()))
+
+def _assoc_keys(attr):
+    return lambda doc: [doc[attr]] if doc.get('type_') == "Association" else []
+
+def _direntry_keys(attr):
+    return lambda doc: [doc[attr]] if doc.get('type_') == "DirEntry" else []
+
+def _event_keys(attr):
+    return lambda doc: [doc.get(attr)] if doc.get('origin') else []
+
+# Secondary hash indexes maintained on the HEAD version of each doc.
+# Index name -> function returning the list of index keys of a doc
+MOCKDB_INDEXES = {
+    'type':         lambda doc: [doc['type_']] if 'type_' in doc else [],
+    'lcstate':      lambda doc: [doc['lcstate']] if 'lcstate' in doc else [],
+    'name':         lambda doc: [doc['name']] if 'name' in doc else [],
+    'assoc_s':      _assoc_keys('s'),
+    'assoc_o':      _assoc_keys('o'),
+    'assoc_p':      _assoc_keys('p'),
+    'dir_parent':   _direntry_keys('parent'),
+    'dir_key':      _direntry_keys('key'),
+    'event_origin': _event_keys('origin'),
+    'event_type':   _event_keys('type_'),
+    'event_time':   _event_keys('ts_created'),
+    'event_origin_type': _event_keys('origin_type'),
+}
+
+def _map_lcstate(doc):
+    if doc.get('type_') and doc['type_'] != "Association":
+        lcstate = doc.get('lcstate')
+        yield [0, lcstate, doc['type_'], doc.get('name')], None
+        if lcstate:
+            if not lcstate.startswith("DRAFT") and lcstate != "RETIRED":
+                yield [1, "REGISTERED", doc['type_'], lcstate, doc.get('name')], None
+            comps = lcstate.split("_")
+            if len(comps) == 2:
+                yield [1, comps[0], doc['type_'], lcstate, doc.get('name')], None
+                yield [1, comps[1], doc['type_'], lcstate, doc.get('name')], None
+
+def _map_dir_path(doc):
+    if doc.get('type_') == "DirEntry":
+        levels = doc['parent'].split('/')
+        if doc['parent'] == "":
+            levels.pop()
+        levels.append(doc['key'])
+        yield levels, doc
+
+def _map_dir_attribute(doc):
+    if doc.get('type_') == "DirEntry":
+        for attr, value in (doc.get('attributes') or {}).iteritems():
+            yield [attr, value, doc['parent']], doc
+
+def _map_if(cond, key_fn, value_fn=lambda doc: doc):
+    def map_fn(doc):
+        if cond(doc):
+            yield key_fn(doc), value_fn(doc)
+    return map_fn
+
+_is_assoc = lambda doc: doc.get('type_') == "Association"
+_is_res = lambda doc: doc.get('type_') and doc['type_'] != "Association"
+_is_direntry = lambda doc: doc.get('type_') == "DirEntry"
+_is_event = lambda doc: bool(doc.get('origin'))
+_no_value = lambda doc: None
+
+# Python equivalents of the CouchDB views in couchdb_config.py used by find_by_view.
+# (design, view) -> (map function yielding (key, value), name of index on the first key element)
+MOCKDB_VIEWS = {
+    ('association', 'by_sub'):      (_map_if(_is_assoc, lambda d: [d['s'], d['p'], d['ot'], d['o']]), 'assoc_s'),
+    ('association', 'by_obj'):      (_map_if(_is_assoc, lambda d: [d['o'], d['p'], d['st'], d['s']]), 'assoc_o'),
+    ('association', 'by_ids'):      (_map_if(_is_assoc, lambda d: [d['s'], d['o'], d['p'], d['at'], d['srv'], d['orv']]), 'assoc_s'),
+    ('association', 'by_pred'):     (_map_if(_is_assoc, lambda d: [d['p'], d['s'], d['o'], d['at'], d['srv'], d['orv']]), 'assoc_p'),
+    ('association', 'by_bulk'):     (_map_if(_is_assoc, lambda d: d['s'], lambda d: d['o']), 'assoc_s'),
+    ('association', 'by_subpred'):  (_map_if(_is_assoc, lambda d: [d['s'], d['p']]), 'assoc_s'),
+    ('association', 'by_objpred'):  (_map_if(_is_assoc, lambda d: [d['o'], d['p']]), 'assoc_o'),
+    ('object', 'by_type'):          (_map_if(lambda d: True, lambda d: [d.get('type_')], _no_value), 'type'),
+    ('attachment', 'by_resource'):  (_map_if(lambda d: d.get('type_') == "Attachment", lambda d: [d.get('object_id'), d.get('ts_created')], _no_value), None),
+    ('resource', 'by_type'):        (_map_if(_is_res, lambda d: [d['type_'], d.get('lcstate'), d.get('name')], _no_value), 'type'),
+    ('resource', 'by_lcstate'):     (_map_lcstate, None),
+    ('resource', 'by_name'):        (_map_if(_is_res, lambda d: [d.get('name'), d['type_'], d.get('lcstate')], _no_value), 'name'),
+    ('resource', 'by_restype'):     (_map_if(_is_res, lambda d: [d['type_']], _no_value), 'type'),
+    ('directory', 'by_path'):       (_map_dir_path, None),
+    ('directory', 'by_key'):        (_map_if(_is_direntry, lambda d: [d['key'], d['parent']]), 'dir_key'),
+    ('directory', 'by_parent'):     (_map_if(_is_direntry, lambda d: [d['parent'], d['key']]), 'dir_parent'),
+    ('directory', 'by_attribute'):  (_map_dir_attribute, None),
+    ('event', 'by_time'):           (_map_if(_is_event, lambda d: [d.get('ts_created')], _no_value), 'event_time'),
+    ('event', 'by_type'):           (_map_if(_is_event, lambda d: [d['type_'], d.get('ts_created')], _no_value), 'event_type'),
+    ('event', 'by_origin'):         (_map_if(_is_event, lambda d: [d['origin'], d.get('ts_created')], _no_value), 'event_origin'),
+    ('event', 'by_origintype'):     (_map_if(_is_event, lambda d: [d['origin'], d['type_'], d.get('ts_created')], _no_value), 'event_origin'),
+    ('event', 'by_typesub'):        (_map_if(_is_event, lambda d: [d['type_'], d.get('sub_type'), d.get('ts_created')], _no_value), 'event_type'),
+    ('event', 'by_origintype_type'): (_map_if(_is_event, lambda d: [d.get('origin_type'), d['type_'], d.get('ts_created')], _no_value), 'event_origin_type'),
+    ('event', 'by_origintype_time'): (_map_if(_is_event, lambda d: [d.get('origin_type'), d.get('ts_created')], _no_value), 'event_origin_type'),
+}
+
+
 class MockDB_DataStore(DataStore):
     """
     Data store implementation utilizing in-memory dict of dicts
-    to persist documents.
+    to persist documents. Maintains secondary hash indexes (see MOCKDB_INDEXES)
+    over the HEAD docs, so that finds do not need to scan the entire store.
     """
 
     def __init__(self, datastore_name='prototype'):
         self.datastore_name = datastore_name
         log.debug('Creating in-memory dict of dicts that will simulate data stores')
         self.root = {}
+        # Per data store: index name -> index key -> set of doc ids
+        self._indexes = {}
+        # Per data store: doc id -> list of (index name, index key) the HEAD doc is indexed under
+        self._index_entries = {}
 
         # serializers
         self._io_serializer     = IonObjectSerializer()
@@ -35,6 +153,8 @@ class MockDB_DataStore(DataStore):
             raise BadRequest("Data store with name %s already exists" % datastore_name)
         if datastore_name not in self.root:
             self.root[datastore_name] = {}
+            self._indexes[datastore_name] = dict((index_name, {}) for index_name in MOCKDB_INDEXES)
+            self._index_entries[datastore_name] = {}
 
     def delete_datastore(self, datastore_name=""):
         if not datastore_name:
@@ -42,6 +162,8 @@ class MockDB_DataStore(DataStore):
         log.info('Deleting data store %s' % datastore_name)
         if datastore_name in self.root:
             del self.root[datastore_name]
+            del self._indexes[datastore_name]
+            del self._index_entries[datastore_name]
         else:
             log.info('Data store %s does not exist' % datastore_name)
 
@@ -128,6 +250,7 @@ class MockDB_DataStore(DataStore):
         datastore_dict[object_id] = doc
         datastore_dict[version_counter_key] = version_counter
         datastore_dict[object_id + '_version_' + str(version_counter)] = doc
+        self._index_doc(doc, datastore_name)
 
         # Return list that identifies the id of the new doc and its version
         res = [object_id, str(version_counter)]
@@ -188,15 +311,15 @@ class MockDB_DataStore(DataStore):
         log.debug('Read result: %s' % str(doc))
         return doc
 
-    def read_mult(self, object_ids, datastore_name=""):
+    def read_mult(self, object_ids, datastore_name="", strict=True):
         if any([not isinstance(object_id, str) for object_id in object_ids]):
             raise BadRequest("Object id param is not string")
-        docs = self.read_doc_mult(object_ids, datastore_name)
+        docs = self.read_doc_mult(object_ids, datastore_name, strict)
         # Convert docs into Ion objects
-        obj_list = [self._persistence_dict_to_ion_object(doc) for doc in docs]
+        obj_list = [self._persistence_dict_to_ion_object(doc) if doc is not None else None for doc in docs]
         return obj_list
 
-    def read_doc_mult(self, object_ids, datastore_name=""):
+    def read_doc_mult(self, object_ids, datastore_name="", strict=True):
         if not datastore_name:
             datastore_name = self.datastore_name
         try:
@@ -205,14 +328,15 @@ class MockDB_DataStore(DataStore):
             raise BadRequest('Data store ' + datastore_name + ' does not exist.')
 
         doc_list = []
-        try:
-            for object_id in object_ids:
-                log.debug('Reading head version of object %s/%s' % (datastore_name, str(object_id)))
-                doc = datastore_dict[object_id]
-
+        for object_id in object_ids:
+            log.debug('Reading head version of object %s/%s' % (datastore_name, str(object_id)))
+            doc = datastore_dict.get(object_id, None)
+            if doc is None:
+                if strict:
+                    raise NotFound('Object with id %s does not exist.' % str(object_id))
+                doc_list.append(None)
+            else:
                 doc_list.append(doc.copy())
-        except KeyError:
-            raise NotFound('Object with id %s does not exist.' % str(object_id))
         return doc_list
 
     def update(self, obj, datastore_name=""):
@@ -248,13 +372,35 @@ class MockDB_DataStore(DataStore):
         doc["_rev"] = str(version_counter)
 
         # Overwrite HEAD and version counter dicts, add new version dict
+        self._unindex_doc(object_id, datastore_name)
         datastore_dict[object_id] = doc
         datastore_dict[version_counter_key] = version_counter
         datastore_dict[object_id + '_version_' + str(version_counter)] = doc
+        self._index_doc(doc, datastore_name)
         res = [object_id, str(version_counter)]
         log.debug('Update result: %s' % str(res))
         return res
 
+    def update_mult(self, objects):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects])
+
+    def update_doc_mult(self, docs):
+        if type(docs) is not list:
+            raise BadRequest("Invalid type for docs:%s" % type(docs))
+        if not all(["_id" in doc and "_rev" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_id' and '_rev'")
+
+        res = []
+        for doc in docs:
+            try:
+                oid, rev = self.update_doc(doc)
+                res.append((True, oid, rev))
+            except (Conflict, BadRequest):
+                res.append((False, doc["_id"], "conflict"))
+        return res
+
     def delete(self, obj, datastore_name=""):
         if not isinstance(obj, IonObjectBase) and not isinstance(obj, str):
             raise BadRequest("Obj param is not instance of IonObjectBase or string id")
@@ -276,21 +422,22 @@ class MockDB_DataStore(DataStore):
             object_id = doc["_id"]
         
         log.info('Deleting object %s/%s' % (datastore_name, object_id))
-        if object_id in datastore_dict.keys():
+        if object_id in datastore_dict:
 
             if self._is_in_association(object_id, datastore_name):
                 obj = self.read(object_id, "", datastore_name)
                 log.warn("XXXXXXX Attempt to delete object %s that still has associations" % str(obj))
 #                raise BadRequest("Object cannot be deleted until associations are broken")
 
-            # Find all version dicts and delete them
-            for key in datastore_dict.keys():
-                if key.find(object_id + '_version_') == 0:
-                    del datastore_dict[key]
+            # Delete all version dicts
+            version_counter_key = '__' + object_id + '_version_counter'
+            for version in xrange(1, datastore_dict[version_counter_key] + 1):
+                datastore_dict.pop(object_id + '_version_' + str(version), None)
             # Delete the HEAD dict
+            self._unindex_doc(object_id, datastore_name)
             del datastore_dict[object_id]
             # Delete the version counter dict
-            del datastore_dict['__' + object_id + '_version_counter']
+            del datastore_dict[version_counter_key]
         else:
             raise NotFound('Object with id ' + object_id + ' does not exist.')
         log.info('Delete result: True')
@@ -302,19 +449,47 @@ class MockDB_DataStore(DataStore):
 
         if not datastore_name:
             datastore_name = self.datastore_name
+        if datastore_name not in self.root:
+            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+
+        if self._lookup('assoc_s', obj_id, datastore_name) or self._lookup('assoc_o', obj_id, datastore_name):
+            log.debug("association found for %s" % obj_id)
+            return True
+        return False
+
+    def _index_doc(self, doc, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        indexes = self._indexes[datastore_name]
+        entries = []
+        for index_name, key_fn in MOCKDB_INDEXES.iteritems():
+            for key in key_fn(doc):
+                indexes[index_name].setdefault(key, set()).add(doc['_id'])
+                entries.append((index_name, key))
+        self._index_entries[datastore_name][doc['_id']] = entries
+
+    def _unindex_doc(self, doc_id, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        indexes = self._indexes[datastore_name]
+        for index_name, key in self._index_entries[datastore_name].pop(doc_id, []):
+            id_set = indexes[index_name][key]
+            id_set.discard(doc_id)
+            if not id_set:
+                del indexes[index_name][key]
+
+    def _lookup(self, index_name, key, datastore_name=""):
+        """
+        Returns the set of ids of HEAD docs with given key in given index.
+        """
+        datastore_name = datastore_name or self.datastore_name
         try:
-            datastore_dict = self.root[datastore_name]
+            return self._indexes[datastore_name][index_name].get(key, set())
         except KeyError:
             raise BadRequest('Data store ' + datastore_name + ' does not exist.')
 
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                association = obj
-                if association["s"] == obj_id or association["o"] == obj_id:
-                    log.debug("association found(%s)" % association)
-                    return True
-        return False
+    def _lookup_docs(self, index_name, key, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        datastore_dict = self.root[datastore_name]
+        return [datastore_dict[doc_id] for doc_id in self._lookup(index_name, key, datastore_name)]
 
     def find_objects(self, subject, predicate=None, object_type=None, id_only=False):
         log.debug("find_objects(subject=%s, predicate=%s, object_type=%s, id_only=%s" % (subject, predicate, object_type, id_only))
@@ -322,9 +497,7 @@ class MockDB_DataStore(DataStore):
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
         if not subject:
             raise BadRequest("Must provide subject")
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
+        if self.datastore_name not in self.root:
             raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
 
         if type(subject) is str:
@@ -337,21 +510,17 @@ class MockDB_DataStore(DataStore):
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                if obj['s'] == subject_id:
-                    if predicate and obj['p'] == predicate:
-                        if (object_type and obj['ot'] == object_type) or not object_type:
-                            assoc_list.append(obj)
-                            target_id_list.append(obj['o'])
-                            target_list.append(self.read(obj['o']))
-                    elif not predicate:
-                        assoc_list.append(obj)
-                        target_id_list.append(obj['o'])
-                        target_list.append(self.read(obj['o']))
-
-        log.debug("find_objects() found %s objects" % (len(target_list)))
+        for obj in self._lookup_docs('assoc_s', subject_id):
+            if predicate and obj['p'] != predicate:
+                continue
+            if predicate and object_type and obj['ot'] != object_type:
+                continue
+            assoc_list.append(obj)
+            target_id_list.append(obj['o'])
+            if not id_only:
+                target_list.append(self.read(obj['o']))
+
+        log.debug("find_objects() found %s objects" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -363,9 +532,7 @@ class MockDB_DataStore(DataStore):
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
         if not obj:
             raise BadRequest("Must provide object")
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
+        if self.datastore_name not in self.root:
             raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
 
         if type(obj) is str:
@@ -378,21 +545,17 @@ class MockDB_DataStore(DataStore):
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                if obj['o'] == object_id:
-                    if predicate and obj['p'] == predicate:
-                        if (subject_type and obj['st'] == subject_type) or not subject_type:
-                            assoc_list.append(obj)
-                            target_id_list.append(obj['s'])
-                            target_list.append(self.read(obj['s']))
-                    elif not predicate:
-                        assoc_list.append(obj)
-                        target_id_list.append(obj['s'])
-                        target_list.append(self.read(obj['s']))
-
-        log.debug("find_subjects() found %s subjects" % (len(target_list)))
+        for obj in self._lookup_docs('assoc_o', object_id):
+            if predicate and obj['p'] != predicate:
+                continue
+            if predicate and subject_type and obj['st'] != subject_type:
+                continue
+            assoc_list.append(obj)
+            target_id_list.append(obj['s'])
+            if not id_only:
+                target_list.append(self.read(obj['s']))
+
+        log.debug("find_subjects() found %s subjects" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -426,23 +589,12 @@ class MockDB_DataStore(DataStore):
                     raise BadRequest("Object id not available in object")
                 else:
                     object_id = obj._id
-            target_list = []
-            for objname,obj in datastore_dict.iteritems():
-                if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-                if 'type_' in obj and obj['type_'] == "Association":
-                    if obj['s'] == subject_id and obj['o'] == object_id:
-                        if assoc_type:
-                            if obj['at'] == assoc_type:
-                                target_list.append(obj)
-                        else:
-                            target_list.append(obj)
+            assoc_ids = self._lookup('assoc_s', subject_id) & self._lookup('assoc_o', object_id)
+            target_list = [datastore_dict[assoc_id] for assoc_id in assoc_ids]
+            if assoc_type:
+                target_list = [assoc for assoc in target_list if assoc['at'] == assoc_type]
         else:
-            target_list = []
-            for objname,obj in datastore_dict.iteritems():
-                if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-                if 'type_' in obj and obj['type_'] == "Association":
-                    if obj['p'] == predicate:
-                        target_list.append(obj)
+            target_list = self._lookup_docs('assoc_p', predicate)
 
         if id_only:
             assocs = [row['_id'] for row in target_list]
@@ -450,28 +602,47 @@ class MockDB_DataStore(DataStore):
             assocs = [self._persistence_dict_to_ion_object(row) for row in target_list]
         log.debug("find_associations() found %s associations" % (len(assocs)))
         return assocs
-        
+
+    def _find_associations_by_ids(self, resource_ids, predicate, reverse=False):
+        try:
+            datastore_dict = self.root[self.datastore_name]
+        except KeyError:
+            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+
+        index_name = 'assoc_o' if reverse else 'assoc_s'
+        pred_ids = self._lookup('assoc_p', predicate)
+        assoc_list = []
+        for res_id in resource_ids:
+            for assoc_id in self._lookup(index_name, res_id) & pred_ids:
+                assoc_list.append(self._persistence_dict_to_ion_object(datastore_dict[assoc_id]))
+        return assoc_list
+
     def find_res_by_type(self, restype, lcstate=None, id_only=False):
         log.debug("find_res_by_type(restype=%s, lcstate=%s)" % (restype, lcstate))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
+        if self.datastore_name not in self.root:
             raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
 
+        if restype:
+            candidates = self._lookup_docs('type', restype)
+        else:
+            candidates = []
+            for obj_type in self._indexes[self.datastore_name]['type'].keys():
+                if obj_type != "Association":
+                    candidates.extend(self._lookup_docs('type', obj_type))
+
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and (obj['type_'] == restype or (not restype and obj['type_'] != "Association")):
-                if (lcstate and 'lcstate' in obj and obj['lcstate'] == lcstate) or not lcstate or not restype:
-                    target_id_list.append(obj['_id'])
+        for obj in candidates:
+            if (lcstate and 'lcstate' in obj and obj['lcstate'] == lcstate) or not lcstate or not restype:
+                target_id_list.append(obj['_id'])
+                if not id_only:
                     target_list.append(self._persistence_dict_to_ion_object(obj))
-                    assoc_list.append([])
+                assoc_list.append([])
 
-        log.debug("find_res_by_type() found %s resources" % (len(target_list)))
+        log.debug("find_res_by_type() found %s resources" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -481,9 +652,7 @@ class MockDB_DataStore(DataStore):
         log.debug("find_res_by_type(lcstate=%s, restype=%s)" % (lcstate, restype))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
+        if self.datastore_name not in self.root:
             raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
 
         if lcstate in CommonResourceLifeCycleSM.STATE_ALIASES:
@@ -493,15 +662,15 @@ class MockDB_DataStore(DataStore):
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'lcstate' in obj and obj['lcstate'] in lcstate_match:
+        for lcs in lcstate_match:
+            for obj in self._lookup_docs('lcstate', lcs):
                 if (restype and obj['type_'] == restype) or not restype:
                     target_id_list.append(obj['_id'])
-                    target_list.append(self._persistence_dict_to_ion_object(obj))
+                    if not id_only:
+                        target_list.append(self._persistence_dict_to_ion_object(obj))
                     assoc_list.append([])
 
-        log.debug("find_res_by_lcstate() found %s resources" % (len(target_list)))
+        log.debug("find_res_by_lcstate() found %s resources" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -514,30 +683,112 @@ class MockDB_DataStore(DataStore):
         log.debug("find_res_by_name(name=%s, restype=%s)" % (name, restype))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
+        if self.datastore_name not in self.root:
             raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
 
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'name' in obj and obj['name'] == name:
-                if (restype and obj['type_'] == restype) or not restype:
-                    target_id_list.append(obj['_id'])
+        for obj in self._lookup_docs('name', name):
+            if (restype and obj['type_'] == restype) or not restype:
+                target_id_list.append(obj['_id'])
+                if not id_only:
                     target_list.append(self._persistence_dict_to_ion_object(obj))
-                    assoc_list.append([])
+                assoc_list.append([])
 
-        log.debug("find_res_by_name() found %s resources" % (len(target_list)))
+        log.debug("find_res_by_name() found %s resources" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
             return (target_list, assoc_list)
 
     def find_dir_entries(self, qname):
-        raise NotImplementedError()
+        log.debug("find_dir_entries(qname=%s)" % qname)
+        if not str(qname).startswith('/'):
+            raise BadRequest("Illegal directory qname=%s" % qname)
+        key = str(qname).split('/')[1:]
+        endkey = list(key) if qname != '/' else []
+        rows = self.find_by_view("directory", "by_path", start_key=key, end_key=endkey, id_only=False, convert_doc=False)
+        res_entries = [self._persistence_dict_to_ion_object(doc) for _, _, doc in rows]
+        log.debug("find_dir_entries() found %s objects" % (len(res_entries)))
+        return res_entries
+
+    def find_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
+                           id_only=True, convert_doc=True, **kwargs):
+        """
+        @brief Generic find function emulating the CouchDB views defined in MOCKDB_VIEWS.
+            Supports the same query arguments as CouchDB_DataStore.find_by_view.
+        @retval Returns a list of triples: (doc_id, index_key, object or doc or None)
+        """
+        log.debug("find_by_view(%s/%s)" % (design_name, view_name))
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        try:
+            datastore_dict = self.root[self.datastore_name]
+        except KeyError:
+            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+
+        if design_name == "_all_docs":
+            map_fn, index_name = (lambda doc: [(doc['_id'], None)]), None
+        elif (design_name, view_name) in MOCKDB_VIEWS:
+            map_fn, index_name = MOCKDB_VIEWS[(design_name, view_name)]
+        else:
+            raise BadRequest("Unknown view %s/%s" % (design_name, view_name))
+
+        def first_elem(k):
+            return k[0] if type(k) is list and k else k
+
+        # Narrow down candidate docs using the index on the first key element, if possible
+        if key is not None:
+            prefixes = [first_elem(key)]
+        elif keys:
+            prefixes = [first_elem(k) for k in keys]
+        elif start_key and end_key and first_elem(start_key) == first_elem(end_key):
+            prefixes = [first_elem(start_key)]
+        else:
+            prefixes = None
+        if index_name and prefixes is not None and type(prefixes[0]) is not list:
+            candidate_ids = set()
+            for prefix in prefixes:
+                candidate_ids |= self._lookup(index_name, prefix)
+        else:
+            candidate_ids = [oid for oid, obj in datastore_dict.iteritems() if type(obj) is dict and oid.find('_version_') == -1]
+
+        rows = []
+        for doc_id in candidate_ids:
+            doc = datastore_dict[doc_id]
+            for row_key, row_value in map_fn(doc):
+                rows.append((row_key, doc_id, doc))
+        rows.sort(key=lambda row: (_collation_key(row[0]), row[1]))
+
+        if key is not None:
+            rows = [row for row in rows if row[0] == key]
+        elif keys:
+            rows = [row for k in keys for row in rows if row[0] == k]
+        elif start_key and end_key:
+            endkey = list(end_key)
+            endkey.append(END_MARKER)
+            start_ckey, end_ckey = _collation_key(start_key), _collation_key(endkey)
+            rows = [row for row in rows if start_ckey <= _collation_key(row[0]) <= end_ckey]
+
+        if kwargs.get('descending', False):
+            rows.reverse()
+        skip = int(kwargs.get('skip', 0))
+        limit = int(kwargs.get('limit', 0))
+        if skip > 0:
+            rows = rows[skip:]
+        if limit > 0:
+            rows = rows[:limit]
+
+        if id_only:
+            res_rows = [(doc_id, row_key, None) for row_key, doc_id, doc in rows]
+        elif convert_doc:
+            res_rows = [(doc_id, row_key, self._persistence_dict_to_ion_object(doc)) for row_key, doc_id, doc in rows]
+        else:
+            res_rows = [(doc_id, row_key, doc.copy()) for row_key, doc_id, doc in rows]
+
+        log.debug("find_by_view() found %s objects" % (len(res_rows)))
+        return res_rows
 
     def _ion_object_to_persistence_dict(self, ion_object):
         if ion_object is None: return None
@@ -0,0 +1,854 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+__license__ = 'Apache 2.0'
+
+from uuid import uuid4
+import os
+import re
+import sqlite3
+
+import msgpack
+import simplejson
+
+from pyon.core.bootstrap import get_obj_registry, CFG
+from pyon.core.exception import BadRequest, Conflict, NotFound
+from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer
+from pyon.datastore.datastore import DataStore
+from pyon.datastore.couchdb.couchdb_config import COUCHDB_CONFIGS
+from pyon.ion.resource import CommonResourceLifeCycleSM
+from pyon.util.log import log
+
+# Maximum number of host parameters in one SQLite statement is 999 by default
+MAX_SQL_PARAMS = 900
+
+SQLITE_TABLES = [
+    # HEAD version of all docs. The fields used by the views in couchdb_config.py are extracted
+    # into columns, so that they can be indexed.
+    """CREATE TABLE IF NOT EXISTS docs (
+        id TEXT PRIMARY KEY,
+        rev INTEGER NOT NULL,
+        type_ TEXT, lcstate TEXT, name TEXT, ts_created TEXT,
+        s TEXT, st TEXT, p TEXT, o TEXT, ot TEXT, at TEXT, srv TEXT, orv TEXT,
+        parent TEXT, dir_key TEXT, path TEXT,
+        origin TEXT, origin_type TEXT, sub_type TEXT, object_id TEXT,
+        doc BLOB NOT NULL)""",
+    # All versions of all docs
+    """CREATE TABLE IF NOT EXISTS doc_revisions (
+        id TEXT NOT NULL,
+        rev INTEGER NOT NULL,
+        doc BLOB NOT NULL,
+        PRIMARY KEY (id, rev))""",
+    # DirEntry attributes, one row per attribute with scalar value
+    """CREATE TABLE IF NOT EXISTS dir_attributes (
+        id TEXT NOT NULL,
+        attr TEXT NOT NULL,
+        value TEXT)""",
+    "CREATE INDEX IF NOT EXISTS dir_attributes_by_id ON dir_attributes (id)",
+]
+
+# SQL indexes equivalent to the CouchDB views. Design name -> list of (index name, table, columns)
+SQLITE_INDEXES = {
+    'object': [
+        ('object_by_type', 'docs', 'type_'),
+    ],
+    'association': [
+        ('association_by_sub', 'docs', 's, p, ot, o'),
+        ('association_by_obj', 'docs', 'o, p, st, s'),
+        ('association_by_pred', 'docs', 'p, s, o, at'),
+    ],
+    'attachment': [
+        ('attachment_by_resource', 'docs', 'object_id, ts_created'),
+    ],
+    'resource': [
+        ('resource_by_type', 'docs', 'type_, lcstate, name'),
+        ('resource_by_lcstate', 'docs', 'lcstate, type_, name'),
+        ('resource_by_name', 'docs', 'name, type_, lcstate'),
+    ],
+    'directory': [
+        ('directory_by_path', 'docs', 'path'),
+        ('directory_by_key', 'docs', 'dir_key, parent'),
+        ('directory_by_parent', 'docs', 'parent, dir_key'),
+        ('directory_by_attribute', 'dir_attributes', 'attr, value'),
+    ],
+    'event': [
+        ('event_by_time', 'docs', 'ts_created'),
+        ('event_by_type', 'docs', 'type_, ts_created'),
+        ('event_by_origin', 'docs', 'origin, type_, ts_created'),
+        ('event_by_typesub', 'docs', 'type_, sub_type, ts_created'),
+        ('event_by_origintype', 'docs', 'origin_type, type_, ts_created'),
+    ],
+}
+
+_DOCS = "docs"
+_DIR_ATTRS = "dir_attributes JOIN docs ON dir_attributes.id = docs.id"
+_IS_ASSOC = "docs.type_ = 'Association'"
+_IS_RES = "docs.type_ IS NOT NULL AND docs.type_ != 'Association'"
+_IS_EVENT = "docs.origin IS NOT NULL"
+
+# Views supported by find_by_view. (design, view) -> (from clause, where clause, key columns)
+SQLITE_VIEWS = {
+    ('association', 'by_sub'):      (_DOCS, _IS_ASSOC, ['s', 'p', 'ot', 'o']),
+    ('association', 'by_obj'):      (_DOCS, _IS_ASSOC, ['o', 'p', 'st', 's']),
+    ('association', 'by_ids'):      (_DOCS, _IS_ASSOC, ['s', 'o', 'p', 'at', 'srv', 'orv']),
+    ('association', 'by_pred'):     (_DOCS, _IS_ASSOC, ['p', 's', 'o', 'at', 'srv', 'orv']),
+    ('association', 'by_subpred'):  (_DOCS, _IS_ASSOC, ['s', 'p']),
+    ('association', 'by_objpred'):  (_DOCS, _IS_ASSOC, ['o', 'p']),
+    ('object', 'by_type'):          (_DOCS, "1", ['type_']),
+    ('attachment', 'by_resource'):  (_DOCS, "docs.type_ = 'Attachment'", ['object_id', 'ts_created']),
+    ('resource', 'by_type'):        (_DOCS, _IS_RES, ['type_', 'lcstate', 'name']),
+    ('resource', 'by_name'):        (_DOCS, _IS_RES, ['name', 'type_', 'lcstate']),
+    ('resource', 'by_restype'):     (_DOCS, _IS_RES, ['type_']),
+    ('directory', 'by_key'):        (_DOCS, "docs.type_ = 'DirEntry'", ['dir_key', 'parent']),
+    ('directory', 'by_parent'):     (_DOCS, "docs.type_ = 'DirEntry'", ['parent', 'dir_key']),
+    ('directory', 'by_attribute'):  (_DIR_ATTRS, "1", ['dir_attributes.attr', 'dir_attributes.value', 'docs.parent']),
+    ('event', 'by_time'):           (_DOCS, _IS_EVENT, ['ts_created']),
+    ('event', 'by_type'):           (_DOCS, _IS_EVENT, ['type_', 'ts_created']),
+    ('event', 'by_origin'):         (_DOCS, _IS_EVENT, ['origin', 'ts_created']),
+    ('event', 'by_origintype'):     (_DOCS, _IS_EVENT, ['origin', 'type_', 'ts_created']),
+    ('event', 'by_typesub'):        (_DOCS, _IS_EVENT, ['type_', 'sub_type', 'ts_created']),
+    ('event', 'by_origintype_type'): (_DOCS, _IS_EVENT, ['origin_type', 'type_', 'ts_created']),
+    ('event', 'by_origintype_time'): (_DOCS, _IS_EVENT, ['origin_type', 'ts_created']),
+}
+
+DOC_COLUMNS = ['type_', 'lcstate', 'name', 'ts_created', 's', 'st', 'p', 'o', 'ot', 'at', 'srv', 'orv',
+               'parent', 'dir_key', 'path', 'origin', 'origin_type', 'sub_type', 'object_id']
+
+_DATASTORE_NAME_RE = re.compile(r'^[a-z][a-z0-9_]*$')
+
+
+def _scalar(value):
+    return value if isinstance(value, (basestring, int, long, float)) and not type(value) is bool else None
+
+def _get_doc_columns(doc):
+    """
+    Returns the list of indexed column values (see DOC_COLUMNS) for given doc
+    """
+    col = dict(type_=_scalar(doc.get('type_')), lcstate=_scalar(doc.get('lcstate')), name=_scalar(doc.get('name')),
+               ts_created=_scalar(doc.get('ts_created')), origin=_scalar(doc.get('origin')) or None)
+    doc_type = col['type_']
+    if doc_type == "Association":
+        for attr in ('s', 'st', 'p', 'o', 'ot', 'at', 'srv', 'orv'):
+            col[attr] = _scalar(doc.get(attr))
+    elif doc_type == "DirEntry":
+        col['parent'] = doc.get('parent', "")
+        col['dir_key'] = doc.get('key', "")
+        col['path'] = "%s/%s" % (col['parent'], col['dir_key']) if col['parent'] else col['dir_key']
+    elif doc_type == "Attachment":
+        col['object_id'] = _scalar(doc.get('object_id'))
+    if col['origin']:
+        col['origin_type'] = _scalar(doc.get('origin_type'))
+        col['sub_type'] = _scalar(doc.get('sub_type'))
+    return [col.get(name, None) for name in DOC_COLUMNS]
+
+def _chunks(values, size=MAX_SQL_PARAMS):
+    for i in xrange(0, len(values), size):
+        yield values[i:i + size]
+
+
+class SQLite_DataStore(DataStore):
+    """
+    Data store implementation utilizing an embedded SQLite database file per data store
+    to persist documents. Docs are stored as JSON or msgpack encoded blobs; the fields
+    used by the CouchDB views are extracted into columns with SQL indexes.
+    Use path ":memory:" for non-persistent data stores.
+    """
+    def __init__(self, path=None, datastore_name='prototype', profile=DataStore.DS_PROFILE.BASIC, encoding=None):
+        log.debug('__init__(path=%s, datastore_name=%s)', path, datastore_name)
+        self.path = path or CFG.get_safe('server.sqlite.path', 'sqlite')
+        self.encoding = encoding or CFG.get_safe('server.sqlite.encoding', 'json')
+        if self.encoding not in ('json', 'msgpack'):
+            raise BadRequest("Unknown doc encoding: %s" % self.encoding)
+        # The scoped name of the datastore
+        self.datastore_name = datastore_name
+        # Datastore specialization (indexes)
+        self.profile = profile
+
+        # serializers
+        self._io_serializer     = IonObjectSerializer()
+        self._io_deserializer   = IonObjectDeserializer(obj_registry=get_obj_registry())
+        self._datastore_cache = {}
+
+    def close(self):
+        log.info("Closing connections to SQLite")
+        for conn in self._datastore_cache.values():
+            conn.close()
+        self._datastore_cache = {}
+
+    def _get_filename(self, datastore_name):
+        return os.path.join(self.path, "%s.db" % datastore_name)
+
+    def _connect(self, datastore_name):
+        filename = ":memory:" if self.path == ":memory:" else self._get_filename(datastore_name)
+        conn = sqlite3.connect(filename, check_same_thread=False)
+        conn.text_factory = str
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _get_datastore(self, datastore_name=None):
+        datastore_name = datastore_name or self.datastore_name
+
+        if datastore_name in self._datastore_cache:
+            return (self._datastore_cache[datastore_name], datastore_name)
+
+        if not _DATASTORE_NAME_RE.match(datastore_name):
+            raise BadRequest("Datastore name '%s' invalid" % datastore_name)
+        if not self.datastore_exists(datastore_name):
+            raise BadRequest("Datastore '%s' does not exist" % datastore_name)
+        conn = self._connect(datastore_name)
+        self._datastore_cache[datastore_name] = conn
+        return conn, datastore_name
+
+    def _encode_doc(self, doc):
+        if self.encoding == 'msgpack':
+            return sqlite3.Binary(msgpack.packb(doc))
+        return simplejson.dumps(doc)
+
+    def _decode_doc(self, blob):
+        if self.encoding == 'msgpack':
+            return msgpack.unpackb(str(blob))
+        return simplejson.loads(blob)
+
+    def create_datastore(self, datastore_name="", create_indexes=True, profile=None):
+        datastore_name = datastore_name or self.datastore_name
+        profile = profile or self.profile
+        log.info('Creating data store %s with profile=%s' % (datastore_name, profile))
+        if not _DATASTORE_NAME_RE.match(datastore_name):
+            raise BadRequest("Data store name %s invalid" % datastore_name)
+        if self.datastore_exists(datastore_name):
+            raise BadRequest("Data store with name %s already exists" % datastore_name)
+        if self.path != ":memory:" and not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        conn = self._connect(datastore_name)
+        for stmt in SQLITE_TABLES:
+            conn.execute(stmt)
+        self._datastore_cache[datastore_name] = conn
+        if create_indexes:
+            self._define_views(datastore_name, profile)
+
+    def delete_datastore(self, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        log.info('Deleting data store %s' % datastore_name)
+        if not _DATASTORE_NAME_RE.match(datastore_name):
+            raise BadRequest("Data store name %s invalid" % datastore_name)
+        if not self.datastore_exists(datastore_name):
+            log.info('Data store %s does not exist' % datastore_name)
+            return
+        conn = self._datastore_cache.pop(datastore_name, None)
+        if conn:
+            conn.close()
+        if self.path != ":memory:":
+            filename = self._get_filename(datastore_name)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(filename + suffix):
+                    os.remove(filename + suffix)
+
+    def list_datastores(self):
+        if self.path == ":memory:":
+            dbs = self._datastore_cache.keys()
+        elif os.path.exists(self.path):
+            dbs = [fn[:-3] for fn in os.listdir(self.path) if fn.endswith(".db")]
+        else:
+            dbs = []
+        log.debug('Data stores: %s', str(dbs))
+        return dbs
+
+    def info_datastore(self, datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        log.debug('Listing information about data store %s', datastore_name)
+        doc_count = conn.execute("SELECT count(*) FROM docs").fetchone()[0]
+        info = dict(db_name=datastore_name, doc_count=doc_count, encoding=self.encoding,
+                    filename=None if self.path == ":memory:" else self._get_filename(datastore_name))
+        log.debug('Data store info: %s', str(info))
+        return info
+
+    def datastore_exists(self, datastore_name=""):
+        if self.path == ":memory:":
+            return datastore_name in self._datastore_cache
+        return os.path.exists(self._get_filename(datastore_name))
+
+    def list_objects(self, datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        log.warning('Listing all objects in data store %s' % datastore_name)
+        objs = [row[0] for row in conn.execute("SELECT id FROM docs ORDER BY id")]
+        log.debug('Objects: %s', str(objs))
+        return objs
+
+    def list_object_revisions(self, object_id, datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        log.debug('Listing all versions of object %s/%s', datastore_name, object_id)
+        res = [str(row[0]) for row in conn.execute("SELECT rev FROM doc_revisions WHERE id=? ORDER BY rev DESC", (object_id,))]
+        log.debug('Object versions: %s', str(res))
+        return res
+
+    def create(self, obj, object_id=None, datastore_name=""):
+        if not isinstance(obj, IonObjectBase):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.create_doc(self._ion_object_to_persistence_dict(obj),
+                               object_id=object_id, datastore_name=datastore_name)
+
+    def create_doc(self, doc, object_id=None, datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        if '_id' in doc:
+            raise BadRequest("Doc must not have '_id'")
+        if '_rev' in doc:
+            raise BadRequest("Doc must not have '_rev'")
+
+        doc["_id"] = object_id or uuid4().hex
+        log.info('Creating new object %s/%s' % (datastore_name, doc["_id"]))
+        log.debug('create doc contents: %s', doc)
+
+        with conn:
+            try:
+                self._insert_doc(conn, doc)
+            except sqlite3.IntegrityError:
+                del doc["_rev"]
+                raise BadRequest("Object with id %s already exist" % doc["_id"])
+        return (doc["_id"], doc["_rev"])
+
+    def _insert_doc(self, conn, doc):
+        doc["_rev"] = "1"
+        blob = self._encode_doc(doc)
+        conn.execute("INSERT INTO docs (id, rev, %s, doc) VALUES (?, 1, %s, ?)" % (
+                     ", ".join(DOC_COLUMNS), ", ".join("?" * len(DOC_COLUMNS))),
+                     [doc["_id"]] + _get_doc_columns(doc) + [blob])
+        conn.execute("INSERT INTO doc_revisions (id, rev, doc) VALUES (?, 1, ?)", (doc["_id"], blob))
+        self._insert_dir_attributes(conn, doc)
+
+    def _insert_dir_attributes(self, conn, doc):
+        if doc.get('type_') == "DirEntry" and doc.get('attributes'):
+            conn.executemany("INSERT INTO dir_attributes (id, attr, value) VALUES (?, ?, ?)",
+                             [(doc["_id"], attr, _scalar(value)) for attr, value in doc['attributes'].iteritems()])
+
+    def _preload_create_doc(self, doc):
+        conn, datastore_name = self._get_datastore()
+        log.debug('Preloading object %s/%s', datastore_name, doc["_id"])
+        log.debug('create doc contents: %s', doc)
+        with conn:
+            try:
+                self._insert_doc(conn, doc)
+            except sqlite3.IntegrityError:
+                raise BadRequest("Object with id %s already exist" % doc["_id"])
+
+    def create_mult(self, objects, object_ids=None, allow_ids=False):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+                raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.create_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects],
+                                    object_ids, allow_ids=allow_ids)
+
+    def create_doc_mult(self, docs, object_ids=None, allow_ids=False):
+        if not allow_ids:
+            if any(["_id" in doc for doc in docs]):
+                raise BadRequest("Docs must not have '_id'")
+            if any(["_rev" in doc for doc in docs]):
+                raise BadRequest("Docs must not have '_rev'")
+        if object_ids and len(object_ids) != len(docs):
+            raise BadRequest("Invalid object_ids")
+        if type(docs) is not list:
+            raise BadRequest("Invalid type for docs:%s" % type(docs))
+
+        if object_ids:
+            for doc, oid in zip(docs, object_ids):
+                doc["_id"] = oid
+        else:
+            for doc in docs:
+                doc["_id"] = doc.get("_id", None) or uuid4().hex
+
+        # All docs are inserted in one transaction. Docs with existing ids are reported as errors
+        conn, datastore_name = self._get_datastore()
+        res = []
+        with conn:
+            for doc in docs:
+                try:
+                    self._insert_doc(conn, doc)
+                    res.append((True, doc["_id"], doc["_rev"]))
+                except sqlite3.IntegrityError:
+                    res.append((False, doc["_id"], "conflict"))
+        if not all([success for success, oid, rev in res]):
+            errors = ["%s:%s" % (oid, rev) for success, oid, rev in res if not success]
+            log.error('create_doc_mult had errors. Successful: %s, Errors: %s' % (len(res) - len(errors), "\n".join(errors)))
+        else:
+            log.debug('create_doc_mult result: %s', str(res))
+        return res
+
+    def read(self, object_id, rev_id="", datastore_name=""):
+        if not isinstance(object_id, str):
+            raise BadRequest("Object id param is not string")
+        doc = self.read_doc(object_id, rev_id, datastore_name)
+
+        # Convert doc into Ion object
+        obj = self._persistence_dict_to_ion_object(doc)
+        log.debug('Ion object: %s', str(obj))
+        return obj
+
+    def read_doc(self, doc_id, rev_id="", datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        if not rev_id:
+            log.debug('Reading head version of object %s/%s', datastore_name, doc_id)
+            row = conn.execute("SELECT doc FROM docs WHERE id=?", (doc_id,)).fetchone()
+        else:
+            log.debug('Reading version %s of object %s/%s', rev_id, datastore_name, doc_id)
+            row = conn.execute("SELECT doc FROM doc_revisions WHERE id=? AND rev=?", (doc_id, int(rev_id))).fetchone()
+        if row is None:
+            raise NotFound('Object with id %s does not exist.' % str(doc_id))
+        doc = self._decode_doc(row[0])
+        log.debug('read doc contents: %s', doc)
+        return doc
+
+    def read_mult(self, object_ids, datastore_name="", strict=True):
+        if any([not isinstance(object_id, str) for object_id in object_ids]):
+            raise BadRequest("Object id param is not string")
+        docs = self.read_doc_mult(object_ids, datastore_name, strict)
+        # Convert docs into Ion objects
+        obj_list = [self._persistence_dict_to_ion_object(doc) if doc is not None else None for doc in docs]
+        return obj_list
+
+    def read_doc_mult(self, object_ids, datastore_name="", strict=True):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        if type(object_ids) is not list:
+            raise BadRequest("Invalid type for object_ids:%s" % type(object_ids))
+        log.info('Reading head version of objects %s/%s' % (datastore_name, object_ids))
+        blobs = {}
+        for id_chunk in _chunks(list(set(object_ids))):
+            for doc_id, blob in conn.execute("SELECT id, doc FROM docs WHERE id IN (%s)" % ",".join("?" * len(id_chunk)), id_chunk):
+                blobs[doc_id] = blob
+        # Check for docs not found
+        notfound_list = ['Object with id %s does not exist.' % str(doc_id) for doc_id in object_ids if doc_id not in blobs]
+        if notfound_list and strict:
+            raise NotFound("\n".join(notfound_list))
+
+        doc_list = [self._decode_doc(blobs[doc_id]) if doc_id in blobs else None for doc_id in object_ids]
+        return doc_list
+
+    def update(self, obj, datastore_name=""):
+        if not isinstance(obj, IonObjectBase):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc(self._ion_object_to_persistence_dict(obj))
+
+    def update_doc(self, doc, datastore_name=""):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        if '_id' not in doc:
+            raise BadRequest("Doc must have '_id'")
+        if '_rev' not in doc:
+            raise BadRequest("Doc must have '_rev'")
+
+        log.debug('update doc contents: %s', doc)
+        with conn:
+            self._update_doc(conn, doc)
+        log.debug('Update result: %s', doc["_rev"])
+        return (doc["_id"], doc["_rev"])
+
+    def _update_doc(self, conn, doc):
+        try:
+            base_rev = int(doc["_rev"])
+        except ValueError:
+            raise Conflict('Object not based on most current version')
+        doc["_rev"] = str(base_rev + 1)
+        blob = self._encode_doc(doc)
+        cur = conn.execute("UPDATE docs SET rev=?, %s, doc=? WHERE id=? AND rev=?" % (
+                           ", ".join("%s=?" % col for col in DOC_COLUMNS)),
+                           [base_rev + 1] + _get_doc_columns(doc) + [blob, doc["_id"], base_rev])
+        if cur.rowcount != 1:
+            doc["_rev"] = str(base_rev)
+            if conn.execute("SELECT rev FROM docs WHERE id=?", (doc["_id"],)).fetchone() is None:
+                raise NotFound('Object with id %s does not exist.' % doc["_id"])
+            raise Conflict('Object not based on most current version')
+        conn.execute("INSERT INTO doc_revisions (id, rev, doc) VALUES (?, ?, ?)", (doc["_id"], base_rev + 1, blob))
+        conn.execute("DELETE FROM dir_attributes WHERE id=?", (doc["_id"],))
+        self._insert_dir_attributes(conn, doc)
+
+    def update_mult(self, objects):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects])
+
+    def update_doc_mult(self, docs):
+        """
+        Updates multiple raw docs in one transaction.
+        Returns list of (Success, Oid, rev or error)
+        """
+        if type(docs) is not list:
+            raise BadRequest("Invalid type for docs:%s" % type(docs))
+        if not all(["_id" in doc and "_rev" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_id' and '_rev'")
+
+        conn, datastore_name = self._get_datastore()
+        res = []
+        with conn:
+            for doc in docs:
+                try:
+                    self._update_doc(conn, doc)
+                    res.append((True, doc["_id"], doc["_rev"]))
+                except (Conflict, NotFound):
+                    res.append((False, doc["_id"], "conflict"))
+        log.debug('update_doc_mult result: %s', str(res))
+        return res
+
+    def delete(self, obj, datastore_name="", del_associations=False):
+        if not isinstance(obj, IonObjectBase) and not isinstance(obj, str):
+            raise BadRequest("Obj param is not instance of IonObjectBase or string id")
+        if type(obj) is str:
+            self.delete_doc(obj, datastore_name=datastore_name, del_associations=del_associations)
+        else:
+            if '_id' not in obj:
+                raise BadRequest("Doc must have '_id'")
+            if '_rev' not in obj:
+                raise BadRequest("Doc must have '_rev'")
+            self.delete_doc(self._ion_object_to_persistence_dict(obj), datastore_name=datastore_name, del_associations=del_associations)
+
+    def delete_doc(self, doc, datastore_name="", del_associations=False):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        doc_id = doc if type(doc) is str else doc["_id"]
+        log.debug('Deleting object %s/%s', datastore_name, doc_id)
+
+        if del_associations:
+            assoc_ids = self.find_associations(anyobj=doc_id, id_only=True)
+            for aid in assoc_ids:
+                self.delete(aid, datastore_name=datastore_name)
+            log.debug("Deleted %s associations for object %s", len(assoc_ids), doc_id)
+
+        elif self._is_in_association(doc_id, datastore_name):
+            log.warn("XXXXXXX Attempt to delete object %s that still has associations" % doc_id)
+
+        with conn:
+            if type(doc) is str:
+                cur = conn.execute("DELETE FROM docs WHERE id=?", (doc_id,))
+            else:
+                cur = conn.execute("DELETE FROM docs WHERE id=? AND rev=?", (doc_id, int(doc["_rev"])))
+                if cur.rowcount == 0 and conn.execute("SELECT rev FROM docs WHERE id=?", (doc_id,)).fetchone():
+                    raise Conflict('Object not based on most current version')
+            if cur.rowcount == 0:
+                raise NotFound('Object with id %s does not exist.' % doc_id)
+            conn.execute("DELETE FROM doc_revisions WHERE id=?", (doc_id,))
+            conn.execute("DELETE FROM dir_attributes WHERE id=?", (doc_id,))
+
+    def _define_views(self, datastore_name=None, profile=None, keepviews=False):
+        """
+        Creates the SQL indexes equivalent to the CouchDB views of the given profile.
+        Existing indexes are always kept.
+        """
+        conn, datastore_name = self._get_datastore(datastore_name)
+        profile = profile or self.profile
+
+        for design in COUCHDB_CONFIGS[profile]['views']:
+            for index_name, table, columns in SQLITE_INDEXES.get(design, []):
+                conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (index_name, table, columns))
+
+    def _update_views(self, datastore_name="", profile=None):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        conn.execute("ANALYZE")
+
+    _refresh_views = _update_views
+
+    def _delete_views(self, datastore_name="", profile=None):
+        conn, datastore_name = self._get_datastore(datastore_name)
+        profile = profile or self.profile
+
+        for design in COUCHDB_CONFIGS[profile]['views']:
+            for index_name, table, columns in SQLITE_INDEXES.get(design, []):
+                conn.execute("DROP INDEX IF EXISTS %s" % index_name)
+
+    def _is_in_association(self, obj_id, datastore_name=""):
+        log.debug("_is_in_association(%s)", obj_id)
+        if not obj_id:
+            raise BadRequest("Must provide object id")
+        conn, datastore_name = self._get_datastore(datastore_name)
+
+        row = conn.execute("SELECT id FROM docs WHERE type_='Association' AND (s=? OR o=?) LIMIT 1", (obj_id, obj_id)).fetchone()
+        if row:
+            log.debug("Object found in associations: First is %s", row[0])
+            return True
+
+        return False
+
+    def _query_assocs(self, where, params, **kwargs):
+        """
+        Returns association docs matching the given SQL where clause
+        """
+        conn, datastore_name = self._get_datastore()
+        sql = "SELECT doc FROM docs WHERE type_='Association' AND %s" % where
+        limit = int(kwargs.get('limit', 0))
+        if limit > 0:
+            sql += " LIMIT %s" % limit
+        return [self._decode_doc(row[0]) for row in conn.execute(sql, params)]
+
+    def find_associations_mult(self, subjects, id_only=False):
+        if type(subjects) is not list:
+            raise BadRequest('subjects is not a list of resource_ids')
+        assoc_docs = []
+        for id_chunk in _chunks(subjects):
+            assoc_docs.extend(self._query_assocs("s IN (%s)" % ",".join("?" * len(id_chunk)), id_chunk))
+        ids = [doc['o'] for doc in assoc_docs]
+        assocs = [self._persistence_dict_to_ion_object(doc) for doc in assoc_docs]
+        if id_only:
+            return ids, assocs
+        else:
+            return self.read_mult(ids), assocs
+
+    def _find_associations_by_ids(self, resource_ids, predicate, reverse=False):
+        id_col = "o" if reverse else "s"
+        assoc_docs = []
+        for id_chunk in _chunks(list(resource_ids)):
+            where = "p=? AND %s IN (%s) ORDER BY %s" % (id_col, ",".join("?" * len(id_chunk)), id_col)
+            assoc_docs.extend(self._query_assocs(where, [predicate] + id_chunk))
+        return [self._persistence_dict_to_ion_object(doc) for doc in assoc_docs]
+
+    def find_objects(self, subject, predicate=None, object_type=None, id_only=False, **kwargs):
+        log.debug("find_objects(subject=%s, predicate=%s, object_type=%s, id_only=%s", subject, predicate, object_type, id_only)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if not subject:
+            raise BadRequest("Must provide subject")
+
+        if type(subject) is str:
+            subject_id = subject
+        else:
+            if "_id" not in subject:
+                raise BadRequest("Object id not available in subject")
+            else:
+                subject_id = subject._id
+
+        where, params = ["s=?"], [subject_id]
+        if predicate:
+            where.append("p=?")
+            params.append(predicate)
+            if object_type:
+                where.append("ot=?")
+                params.append(object_type)
+        assoc_docs = self._query_assocs(" AND ".join(where) + " ORDER BY s, p, ot, o", params, **kwargs)
+
+        obj_assocs = [self._persistence_dict_to_ion_object(doc) for doc in assoc_docs]
+        obj_ids = [assoc.o for assoc in obj_assocs]
+
+        log.debug("find_objects() found %s objects", len(obj_ids))
+        if id_only:
+            return (obj_ids, obj_assocs)
+
+        obj_list = self.read_mult(obj_ids)
+        return (obj_list, obj_assocs)
+
+    def find_subjects(self, subject_type=None, predicate=None, obj=None, id_only=False, **kwargs):
+        log.debug("find_subjects(subject_type=%s, predicate=%s, object=%s, id_only=%s", subject_type, predicate, obj, id_only)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if not obj:
+            raise BadRequest("Must provide object")
+
+        if type(obj) is str:
+            object_id = obj
+        else:
+            if "_id" not in obj:
+                raise BadRequest("Object id not available in object")
+            else:
+                object_id = obj._id
+
+        where, params = ["o=?"], [object_id]
+        if predicate:
+            where.append("p=?")
+            params.append(predicate)
+            if subject_type:
+                where.append("st=?")
+                params.append(subject_type)
+        assoc_docs = self._query_assocs(" AND ".join(where) + " ORDER BY o, p, st, s", params, **kwargs)
+
+        sub_assocs = [self._persistence_dict_to_ion_object(doc) for doc in assoc_docs]
+        sub_ids = [assoc.s for assoc in sub_assocs]
+
+        log.debug("find_subjects() found %s subjects", len(sub_ids))
+        if id_only:
+            return (sub_ids, sub_assocs)
+
+        sub_list = self.read_mult(sub_ids)
+        return (sub_list, sub_assocs)
+
+    def find_associations(self, subject=None, predicate=None, obj=None, assoc_type=None, id_only=True, anyobj=None, **kwargs):
+        log.debug("find_associations(subject=%s, predicate=%s, object=%s)", subject, predicate, obj)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if not (subject and obj or predicate or anyobj):
+            raise BadRequest("Illegal parameters")
+        if assoc_type and not predicate:
+            raise BadRequest("Illegal parameters")
+
+        if subject:
+            subject_id = subject if type(subject) is str else subject._id
+        if obj:
+            object_id = obj if type(obj) is str else obj._id
+
+        where, params = [], []
+        if subject and obj:
+            where.append("s=? AND o=?")
+            params.extend([subject_id, object_id])
+        elif subject is None and obj is None and anyobj:
+            where.append("(s=? OR o=?)")
+            params.extend([anyobj, anyobj])
+        elif subject:
+            where.append("(s=? OR o=?)")
+            params.extend([subject_id, subject_id])
+        if predicate:
+            where.append("p=?")
+            params.append(predicate)
+        if assoc_type:
+            where.append("at=?")
+            params.append(assoc_type)
+        if not where:
+            raise BadRequest("Illegal arguments")
+        assoc_docs = self._query_assocs(" AND ".join(where), params, **kwargs)
+
+        if id_only:
+            assocs = [doc['_id'] for doc in assoc_docs]
+        else:
+            assocs = [self._persistence_dict_to_ion_object(doc) for doc in assoc_docs]
+        log.debug("find_associations() found %s associations", len(assocs))
+        return assocs
+
+    def _find_res(self, where, params, order_by, id_only):
+        conn, datastore_name = self._get_datastore()
+        sql = "SELECT id, type_, lcstate, name%s FROM docs WHERE %s AND %s ORDER BY %s" % (
+              "" if id_only else ", doc", _IS_RES, where, order_by)
+        rows = conn.execute(sql, params).fetchall()
+        res_assocs = [dict(type=row[1], lcstate=row[2], name=row[3], id=row[0]) for row in rows]
+        if id_only:
+            res_ids = [row[0] for row in rows]
+            return (res_ids, res_assocs)
+        else:
+            res_docs = [self._persistence_dict_to_ion_object(self._decode_doc(row[4])) for row in rows]
+            return (res_docs, res_assocs)
+
+    def find_res_by_type(self, restype, lcstate=None, id_only=False):
+        log.debug("find_res_by_type(restype=%s, lcstate=%s)", restype, lcstate)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        where, params = ["1"], []
+        if restype:
+            where.append("type_=?")
+            params.append(restype)
+            if lcstate:
+                where.append("lcstate=?")
+                params.append(lcstate)
+        res = self._find_res(" AND ".join(where), params, "type_, lcstate, name", id_only)
+        log.debug("find_res_by_type() found %s objects", len(res[0]))
+        return res
+
+    def find_res_by_lcstate(self, lcstate, restype=None, id_only=False):
+        log.debug("find_res_by_lcstate(lcstate=%s, restype=%s)", lcstate, restype)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        # lcstate may be a hierarchical state, matching a set of actual states
+        lcstate_match = list(CommonResourceLifeCycleSM.STATE_ALIASES.get(lcstate, [lcstate]))
+        where, params = ["lcstate IN (%s)" % ",".join("?" * len(lcstate_match))], lcstate_match
+        if restype:
+            where.append("type_=?")
+            params.append(restype)
+        res = self._find_res(" AND ".join(where), params, "lcstate, type_, name", id_only)
+        log.debug("find_res_by_lcstate() found %s objects", len(res[0]))
+        return res
+
+    def find_res_by_name(self, name, restype=None, id_only=False):
+        log.debug("find_res_by_name(name=%s, restype=%s)", name, restype)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        where, params = ["name=?"], [name]
+        if restype:
+            where.append("type_=?")
+            params.append(restype)
+        res = self._find_res(" AND ".join(where), params, "name, type_, lcstate", id_only)
+        log.debug("find_res_by_name() found %s objects", len(res[0]))
+        return res
+
+    def find_dir_entries(self, qname):
+        log.debug("find_dir_entries(qname=%s)", qname)
+        if not str(qname).startswith('/'):
+            raise BadRequest("Illegal directory qname=%s" % qname)
+        conn, datastore_name = self._get_datastore()
+        sql = "SELECT doc FROM docs WHERE type_='DirEntry'"
+        params = []
+        if qname != '/':
+            prefix = str(qname)[1:]
+            sql += " AND (path=? OR substr(path, 1, ?)=?)"
+            params = [prefix, len(prefix) + 1, prefix + "/"]
+        rows = conn.execute(sql + " ORDER BY path", params)
+        res_entries = [self._persistence_dict_to_ion_object(self._decode_doc(row[0])) for row in rows]
+        log.debug("find_dir_entries() found %s objects", len(res_entries))
+        return res_entries
+
+    def find_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
+                           id_only=True, convert_doc=True, **kwargs):
+        """
+        @brief Generic find function using the SQL index equivalent to a CouchDB view.
+            See SQLITE_VIEWS for the supported views.
+        @retval Returns a list of triples: (doc_id, index_key, object or doc or None)
+        """
+        log.debug("find_by_view(%s/%s)", design_name, view_name)
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        conn, datastore_name = self._get_datastore()
+
+        if design_name == "_all_docs":
+            from_clause, where_clause, columns = _DOCS, "1", ['id']
+        elif (design_name, view_name) in SQLITE_VIEWS:
+            from_clause, where_clause, columns = SQLITE_VIEWS[(design_name, view_name)]
+        else:
+            raise BadRequest("View %s/%s not supported" % (design_name, view_name))
+        columns = [col if "." in col else "docs.%s" % col for col in columns]
+
+        where, params = [where_clause], []
+        if key is not None:
+            key = key if type(key) is list else [key]
+            if len(key) != len(columns):
+                return []
+            where.extend("%s=?" % col for col in columns)
+            params.extend(key)
+        elif keys:
+            key_conds = []
+            for k in keys:
+                k = k if type(k) is list else [k]
+                if len(k) == len(columns):
+                    key_conds.append("(%s)" % " AND ".join("%s=?" % col for col in columns))
+                    params.extend(k)
+            if not key_conds:
+                return []
+            where.append("(%s)" % " OR ".join(key_conds))
+        elif start_key and end_key:
+            # Equal leading key elements are matched exactly, the first differing element as range
+            for col, start_val, end_val in zip(columns, start_key, end_key):
+                if start_val == end_val:
+                    where.append("%s=?" % col)
+                    params.append(start_val)
+                else:
+                    where.append("%s>=? AND %s<=?" % (col, col))
+                    params.extend([start_val, end_val])
+                    break
+
+        order = " DESC" if kwargs.get('descending', False) else ""
+        # Rows with equal keys are ordered by id, as in CouchDB
+        sql = "SELECT docs.id, %s, docs.doc FROM %s WHERE %s ORDER BY %s" % (
+              ", ".join(columns), from_clause, " AND ".join(where), ", ".join(col + order for col in columns + ["docs.id"]))
+        limit, skip = int(kwargs.get('limit', 0)), int(kwargs.get('skip', 0))
+        if limit > 0 or skip > 0:
+            sql += " LIMIT %s OFFSET %s" % (limit if limit > 0 else -1, skip)
+
+        rows = conn.execute(sql, params).fetchall()
+        if id_only:
+            res_rows = [(row[0], list(row[1:-1]), None) for row in rows]
+        elif convert_doc:
+            res_rows = [(row[0], list(row[1:-1]), self._persistence_dict_to_ion_object(self._decode_doc(row[-1]))) for row in rows]
+        else:
+            res_rows = [(row[0], list(row[1:-1]), self._decode_doc(row[-1])) for row in rows]
+
+        log.info("find_by_view() found %s objects" % (len(res_rows)))
+        return res_rows
+
+    def _ion_object_to_persistence_dict(self, ion_object):
+        if ion_object is None: return None
+
+        obj_dict = self._io_serializer.serialize(ion_object)
+        return obj_dict
+
+    def _persistence_dict_to_ion_object(self, obj_dict):
+        if obj_dict is None: return None
+
+        ion_object = self._io_deserializer.deserialize(obj_dict)
+        return ion_object
@@ -5,10 +5,13 @@ __license__ = 'Apache 2.0'
 
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest, NotFound
+from pyon.core.registry import issubtype
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+from pyon.datastore.mockdb.mockdb_datastore import MockDB_DataStore
+from pyon.datastore.sqlite.sqlite_datastore import SQLite_DataStore
 from pyon.util.int_test import IonIntegrationTestCase
-from pyon.ion.resource import RT, PRED, LCS
+from pyon.ion.resource import RT, PRED, LCS, AT
 from nose.plugins.attrib import attr
 from unittest import SkipTest
 import socket
@@ -63,6 +66,173 @@ class Test_DataStores(IonIntegrationTestCase):
         except socket.error:
             raise SkipTest('Failed to connect to CouchDB')
 
+    def test_couchdb_pool(self):
+        import gevent
+        try:
+            ds1 = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+            ds2 = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+            if not ds1.datastore_exists('ion_test_ds'):
+                ds1.create_datastore('ion_test_ds', create_indexes=False)
+        except socket.error:
+            raise SkipTest('Failed to connect to CouchDB')
+
+        # Datastores to the same server share one pool
+        self.assertTrue(ds1._pool is ds2._pool)
+        pool = ds1._pool
+        pool.reset_stats()
+        max_conns = pool.max_connections
+
+        doc_id, _ = ds1.create_doc({"foo": "bar"})
+        gls = [gevent.spawn(ds.read_doc, doc_id) for ds in [ds1, ds2] * max_conns * 2]
+        gevent.joinall(gls, timeout=20, raise_error=True)
+        self.assertTrue(all(gl.value["foo"] == "bar" for gl in gls))
+
+        stats = ds2.get_pool_stats()
+        self.assertEquals(stats['requests']['GET']['count'], max_conns * 4)
+        self.assertEquals(stats['requests']['GET']['errors'], 0)
+        self.assertLessEqual(stats['connections_opened'], max_conns)
+        self.assertEquals(stats['active'], 0)
+        self.assertEquals(stats['waiting'], 0)
+
+        # Errors release their connection
+        with self.assertRaises(NotFound):
+            ds1.read_doc("unknown_doc")
+        self.assertEquals(ds1.get_pool_stats()['active'], 0)
+
+        ds1.delete_doc(doc_id)
+        ds1.close()
+        ds2.close()
+
+    def test_couchdb_view_warmer(self):
+        from pyon.datastore.datastore import ViewWarmer
+        try:
+            ds = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+            if ds.datastore_exists('ion_test_ds'):
+                ds.delete_datastore('ion_test_ds')
+            ds.create_datastore('ion_test_ds', create_indexes=True, profile=DataStore.DS_PROFILE.RESOURCES)
+        except socket.error:
+            raise SkipTest('Failed to connect to CouchDB')
+
+        ds.create_mult([IonObject(RT.ActorIdentity, name="actor%s" % i) for i in xrange(20)])
+        view_lag = ds.get_view_lag()
+        self.assertIn("resource/by_type", view_lag)
+        self.assertGreater(view_lag["resource/by_type"], 0)
+
+        # Stale queries do not wait for the index
+        res = ds.find_by_view("resource", "by_type", stale="ok")
+        self.assertLessEqual(len(res), 20)
+        with self.assertRaises(BadRequest):
+            ds.find_by_view("resource", "by_type", stale="never")
+
+        warmer = ViewWarmer(bulk_threshold=10)
+        warmer.warm(ds)
+        view_stats = warmer.get_stats()['ion_test_ds']
+        self.assertEquals(view_stats["resource/by_type"]['lag'], 0)
+        self.assertGreaterEqual(view_stats["resource/by_type"]['warm_time'], 0)
+        self.assertEquals(ds.get_view_lag()["resource/by_type"], 0)
+        self.assertEquals(len(ds.find_by_view("resource", "by_type", stale="ok")), 20)
+
+        ds.delete_datastore('ion_test_ds')
+        ds.close()
+
+    def test_instrumentation(self):
+        from pyon.datastore.instrumentation import InstrumentedDataStore, DatastoreStats, HISTOGRAM_BOUNDS
+        ds_stats = DatastoreStats()
+        data_store = InstrumentedDataStore(MockDB_DataStore(datastore_name='ion_test_ds'), 'test', ds_stats)
+        data_store.create_datastore()
+        data_store.local_name = 'test'
+        self.assertEquals(data_store._datastore.local_name, 'test')
+
+        res = data_store.create_doc_mult([{"foo": "bar%s" % i} for i in xrange(5)])
+        doc_ids = [doc_id for _, doc_id, _ in res]
+        data_store.read_doc(doc_ids[0])
+        data_store.read_doc_mult(doc_ids[:3])
+        with self.assertRaises(NotFound):
+            data_store.read_doc("unknown_doc")
+
+        stats = ds_stats.get_stats()['test']
+        self.assertEquals(stats['create_doc_mult']['count'], 1)
+        self.assertEquals(stats['create_doc_mult']['docs'], 5)
+        self.assertEquals(stats['read_doc']['count'], 2)
+        self.assertEquals(stats['read_doc']['errors'], 1)
+        self.assertEquals(stats['read_doc']['docs'], 1)
+        self.assertEquals(stats['read_doc_mult']['docs'], 3)
+        self.assertEquals(sum(stats['read_doc']['histogram']), 2)
+        self.assertEquals(len(stats['read_doc']['histogram']), len(HISTOGRAM_BOUNDS) + 1)
+        self.assertNotIn('_get_datastore', stats)
+        self.assertEquals(ds_stats.get_totals()['count'], 5)
+        self.assertEquals(ds_stats.get_percentile(stats['read_doc']['histogram'], 95), HISTOGRAM_BOUNDS[0])
+
+        ds_stats.reset()
+        self.assertEquals(ds_stats.get_stats(), {})
+
+    def test_non_persistent(self):
+        self._do_test_views(MockDB_DataStore(datastore_name='ion_test_ds'))
+
+        # Indexed finds must follow updates and deletes
+        data_store = self.data_store
+        res_obj = data_store.read(self.resources['CTD2']._id)
+        res_obj.name = 'CTD2b'
+        data_store.update(res_obj)
+        self.assertEquals(data_store.find_res_by_name('CTD2', id_only=True)[0], [])
+        self.assertEquals(data_store.find_res_by_name('CTD2b', id_only=True)[0], [res_obj._id])
+
+        rows = data_store.find_by_view("resource", "by_type", start_key=[RT.InstrumentDevice], end_key=[RT.InstrumentDevice])
+        self.assertEquals(len(rows), 3)
+
+        data_store.delete(res_obj._id)
+        self.assertEquals(data_store.find_res_by_name('CTD2b', id_only=True)[0], [])
+        self.assertEquals(len(data_store.find_res_by_type(RT.InstrumentDevice, id_only=True)[0]), 2)
+
+    def test_sqlite(self):
+        self._do_test(SQLite_DataStore(path=":memory:", datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES))
+
+        ds = SQLite_DataStore(path=":memory:", datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES)
+        with self.assertRaises(BadRequest):
+            ds.create_datastore("BadDataStoreNamePerCouchDB")
+
+        self._do_test_views(ds)
+
+    def test_bulk_preload(self):
+        self._do_test_preload(MockDB_DataStore(datastore_name='ion_test_ds'))
+        self._do_test_preload(SQLite_DataStore(path=":memory:", datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES))
+
+    def _do_test_preload(self, data_store):
+        import os
+        import simplejson
+        import tempfile
+        from pyon.datastore.datastore import iter_preload_file
+        data_store.create_datastore()
+
+        fd, filename = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w") as f:
+            f.write("# Preload test\n")
+            for i in xrange(25):
+                f.write(simplejson.dumps(dict(_id="dev%s" % i, type_=RT.InstrumentDevice, name="Device%s" % i, lcstate=LCS.DRAFT)) + "\n")
+            f.write("\n")
+            for i in xrange(5):
+                f.write(simplejson.dumps(dict(_id="assoc%s" % i, type_="Association", at=AT.H2H, srv="", orv="",
+                                              s="dev%s" % i, st=RT.InstrumentDevice, p=PRED.hasResource,
+                                              o="dev%s" % (i + 10), ot=RT.InstrumentDevice, retired=False)) + "\n")
+        try:
+            stats = data_store.bulk_preload(iter_preload_file(filename), batch_size=10, concurrency=2)
+        finally:
+            os.remove(filename)
+        self.assertEquals(stats['num_docs'], 30)
+        self.assertEquals(stats['num_errors'], 0)
+        self.assertGreater(stats['docs_per_sec'], 0)
+
+        self.assertEquals(len(data_store.find_res_by_type(RT.InstrumentDevice, id_only=True)[0]), 25)
+        self.assertEquals(data_store.read("dev3").name, "Device3")
+        obj_ids, _ = data_store.find_objects("dev2", PRED.hasResource, id_only=True)
+        self.assertEquals(obj_ids, ["dev12"])
+
+        # Existing ids are reported per doc
+        stats = data_store.bulk_preload([dict(_id="dev1", type_=RT.InstrumentDevice, name="Device1", lcstate=LCS.DRAFT)])
+        self.assertEquals(stats['num_errors'], 1)
+
+        data_store.delete_datastore()
+
     def _do_test(self, data_store):
         self.data_store = data_store
         self.resources = {}
@@ -143,6 +313,13 @@ class Test_DataStores(IonIntegrationTestCase):
         self.assertTrue(role_objs[1]._id == data_provider_role_ooi_id)
         self.assertTrue(role_objs[2]._id == marine_operator_role_ooi_id)
 
+        with self.assertRaises(NotFound):
+            data_store.read_mult([admin_role_ooi_id, "badid"])
+        role_objs = data_store.read_mult([admin_role_ooi_id, "badid"], strict=False)
+        self.assertEquals(role_objs[0]._id, admin_role_ooi_id)
+        self.assertEquals(role_objs[1], None)
+        self.assertEquals(data_store.read_mult_existing([admin_role_ooi_id, "badid"]).keys(), [admin_role_ooi_id])
+
         # Construct three user info objects and assign them roles
         hvl_contact_info = {
             "name": "Heitor Villa-Lobos",
@@ -512,6 +689,25 @@ class Test_DataStores(IonIntegrationTestCase):
         assocs = data_store.find_associations(None, OWNER_OF, None, id_only=True)
         self.assertEquals(len(assocs), 3)
 
+        # Multi-hop traversal
+        obj_ids, level_assocs = data_store.traverse(admin_user_id, [OWNER_OF, HAS_A], id_only=True)
+        self.assertEquals(obj_ids, [ds1_obj_id])
+        self.assertEquals([len(la) for la in level_assocs], [2, 1])
+
+        obj_ids, level_assocs = data_store.traverse(admin_user_id, [(OWNER_OF, RT.InstrumentDevice)], id_only=True)
+        self.assertEquals(obj_ids, [inst1_obj_id])
+
+        objs, level_assocs = data_store.traverse(ds1_obj_id, [HAS_A, HAS_A], reverse=True)
+        self.assertEquals([o._id for o in objs], [plat1_obj_id])
+
+        obj_ids, level_assocs = data_store.traverse([admin_user_id, other_user_id], [OWNER_OF, BASED_ON], id_only=True)
+        self.assertEquals(obj_ids, [ds1_obj_id])
+        self.assertEquals([len(la) for la in level_assocs], [3, 1])
+
+        obj_ids, level_assocs = data_store.traverse("Non_Existent", [OWNER_OF, HAS_A], id_only=True)
+        self.assertEquals(obj_ids, [])
+        self.assertEquals(level_assocs, [[], []])
+
         # Test regression bug: Inherited resources in associations
         idev1_obj_id = self._create_resource(RT.InstrumentDevice, 'id1', description='')
 
@@ -519,6 +715,37 @@ class Test_DataStores(IonIntegrationTestCase):
 
         data_store.create_association(idev1_obj_id, PRED.hasAgentInstance, iag1_obj_id)
 
+        # Resources of a type and all its subtypes
+        res_ids, res_assocs = data_store.find_res_by_subtypes(RT.InstrumentDevice, id_only=True)
+        self.assertTrue(set([inst1_obj_id, inst2_obj_id, idev1_obj_id]) <= set(res_ids))
+        self.assertTrue(all([issubtype(ra['type'], RT.InstrumentDevice) for ra in res_assocs]))
+
+        res_objs, _ = data_store.find_res_by_subtypes("Resource", id_only=False)
+        self.assertTrue(set([admin_user_id, plat1_obj_id, ds1_obj_id, iag1_obj_id]) <= set([o._id for o in res_objs]))
+
+        with self.assertRaises(BadRequest):
+            data_store.find_res_by_subtypes("")
+        with self.assertRaises(BadRequest):
+            data_store.find_res_by_subtypes("NoSuchType")
+
+        # Bulk association creation
+        assoc_res = data_store.create_association_mult([
+            (other_user_id, OWNER_OF, ds2_obj_id),
+            (admin_user_id, OWNER_OF, inst1_obj_id),
+            (other_user_id, OWNER_OF, ds2_obj_id, AT.H2H),
+            ("Non_Existent", OWNER_OF, ds2_obj_id),
+            (plat1_obj_id, HAS_A, inst2_obj_id)])
+        self.assertEquals([success for success, _, _ in assoc_res], [True, False, False, False, True])
+        self.assertIsInstance(assoc_res[1][2], BadRequest)
+        self.assertIsInstance(assoc_res[2][2], BadRequest)
+        self.assertIsInstance(assoc_res[3][2], NotFound)
+        self.assertEquals(data_store.read(assoc_res[0][1]).o, ds2_obj_id)
+
+        obj_ids, _ = data_store.find_objects(other_user_id, OWNER_OF, id_only=True)
+        self.assertEquals(set(obj_ids), set([inst2_obj_id, ds2_obj_id]))
+        obj_ids, _ = data_store.find_objects(plat1_obj_id, HAS_A, id_only=True)
+        self.assertEquals(set(obj_ids), set([inst1_obj_id, inst2_obj_id]))
+
 
     def _create_resource(self, restype, name, *args, **kwargs):
         res_obj = IonObject(restype, dict(name=name, **kwargs))
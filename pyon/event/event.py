@@ -5,12 +5,20 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
-from gevent import event as gevent_event
+import os
+import shutil
+import time
+from itertools import islice
+from uuid import uuid4
+
+import simplejson
+from gevent import event as gevent_event, queue as gevent_queue, coros
 
 from pyon.core import bootstrap
 from pyon.core.exception import BadRequest, IonException
 from pyon.datastore.datastore import DataStore
 from pyon.net.endpoint import Publisher, Subscriber
+from pyon.net.transport import NameTrio
 from pyon.util.async import spawn
 from pyon.util.containers import get_ion_ts
 from pyon.util.log import log
@@ -21,6 +29,22 @@ from interface.objects import Event
 EVENTS_XP = "pyon.events"
 EVENTS_XP_TYPE = "topic"
 
+# Event views usable by EventRepository.find_events, most selective first, with the
+# event attributes of their key prefix. All event view keys end with ts_created.
+EVENT_QUERY_VIEWS = [
+    ('by_origintype', ['origin', 'type_']),
+    ('by_origin', ['origin']),
+    ('by_typesub', ['type_', 'sub_type']),
+    ('by_origintype_type', ['origin_type', 'type_']),
+    ('by_type', ['type_']),
+    ('by_origintype_time', ['origin_type']),
+    ('by_time', []),
+]
+EVENT_QUERY_PAGE_SIZE = 500
+
+# High key value in view range queries, as in the datastores
+END_MARKER = "ZZZZZZ"
+
 def get_events_exchange_point():
     return "%s.%s" % (bootstrap.get_sys_name(), EVENTS_XP)
 
@@ -78,7 +102,7 @@ class EventPublisher(Publisher):
 
         return event_msg
 
-    def _publish_event(self, event_msg, origin, event_type=None):
+    def _publish_event(self, event_msg, origin, event_type=None, store=True):
         event_type = event_type or self.event_type or event_msg._get_type()
         assert origin and event_type
 
@@ -96,7 +120,7 @@ class EventPublisher(Publisher):
 
         try:
             # store published event but only if we specified an event_repo
-            if self.event_repo:
+            if self.event_repo and store:
                 self.event_repo.put_event(event_msg)
         except Exception as ex:
             log.exception("Failed to store published event '%s'" % (event_msg))
@@ -119,6 +143,55 @@ class EventPublisher(Publisher):
         success = self._publish_event(event_msg, origin=origin)
         return success
 
+    def publish_event_mult(self, event_list):
+        """
+        Publishes a list of events, each given as dict of publish_event keyword arguments.
+        All events are sent through one endpoint and channel, each with its own routing key
+        because subscribers bind to it, and are stored in the event repository with one bulk
+        write. Like publish_event, this operation logs errors but does not fail with an exception.
+        @param event_list list of dicts with origin, event_type and other event fields
+        @retval list of (published, stored) bool tuples, one per event. stored is False for events
+                not published, if there is no event repository or if the bulk write failed.
+        """
+        published = [False] * len(event_list)
+        events = []     # (index, event_msg) of published events
+        ep = None
+        try:
+            for num, event_args in enumerate(event_list):
+                event_args = dict(event_args)
+                origin = event_args.pop('origin', None)
+                event_type = event_args.pop('event_type', None)
+                try:
+                    event_msg = self._create_event(origin=origin, event_type=event_type, **event_args)
+                    event_type = event_type or self.event_type or event_msg._get_type()
+                    topic = self._topic(event_type, origin, base_types=event_msg.base_types,
+                        sub_type=event_msg.sub_type, origin_type=event_msg.origin_type)
+                    to_name = NameTrio(self._send_name.exchange, topic)
+                    if ep is None:
+                        ep = self.create_endpoint(to_name)
+                    else:
+                        ep.channel.connect(to_name)
+                    ep.send(event_msg)
+                except Exception:
+                    log.exception("Failed to publish event for origin=%s" % origin)
+                    continue
+                published[num] = True
+                events.append((num, event_msg))
+        finally:
+            if ep:
+                ep.close()
+
+        stored = [False] * len(event_list)
+        if self.event_repo and events:
+            try:
+                self.event_repo.put_events([event_msg for num, event_msg in events])
+                for num, event_msg in events:
+                    stored[num] = True
+            except Exception:
+                log.exception("Failed to store %s published events" % len(events))
+
+        return zip(published, stored)
+
 class EventSubscriber(Subscriber):
 
     def _topic(self, event_type, origin, sub_type=None, origin_type=None):
@@ -199,75 +272,396 @@ class EventSubscriber(Subscriber):
         self._cbthread = None
         log.info("EventSubscriber deactivated. Event pattern=%s" % self.binding)
 
+class EventPersistenceBuffer(object):
+    """
+    Write-behind buffer for persisting events. put() queues an event and returns immediately;
+    a background greenlet writes queued events in batches with one create_mult call, whenever
+    max_batch events are pending or flush_interval seconds have passed since the first one.
+    If the queue is full because the datastore cannot keep up, put() blocks for up to
+    put_timeout seconds (backpressure). If the queue is still full and a spill_path is set,
+    the event is appended to a JSON-lines spill file that is replayed once the queue drains,
+    otherwise the event is written synchronously. Events put after stop() are written
+    synchronously as well.
+    """
+
+    def __init__(self, event_store, max_batch=100, flush_interval=0.5, max_queue=10000, put_timeout=1.0, spill_path=None):
+        self.event_store = event_store
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_path = spill_path
+
+        self._queue = gevent_queue.Queue(maxsize=max_queue)
+        self._write_lock = coros.RLock()
+        self._spill_count = 0       # Events in the spill file
+        self._replay_count = 0      # Events in the replay file, not yet written
+        self._inflight = []         # Batch taken off the queue by the writer, not yet written
+        self._gl = None
+        self._stopped = True
+        self._closed = False        # Set by stop(), until the buffer is started again
+
+        self.stats = dict(queued=0, written=0, written_sync=0, failed=0, spilled=0, flushes=0, max_queue_depth=0,
+                          flush_time_total=0.0, flush_time_max=0.0, flush_time_last=0.0)
+
+    def start(self):
+        assert not self._gl, "EventPersistenceBuffer already started"
+        self._stopped, self._closed = False, False
+        self._gl = spawn(self._run)
+
+    def stop(self, timeout=10):
+        """
+        Stops the background writer and flushes all pending and spilled events.
+        """
+        self._stopped, self._closed = True, True
+        if self._gl:
+            self._gl.join(timeout=timeout)
+            if not self._gl.ready():
+                # Let a write in progress finish; the writer can not start another one while the lock is held
+                with self._write_lock:
+                    self._gl.kill(block=True)
+            self._gl = None
+        self.flush()
+
+    def put(self, event):
+        event_id = uuid4().hex
+        if self._closed:
+            # Nothing drains the queue any more
+            self.stats['written_sync'] += 1
+            return self.event_store.create(event, object_id=event_id)
+        try:
+            self._queue.put((event_id, event), block=self.put_timeout > 0, timeout=self.put_timeout)
+        except gevent_queue.Full:
+            if self.spill_path:
+                self._spill([(event_id, event)])
+                return event_id, None
+            log.warn("Event persistence queue full, storing event synchronously")
+            self.stats['written_sync'] += 1
+            return self.event_store.create(event, object_id=event_id)
+        self.stats['queued'] += 1
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._queue.qsize())
+        return event_id, None
+
+    def flush(self):
+        """
+        Synchronously writes all currently queued and spilled events, including the ones
+        the background writer has taken off the queue but not written yet.
+        """
+        self._write_batch(self._inflight)
+        while True:
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except gevent_queue.Empty:
+                    break
+            if not batch:
+                break
+            self._write_batch(batch)
+        if self._spill_count or self._replay_count:
+            self._replay_spill()
+
+    def get_stats(self):
+        """
+        Returns a dict of buffer metrics, including current queue depth and flush latency in seconds.
+        """
+        stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['spill_depth'] = self._spill_count + self._replay_count
+        stats['flush_time_avg'] = stats['flush_time_total'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._collect_batch(self._inflight)
+                if self._inflight:
+                    self._write_batch(self._inflight)
+                elif self._spill_count or self._replay_count:
+                    self._replay_spill()
+            except Exception:
+                log.exception("Error in event persistence buffer")
+
+    def _collect_batch(self, batch):
+        """
+        Appends queued events to batch, waiting for up to flush_interval for the first one
+        and flush_interval after it for max_batch events.
+        """
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except gevent_queue.Empty:
+            return
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except gevent_queue.Empty:
+                break
+
+    def _write_batch(self, batch):
+        """
+        Writes the events in batch and removes them from it, while holding the write lock.
+        Events appended to batch during the write are kept.
+        """
+        with self._write_lock:
+            entries = batch[:]
+            if not entries:
+                return
+            t1 = time.time()
+            try:
+                res = self.event_store.create_mult([ev for ev_id, ev in entries], [ev_id for ev_id, ev in entries])
+            except Exception:
+                log.exception("Failed to store %s events", len(entries))
+                if self.spill_path:
+                    self._spill(entries)
+                else:
+                    self.stats['failed'] += len(entries)
+                return
+            finally:
+                del batch[:len(entries)]
+            self._record_flush(res, time.time() - t1)
+
+    def _record_flush(self, res, latency):
+        failed = len([success for success, oid, rev in res if not success])
+        self.stats['written'] += len(res) - failed
+        self.stats['failed'] += failed
+        self.stats['flushes'] += 1
+        self.stats['flush_time_last'] = latency
+        self.stats['flush_time_total'] += latency
+        self.stats['flush_time_max'] = max(self.stats['flush_time_max'], latency)
+        log.debug("Stored %s events in %.3f sec, %s failed", len(res), latency, failed)
+
+    def _spill(self, batch):
+        with open(self.spill_path, "a") as f:
+            for event_id, event in batch:
+                doc = self.event_store._ion_object_to_persistence_dict(event)
+                f.write(simplejson.dumps(dict(id=event_id, doc=doc)) + "\n")
+        self._spill_count += len(batch)
+        self.stats['spilled'] += len(batch)
+
+    def _replay_spill(self):
+        """
+        Writes the spilled events. The spill file is appended to the replay file, which may still
+        hold events of an earlier replay that failed, and removed. The replay file is removed once
+        all its events are written; if a write fails it is rewritten with the events not written.
+        """
+        with self._write_lock:
+            replay_path = self.spill_path + ".replay"
+            if os.path.exists(self.spill_path):
+                with open(self.spill_path, "r") as spill_file:
+                    with open(replay_path, "a") as replay_file:
+                        shutil.copyfileobj(spill_file, replay_file)
+                os.remove(self.spill_path)
+                self._replay_count += self._spill_count
+            self._spill_count = 0
+            if not os.path.exists(replay_path):
+                self._replay_count = 0
+                return
+
+            with open(replay_path, "r") as f:
+                entries = [simplejson.loads(line) for line in f if line.strip()]
+            self._replay_count = len(entries)
+            for i in xrange(0, len(entries), self.max_batch):
+                chunk = entries[i:i + self.max_batch]
+                t1 = time.time()
+                try:
+                    res = self.event_store.create_doc_mult([_str_dict(e['doc']) for e in chunk], [str(e['id']) for e in chunk])
+                except Exception:
+                    log.exception("Failed to replay %s spilled events, keeping them in %s", len(entries) - i, replay_path)
+                    self._write_entries(replay_path, entries[i:])
+                    self._replay_count = len(entries) - i
+                    return
+                self._record_flush(res, time.time() - t1)
+            os.remove(replay_path)
+            self._replay_count = 0
+            log.info("Replayed %s spilled events", len(entries))
+
+    def _write_entries(self, path, entries):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in entries:
+                f.write(simplejson.dumps(entry) + "\n")
+        os.rename(tmp_path, path)
+
+def _get_event_attr(event, attr):
+    return event._get_type() if attr == 'type_' else getattr(event, attr, None)
+
+def _str_dict(doc):
+    """
+    Converts the unicode strings of a decoded JSON doc back to str, as expected by the datastores.
+    """
+    if isinstance(doc, dict):
+        return dict((str(k), _str_dict(v)) for k, v in doc.iteritems())
+    elif isinstance(doc, list):
+        return [_str_dict(v) for v in doc]
+    elif isinstance(doc, unicode):
+        return doc.encode("utf8")
+    return doc
+
 class EventRepository(object):
     """
     Class that uses a data store to provide a persistent repository for ION events.
     """
 
-    def __init__(self, datastore_manager=None):
+    def __init__(self, datastore_manager=None, buffered=None):
 
         # Get an instance of datastore configured as directory.
         # May be persistent or mock, forced clean, with indexes
         datastore_manager = datastore_manager or bootstrap.container_instance.datastore_manager
         self.event_store = datastore_manager.get_datastore("events", DataStore.DS_PROFILE.EVENTS)
 
+        # Optional write-behind buffering of events, see EventPersistenceBuffer
+        buffer_cfg = bootstrap.CFG.get_safe('container.event_repository.buffer', None) or {}
+        if buffered is None:
+            buffered = buffer_cfg.get('enabled', False)
+        self.event_buffer = None
+        if buffered:
+            self.event_buffer = EventPersistenceBuffer(self.event_store,
+                max_batch=buffer_cfg.get('max_batch', 100),
+                flush_interval=buffer_cfg.get('flush_interval', 0.5),
+                max_queue=buffer_cfg.get('max_queue', 10000),
+                put_timeout=buffer_cfg.get('put_timeout', 1.0),
+                spill_path=buffer_cfg.get('spill_path', None))
+            self.event_buffer.start()
+
     def close(self):
         """
-        Pass-through method to close the underlying datastore.
+        Pass-through method to close the underlying datastore. Flushes buffered events first.
         """
+        if self.event_buffer:
+            self.event_buffer.stop()
         self.event_store.close()
 
     def put_event(self, event):
+        """
+        Stores an event persistently. If buffering is enabled, the event is written later
+        in a batch and the returned rev is None.
+        """
         log.debug("Store event persistently %s" % event)
         if not isinstance(event, Event):
             raise BadRequest("event must be type Event, not %s" % type(event))
+        if self.event_buffer:
+            return self.event_buffer.put(event)
         return self.event_store.create(event)
 
+    def put_events(self, events):
+        """
+        Stores a list of events persistently with one bulk write.
+        Returns a list of (success, event_id, rev) tuples.
+        """
+        log.debug("Store %s events persistently" % len(events))
+        if any([not isinstance(event, Event) for event in events]):
+            raise BadRequest("events must be type Event")
+        return self.event_store.create_mult(events)
+
+    def flush(self):
+        """
+        Writes all buffered events to the datastore.
+        """
+        if self.event_buffer:
+            self.event_buffer.flush()
+
+    def get_stats(self):
+        """
+        Returns event buffer metrics (queue depth, flush latency), or None if not buffered.
+        """
+        if self.event_buffer:
+            return self.event_buffer.get_stats()
+        return None
+
     def get_event(self, event_id):
         log.debug("Retrieving persistent event for id=%s" % event_id)
         event_obj = self.event_store.read(event_id)
         return event_obj
 
-    def find_events(self, event_type=None, origin=None, start_ts=None, end_ts=None, **kwargs):
-        log.debug("Retrieving persistent event for event_type=%s, origin=%s, start_ts=%s, end_ts=%s, descending=%s, limit=%s" % (
-            event_type,origin,start_ts,end_ts,kwargs.get("descending", None),kwargs.get("limit",None)))
-        events = None
-
-        design_name = "event"
-        view_name = None
-        start_key = []
-        end_key = []
-        if origin and event_type:
-            view_name = "by_origintype"
-            start_key=[origin, event_type]
-            end_key=[origin, event_type]
-        elif origin:
-            view_name = "by_origin"
-            start_key=[origin]
-            end_key=[origin]
-        elif event_type:
-            view_name = "by_type"
-            start_key=[event_type]
-            end_key=[event_type]
-        elif start_ts or end_ts:
-            view_name = "by_time"
-            start_key=[]
-            end_key=[]
-        else:
-            view_name = "by_time"
-            if kwargs.get("limit", 0) < 1:
-                kwargs["limit"] = 100
-                log.warn("Querying all events, no limit given. Set limit to 100")
-
-        if start_ts:
-            start_key.append(start_ts)
-        if end_ts:
-            end_key.append(end_ts)
+    def find_events(self, event_type=None, origin=None, start_ts=None, end_ts=None, origin_type=None, sub_type=None, **kwargs):
+        """
+        Returns a list of (event_id, view_key, event) triples for events matching all of the given
+        criteria, in ts_created order (reversed if descending=True). The most selective event view
+        covering the criteria is used (see EVENT_QUERY_VIEWS); remaining criteria are filtered
+        while paging through the view, such that limit and skip apply to the filtered result.
+        """
+        log.debug("Retrieving persistent event for event_type=%s, origin=%s, origin_type=%s, sub_type=%s, start_ts=%s, end_ts=%s, descending=%s, limit=%s" % (
+            event_type,origin,origin_type,sub_type,start_ts,end_ts,kwargs.get("descending", None),kwargs.get("limit",None)))
+
+        criteria = dict((attr, value) for attr, value in (('origin', origin), ('type_', event_type),
+                        ('origin_type', origin_type), ('sub_type', sub_type)) if value)
+        view_name, view_attrs = self._plan_event_query(criteria)
+        residual = dict((attr, value) for attr, value in criteria.iteritems() if attr not in view_attrs)
+
+        if not criteria and not (start_ts or end_ts) and kwargs.get("limit", 0) < 1:
+            kwargs["limit"] = 100
+            log.warn("Querying all events, no limit given. Set limit to 100")
+
+        start_key = [criteria[attr] for attr in view_attrs]
+        end_key = list(start_key)
+        if start_ts or end_ts:
+            # Keys must be of equal length for a range over the trailing ts_created
+            start_key.append(start_ts or "")
+            end_key.append(end_ts or END_MARKER)
+
+        if not residual:
+            return self.event_store.find_by_view("event", view_name, start_key=start_key, end_key=end_key,
+                id_only=False, **kwargs)
+
+        limit = int(kwargs.pop("limit", 0))
+        skip = int(kwargs.pop("skip", 0))
+        if limit < 1:
+            limit = 100
+            log.warn("Querying events with filtered criteria %s, no limit given. Set limit to 100", residual.keys())
+        events = list(islice(self._iter_filtered_events(view_name, start_key, end_key, residual, limit, **kwargs),
+                             skip, skip + limit if limit > 0 else None))
+        return events
 
-        events = self.event_store.find_by_view(design_name, view_name, start_key=start_key, end_key=end_key,
-            id_only=False, **kwargs)
+    def _plan_event_query(self, criteria):
+        """
+        Returns the (view name, key attributes) of the first view in EVENT_QUERY_VIEWS
+        with all key attributes given in criteria.
+        """
+        for view_name, view_attrs in EVENT_QUERY_VIEWS:
+            if all(attr in criteria for attr in view_attrs):
+                return view_name, view_attrs
 
-        return events
+    def _iter_filtered_events(self, view_name, start_key, end_key, residual, limit=0, **kwargs):
+        """
+        Generator paging through an event view in key order, yielding the rows with
+        events matching all residual criteria. Each page starts at the key of the last
+        row of the previous page and only skips the rows with that key already seen,
+        so that paging does not rescan the view.
+        """
+        page_size = max(limit, EVENT_QUERY_PAGE_SIZE)
+        descending = kwargs.get("descending", False)
+        page_start, page_end = start_key, end_key
+        resume_key, view_skip = None, 0
+        while True:
+            rows = self.event_store.find_by_view("event", view_name, start_key=page_start, end_key=page_end,
+                id_only=False, limit=page_size, skip=view_skip, **kwargs)
+            for row in rows:
+                event = row[2]
+                if all(_get_event_attr(event, attr) == value for attr, value in residual.iteritems()):
+                    yield row
+            if len(rows) < page_size:
+                break
+
+            last_key = rows[-1][1]
+            same_key = 0
+            for row in reversed(rows):
+                if row[1] != last_key:
+                    break
+                same_key += 1
+            # A page of rows all with the key the page started at continues past the skipped ones
+            view_skip = view_skip + same_key if same_key == len(rows) and last_key == resume_key else same_key
+            resume_key = last_key
+
+            # The other end of the range is padded to the length of the full view key
+            if descending:
+                page_start = start_key + [""] * (len(last_key) - len(start_key))
+                page_end = last_key
+            else:
+                page_start = last_key
+                page_end = end_key + [END_MARKER] * (len(last_key) - len(end_key))
 
 class EventGate(EventSubscriber):
     def __init__(self, *args, **kwargs):
@@ -4,15 +4,19 @@ from pyon.datastore.datastore import DatastoreManager
 __author__ = 'Dave Foster <dfoster@asascience.com>, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+import os
+import tempfile
 import time
 
 from mock import Mock, sentinel, patch
 from nose.plugins.attrib import attr
+import gevent
 from gevent import event, queue
 from unittest import SkipTest
 
 from pyon.core import bootstrap
-from pyon.event.event import EventPublisher, EventSubscriber, EventRepository
+from pyon.datastore.datastore import DataStore
+from pyon.event.event import EventPublisher, EventSubscriber, EventRepository, EventPersistenceBuffer
 from pyon.util.async import spawn
 from pyon.util.log import log
 from pyon.util.containers import get_ion_ts, DotDict
@@ -65,6 +69,35 @@ class TestEvents(IonIntegrationTestCase):
         evs = self.container.event_repository.find_events(origin='specifics')
         self.assertEquals(len(evs), 1)
 
+    def test_pub_mult(self):
+        ar = event.AsyncResult()
+        gq = queue.Queue()
+
+        def cb(*args, **kwargs):
+            gq.put(args[0])
+            if gq.qsize() == 2:
+                ar.set()
+
+        sub = EventSubscriber(event_type="ResourceEvent", callback=cb, origin="mult_one")
+        self._listen(sub)
+
+        pub = EventPublisher(event_type="ResourceEvent", node=self.container.node)
+        res = pub.publish_event_mult([dict(origin="mult_one", description="1"),
+                                      dict(origin="mult_two", description="2"),
+                                      dict(origin="mult_one", description="3")])
+        self.assertEquals(res, [(True, True)] * 3)
+
+        ar.get(timeout=5)
+        self.assertEquals([gq.get(timeout=5).description for x in xrange(2)], ["1", "3"])
+
+        evs = self.container.event_repository.find_events(origin='mult_two')
+        self.assertEquals(len(evs), 1)
+
+        # Events are published even if they cannot be stored
+        with patch.object(pub.event_repo, 'put_events', Mock(side_effect=Exception)):
+            res = pub.publish_event_mult([dict(origin="mult_one", description="4")])
+        self.assertEquals(res, [(True, False)])
+
     def test_pub_on_different_origins(self):
         ar = event.AsyncResult()
         gq = queue.Queue()
@@ -290,3 +323,152 @@ class TestEventRepository(IonUnitTestCase):
 
         events_r = event_repo.find_events(event_type="ResourceLifecycleEvent")
         self.assertEquals(len(events_r), 1)
+
+        for i in xrange(4):
+            ev = ResourceLifecycleEvent(origin="resource%s" % (7 + i % 2), origin_type="InstrumentDevice",
+                                        sub_type="DEPLOYED" if i < 3 else "RETIRED", ts_created=str(ts + 10 + i))
+            event_repo.put_event(ev)
+
+        events_r = event_repo.find_events(origin_type="InstrumentDevice")
+        self.assertEquals(len(events_r), 4)
+        self.assertEquals([ev.ts_created for _, _, ev in events_r], [str(ts + 10 + i) for i in xrange(4)])
+
+        events_r = event_repo.find_events(origin_type="InstrumentDevice", start_ts=str(ts+12))
+        self.assertEquals(len(events_r), 2)
+
+        events_r = event_repo.find_events(event_type="ResourceLifecycleEvent", sub_type="DEPLOYED")
+        self.assertEquals(len(events_r), 3)
+
+        events_r = event_repo.find_events(origin="resource7", sub_type="DEPLOYED")
+        self.assertEquals(len(events_r), 2)
+
+        events_r = event_repo.find_events(origin_type="InstrumentDevice", event_type="ResourceLifecycleEvent", end_ts=str(ts+11))
+        self.assertEquals(len(events_r), 2)
+
+        events_r = event_repo.find_events(sub_type="DEPLOYED", descending=True, limit=2)
+        self.assertEquals([ev.ts_created for _, _, ev in events_r], [str(ts + 12), str(ts + 11)])
+
+        # Filtered queries page by key, not by growing offsets, also through rows with equal keys
+        ts_offsets = [20, 20, 20, 21, 22, 22, 23, 24, 24]
+        for i, offset in enumerate(ts_offsets):
+            event_repo.put_event(ResourceLifecycleEvent(origin="resource9", sub_type="DEPLOYED" if i % 2 else "RETIRED",
+                                                        ts_created=str(ts + offset)))
+        expected = [str(ts + offset) for i, offset in enumerate(ts_offsets) if i % 2]
+
+        event_store = Mock(wraps=event_repo.event_store)
+        with patch('pyon.event.event.EVENT_QUERY_PAGE_SIZE', 2), patch.object(event_repo, 'event_store', event_store):
+            events_r = event_repo.find_events(origin="resource9", sub_type="DEPLOYED")
+            self.assertEquals([ev.ts_created for _, _, ev in events_r], expected)
+            self.assertEquals(len(set(ev_id for ev_id, _, _ in events_r)), len(expected))
+            self.assertTrue(all(call[1]['skip'] <= 2 for call in event_store.find_by_view.call_args_list))
+
+            events_r = event_repo.find_events(origin="resource9", sub_type="DEPLOYED", descending=True)
+            self.assertEquals([ev.ts_created for _, _, ev in events_r], expected[::-1])
+
+            events_r = event_repo.find_events(origin="resource9", sub_type="RETIRED", skip=1, limit=2)
+            self.assertEquals([ev.ts_created for _, _, ev in events_r], [str(ts + 20), str(ts + 22)])
+
+    def test_event_repo_buffered(self):
+        dsm = DatastoreManager()
+
+        event_repo = EventRepository(dsm, buffered=True)
+        event_repo.event_buffer.max_batch = 20
+
+        ts = 1328680477138
+        event_ids = []
+        for i in xrange(50):
+            event_id, rev = event_repo.put_event(Event(origin="resource4", ts_created=str(ts + i)))
+            self.assertEquals(rev, None)
+            event_ids.append(event_id)
+
+        event_repo.flush()
+        events_r = event_repo.find_events(origin='resource4')
+        self.assertEquals(len(events_r), 50)
+        self.assertEquals(event_repo.get_event(event_ids[0]).origin, "resource4")
+
+        stats = event_repo.get_stats()
+        self.assertEquals(stats['written'], 50)
+        self.assertEquals(stats['queue_depth'], 0)
+        self.assertGreaterEqual(stats['flushes'], 3)
+
+        res = event_repo.put_events([Event(origin="resource5"), Event(origin="resource5")])
+        self.assertEquals(len(res), 2)
+        self.assertTrue(all([success for success, oid, rev in res]))
+        self.assertEquals(len(event_repo.find_events(origin='resource5')), 2)
+
+        event_repo.put_event(Event(origin="resource4"))
+        event_repo.close()
+        self.assertEquals(event_repo.get_stats()['written'], 51)
+
+    def test_event_buffer_spill(self):
+        dsm = DatastoreManager()
+        event_store = dsm.get_datastore("events", DataStore.DS_PROFILE.EVENTS)
+
+        spill_path = tempfile.mktemp(suffix=".jsonl")
+        event_buffer = EventPersistenceBuffer(event_store, max_queue=2, put_timeout=0, spill_path=spill_path)
+        for i in xrange(5):
+            event_buffer.put(Event(origin="resource6", ts_created=str(i)))
+
+        stats = event_buffer.get_stats()
+        self.assertEquals(stats['queue_depth'], 2)
+        self.assertEquals(stats['spill_depth'], 3)
+        self.assertTrue(os.path.exists(spill_path))
+
+        self.assertEquals(stats['queued'], 2)
+        self.assertEquals(stats['spilled'], 3)
+
+        # A failed replay keeps the spilled events for the next replay
+        event_buffer.event_store = Mock(wraps=event_store)
+        event_buffer.event_store.create_doc_mult.side_effect = Exception("datastore down")
+        event_buffer.flush()
+        stats = event_buffer.get_stats()
+        self.assertEquals(stats['written'], 2)
+        self.assertEquals(stats['spill_depth'], 3)
+        self.assertTrue(os.path.exists(spill_path + ".replay"))
+
+        for i in xrange(5, 8):
+            event_buffer.put(Event(origin="resource6", ts_created=str(i)))
+        self.assertEquals(event_buffer.get_stats()['spill_depth'], 4)
+
+        event_buffer.event_store = event_store
+        event_buffer.flush()
+        stats = event_buffer.get_stats()
+        self.assertEquals(stats['written'], 8)
+        self.assertEquals(stats['spill_depth'], 0)
+        self.assertFalse(os.path.exists(spill_path))
+        self.assertFalse(os.path.exists(spill_path + ".replay"))
+
+        event_repo = EventRepository(dsm)
+        self.assertEquals(len(event_repo.find_events(origin='resource6')), 8)
+
+    def test_event_buffer_stop(self):
+        dsm = DatastoreManager()
+        event_store = dsm.get_datastore("events", DataStore.DS_PROFILE.EVENTS)
+
+        # A write still in progress when the stop timeout passes completes, no events are lost
+        write_started = event.Event()
+        def slow_create_mult(*args, **kwargs):
+            write_started.set()
+            gevent.sleep(0.2)
+            return event_store.create_mult(*args, **kwargs)
+        slow_store = Mock(wraps=event_store)
+        slow_store.create_mult.side_effect = slow_create_mult
+
+        event_buffer = EventPersistenceBuffer(slow_store, max_batch=3, flush_interval=0.01)
+        event_buffer.start()
+        for i in xrange(5):
+            event_buffer.put(Event(origin="resource10", ts_created=str(i)))
+        write_started.wait(timeout=5)
+        event_buffer.stop(timeout=0.01)
+
+        stats = event_buffer.get_stats()
+        self.assertEquals(stats['written'], 5)
+        self.assertEquals(stats['queue_depth'], 0)
+
+        # Events put after stop are written synchronously
+        event_id, rev = event_buffer.put(Event(origin="resource10", ts_created="5"))
+        self.assertTrue(rev)
+        self.assertEquals(event_buffer.get_stats()['written_sync'], 1)
+
+        event_repo = EventRepository(dsm)
+        self.assertEquals(len(event_repo.find_events(origin='resource10')), 6)
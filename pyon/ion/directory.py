@@ -62,33 +62,18 @@ class Directory(object):
         root_obj = DirEntry(parent='', key=self.orgname, attributes=dict(sys_name=bootstrap.get_sys_name()))
         root_id,rev = self.dir_store.create(root_obj, self.orgname)
 
-        self._assert_existence("/", "Agents",
-                description="Running agents are registered here")
-
-        self._assert_existence("/", "Config",
-                description="System configuration is registered here")
-
-        self._assert_existence("/", "Containers",
-                description="Running containers are registered here")
-
-        self._assert_existence("/", "ObjectTypes",
-                description="ObjectTypes are registered here")
-
-        self._assert_existence("/", "Org",
-                description="Org specifics are registered here",
-                is_root=self.is_root)
-
-        self._assert_existence("/Org", "Resources",
-                description="Shared Org resources are registered here")
-
-        self._assert_existence("/", "ResourceTypes",
-                description="Resource types are registered here")
-
-        self._assert_existence("/", "ServiceInterfaces",
-                description="Service interface definitions are registered here")
-
-        self._assert_existence("/", "Services",
-                description="Service instances are registered here")
+        # Top level entries don't exist yet if the root entry did not: create all at once
+        self.register_mult([
+            ("/", "Agents", dict(description="Running agents are registered here")),
+            ("/", "Config", dict(description="System configuration is registered here")),
+            ("/", "Containers", dict(description="Running containers are registered here")),
+            ("/", "ObjectTypes", dict(description="ObjectTypes are registered here")),
+            ("/", "Org", dict(description="Org specifics are registered here", is_root=self.is_root)),
+            ("/Org", "Resources", dict(description="Shared Org resources are registered here")),
+            ("/", "ResourceTypes", dict(description="Resource types are registered here")),
+            ("/", "ServiceInterfaces", dict(description="Service interface definitions are registered here")),
+            ("/", "Services", dict(description="Service instances are registered here")),
+        ])
 
     def receive_directory_change_event(self, event_msg, headers):
         # @TODO add support to fold updated config into container config
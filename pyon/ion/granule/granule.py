@@ -9,7 +9,9 @@
 '''
 
 
-from interface.objects import Granule
+from interface.objects import Granule, Taxonomy
+from pyon.ion.granule.record_dictionary import RecordDictionaryTool, rd_to_wire, concatenate_rd, num_rows, check_rows
+from pyon.ion.granule.taxonomy import TaxyTool
 
 
 def build_granule(data_producer_id, taxonomy, record_dictionary):
@@ -21,9 +23,99 @@ def build_granule(data_producer_id, taxonomy, record_dictionary):
     A granule contains a record dictionary. The record dictionary is composed of named value sequences.
     We want the Granule Builder to have a dictionary like behavior for building record dictionaries, using the taxonomy
     as a map from the name to the ordinal in the record dictionary.
+
+    If the taxonomy is registered with the taxonomy cache (see TaxonomyCache.register), the granule carries only
+    a reference to it, which subscribers resolve through their taxonomy cache.
+
+    A packed record dictionary (see RecordDictionaryTool.pack) is sent as one buffer per record dictionary.
     """
 
-    #@todo If the taxonomy has an id_ and rev_ send only that.
-    return Granule(data_producer_id=data_producer_id, record_dictionary=record_dictionary._rd, taxonomy=taxonomy._t)
+    if taxonomy._ref_id:
+        taxonomy_ref = Taxonomy()
+        taxonomy_ref._id = taxonomy._ref_id
+        return Granule(data_producer_id=data_producer_id, record_dictionary=rd_to_wire(record_dictionary._rd), taxonomy=taxonomy_ref)
+
+    return Granule(data_producer_id=data_producer_id, record_dictionary=rd_to_wire(record_dictionary._rd), taxonomy=taxonomy._t)
 
 
+def concatenate(granules):
+    """
+    Returns one granule with the rows of all given granules, which must share a taxonomy and have the same fields
+    and nested record dictionaries with the same trailing shapes (ValueError otherwise). The output value sequences
+    are allocated once and each input is copied once.
+    """
+    granules = list(granules)
+    if not granules:
+        raise ValueError('Can not concatenate an empty list of granules')
+    taxonomy = TaxyTool.load_from_granule(granules[0])
+    taxonomy_hash = None
+    for granule in granules[1:]:
+        taxonomy_hash = _check_taxonomy(TaxyTool.load_from_granule(granule), taxonomy, taxonomy_hash)
+    rdt = RecordDictionaryTool(taxonomy=taxonomy)
+    rdt._rd = concatenate_rd([RecordDictionaryTool.load_from_granule(g)._rd for g in granules])
+    return build_granule(data_producer_id=granules[0].data_producer_id, taxonomy=taxonomy, record_dictionary=rdt)
+
+def slice_granule(granule, start, stop=None):
+    """
+    Returns a granule with the rows start:stop of all value sequences of the given granule, including those of
+    nested record dictionaries. The value sequences are views, no data is copied.
+    """
+    taxonomy = TaxyTool.load_from_granule(granule)
+    rdt = RecordDictionaryTool.load_from_granule(granule).slice_rows(start, stop)
+    return build_granule(data_producer_id=granule.data_producer_id, taxonomy=taxonomy, record_dictionary=rdt)
+
+def rebatch(granules, n):
+    """
+    Generator that regroups the rows of a stream of granules into granules of n rows; the last one has the remaining
+    rows. Input granules are sliced without copying and each row is copied at most once, into an output granule
+    assembled from several inputs. All value sequences of a granule must have the same number of rows, and granules
+    assembled into one output granule must share a taxonomy (ValueError otherwise).
+    """
+    if n < 1:
+        raise ValueError('Invalid batch size "%s"' % n)
+    pending, pending_rows, pending_hash = [], 0, None
+    for granule in granules:
+        taxonomy = TaxyTool.load_from_granule(granule)
+        if pending:
+            pending_hash = _check_taxonomy(taxonomy, pending[0][1], pending_hash)
+        rdt = RecordDictionaryTool.load_from_granule(granule)
+        rows = num_rows(rdt._rd)
+        check_rows(rdt._rd, rows)
+        start = 0
+        while start < rows:
+            take = min(n - pending_rows, rows - start)
+            if take == rows:
+                pending.append((granule, taxonomy, rdt, True))
+            else:
+                pending.append((granule, taxonomy, rdt.slice_rows(start, start + take), False))
+            pending_rows += take
+            start += take
+            if pending_rows == n:
+                yield _join(pending)
+                pending, pending_rows, pending_hash = [], 0, None
+    if pending:
+        yield _join(pending)
+
+def _join(pieces):
+    """
+    Returns a granule from the (granule, taxonomy, record dictionary tool, whole granule) pieces collected by rebatch
+    """
+    granule, taxonomy, rdt, whole = pieces[0]
+    if len(pieces) == 1 and whole:
+        return granule
+    if len(pieces) > 1:
+        rdt = RecordDictionaryTool(taxonomy=taxonomy)
+        rdt._rd = concatenate_rd([piece[2]._rd for piece in pieces])
+    return build_granule(data_producer_id=granule.data_producer_id, taxonomy=taxonomy, record_dictionary=rdt)
+
+def _check_taxonomy(taxonomy, reference, reference_hash=None):
+    """
+    Raises ValueError unless the taxonomy has the content of the reference taxonomy. Returns the content hash of
+    the reference, if it had to be computed, to pass in for further checks against the same reference
+    """
+    if taxonomy is reference or taxonomy._t is reference._t or (taxonomy._ref_id and taxonomy._ref_id == reference._ref_id):
+        return reference_hash
+    reference_hash = reference_hash or reference.get_content_hash()
+    if taxonomy.get_content_hash() != reference_hash:
+        raise ValueError('Granules with different taxonomies can not be combined')
+    return reference_hash
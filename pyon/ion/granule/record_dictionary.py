@@ -14,6 +14,10 @@ from pyon.util.log import log
 import numpy
 
 _NoneType = type(None)
+
+# Key of the structured array holding the columns of a packed record dictionary (see RecordDictionaryTool.pack)
+COLUMNS_KEY = '__columns__'
+
 class RecordDictionaryTool(object):
     """
     A granule is a unit of information which conveys part of a coverage. It is composed of a taxonomy and a nested
@@ -24,6 +28,8 @@ class RecordDictionaryTool(object):
     The fact that all of the keys in the record dictionary are handles mapped by the taxonomy should never be exposed.
     The application user refers to everything in the record dictionary by the unique nick name from the taxonomy.
 
+    Optionally the value sequences can be packed into one contiguous structured array (see pack), which gives zero
+    copy column views, O(1) row slicing and a single buffer wire encoding.
     """
     def __init__(self,taxonomy, shape=None):
         """
@@ -55,8 +61,31 @@ class RecordDictionaryTool(object):
         """
         @brief return an instance of Record Dictionary Tool from a granule. Used when a granule is received in a message
         """
-        result = cls(TaxyTool(g.taxonomy))
-        result._rd = g.record_dictionary
+        result = cls(TaxyTool.load_from_granule(g))
+        result._rd = _rd_from_wire(g.record_dictionary)
+        return result
+
+    def pack(self):
+        """
+        @brief Packs the value sequences of this and all nested record dictionaries into one contiguous structured
+        array per record dictionary. The value sequences are replaced by views of its columns, so reading them is
+        unchanged. Setting or deleting an item drops the packing of that record dictionary; pack again when done.
+        Record dictionaries with object arrays or value sequences of differing shape are left unpacked.
+        @retval self
+        """
+        _pack_rd(self._rd)
+        return self
+
+    def slice_rows(self, start, stop=None, step=None):
+        """
+        @brief Returns a record dictionary with the given rows of all value sequences, including those of nested
+        record dictionaries. The value sequences are views, no data is copied. A packed record dictionary is sliced
+        as one buffer and stays packed.
+        """
+        result = RecordDictionaryTool(taxonomy=self._tx)
+        result._rd = _slice_rd(self._rd, slice(start, stop, step))
+        if self._shp is not None:
+            result._shp = (len(xrange(*slice(start, stop, step).indices(self._shp[0]))),) + self._shp[1:]
         return result
 
     def __setitem__(self, name, vals):
@@ -66,6 +95,7 @@ class RecordDictionaryTool(object):
 
         if isinstance(vals, RecordDictionaryTool):
             assert vals._tx == self._tx
+            self._rd.pop(COLUMNS_KEY, None)
             self._rd[self._tx.get_handle(name)] = vals._rd
         elif isinstance(vals, numpy.ndarray):
             #Otherwise it is a value sequence which should have the correct length
@@ -83,6 +113,7 @@ class RecordDictionaryTool(object):
             if self._shp != vals.shape:
                 raise ValueError('Invalid array shape "%s" for name "%s"; Record dictionary defined shape is "%s"' % (vals.shape, name, self._shp))
 
+            self._rd.pop(COLUMNS_KEY, None)
             self._rd[self._tx.get_handle(name)] = vals
 
         else:
@@ -104,6 +135,8 @@ class RecordDictionaryTool(object):
     def iteritems(self):
         """ D.iteritems() -> an iterator over the (key, value) items of D """
         for k, v in self._rd.iteritems():
+            if k == COLUMNS_KEY:
+                continue
             if isinstance(v, dict):
                 result = RecordDictionaryTool(taxonomy=self._tx)
                 result._rd = v
@@ -114,11 +147,15 @@ class RecordDictionaryTool(object):
     def iterkeys(self):
         """ D.iterkeys() -> an iterator over the keys of D """
         for k in self._rd.iterkeys():
+            if k == COLUMNS_KEY:
+                continue
             yield self._tx.get_nick_name(k)
 
     def itervalues(self):
         """ D.itervalues() -> an iterator over the values of D """
-        for v in self._rd.itervalues():
+        for k, v in self._rd.iteritems():
+            if k == COLUMNS_KEY:
+                continue
             if isinstance(v, dict):
                 result = RecordDictionaryTool(taxonomy=self._tx)
                 result._rd = v
@@ -157,17 +194,20 @@ class RecordDictionaryTool(object):
     def __delitem__(self, y):
         """ x.__delitem__(y) <==> del x[y] """
         #not sure if this is right, might just have to remove the name, not the whole handle
+        self._rd.pop(COLUMNS_KEY, None)
         del self._rd[self._tx.get_handle(y)]
         #will probably need to delete the name from _tx
 
     def __iter__(self):
         """ x.__iter__() <==> iter(x) """
         for k in self._rd.iterkeys():
+            if k == COLUMNS_KEY:
+                continue
             yield self._tx.get_nick_name(k)
 
     def __len__(self):
         """ x.__len__() <==> len(x) """
-        return len(self._rd)
+        return len(self._rd) - (COLUMNS_KEY in self._rd)
 
     def __repr__(self):
         """ x.__repr__() <==> repr(x) """
@@ -224,4 +264,160 @@ class RecordDictionaryTool(object):
                 new_offset = offset + '+ '
                 v._pprint(fid, offset=new_offset)
             else:
-                fid.write('= %sRDT nick name: "%s"\n= %svalues: %s\n' % (offset,k, offset, repr(v)))
\ No newline at end of file
+                fid.write('= %sRDT nick name: "%s"\n= %svalues: %s\n' % (offset,k, offset, repr(v)))
+
+
+def _column_name(handle):
+    return 'h%d' % handle
+
+def _pack_rd(rd):
+    """
+    Packs the value sequences of a record dictionary (dict of handle to array or nested dict) into one structured
+    array stored under COLUMNS_KEY, replacing them with views of its columns. Recurses into nested dicts.
+    """
+    arrays = []
+    for handle, value in rd.iteritems():
+        if handle == COLUMNS_KEY:
+            continue
+        if isinstance(value, dict):
+            _pack_rd(value)
+        else:
+            arrays.append((handle, value))
+
+    if not arrays or COLUMNS_KEY in rd:
+        return
+    shape = arrays[0][1].shape
+    if any(value.shape != shape or value.dtype.hasobject for handle, value in arrays):
+        return
+
+    fields = [(_column_name(handle), value.dtype) + ((shape[1:],) if len(shape) > 1 else ()) for handle, value in arrays]
+    columns = numpy.empty(shape[0], dtype=fields)
+    for handle, value in arrays:
+        columns[_column_name(handle)] = value
+        rd[handle] = columns[_column_name(handle)]
+    rd[COLUMNS_KEY] = columns
+
+def _slice_rd(rd, row_slice):
+    columns = rd.get(COLUMNS_KEY, None)
+    if columns is not None:
+        columns = columns[row_slice]
+    result = {}
+    for handle, value in rd.iteritems():
+        if handle == COLUMNS_KEY:
+            result[handle] = columns
+        elif isinstance(value, dict):
+            result[handle] = _slice_rd(value, row_slice)
+        elif columns is not None and _column_name(handle) in columns.dtype.names:
+            result[handle] = columns[_column_name(handle)]
+        else:
+            result[handle] = value[row_slice]
+    return result
+
+def _is_packed(rd):
+    return COLUMNS_KEY in rd or any(isinstance(value, dict) and _is_packed(value) for value in rd.itervalues())
+
+def rd_to_wire(rd):
+    """
+    Returns the record dictionary to put in a granule. Packed record dictionaries carry only their structured
+    array, not the column views, so that each is encoded as one buffer.
+    """
+    if not _is_packed(rd):
+        return rd
+    columns = rd.get(COLUMNS_KEY, None)
+    names = columns.dtype.names if columns is not None else ()
+    result = {}
+    for handle, value in rd.iteritems():
+        if isinstance(value, dict):
+            result[handle] = rd_to_wire(value)
+        elif handle == COLUMNS_KEY or _column_name(handle) not in names:
+            result[handle] = value
+    return result
+
+def _rd_from_wire(rd):
+    """
+    Returns the record dictionary received in a granule, with the column views of packed record dictionaries
+    restored. Unpacked record dictionaries are returned as is.
+    """
+    if not _is_packed(rd):
+        return rd
+    result = {}
+    for handle, value in rd.iteritems():
+        result[handle] = _rd_from_wire(value) if isinstance(value, dict) else value
+    columns = result.get(COLUMNS_KEY, None)
+    if columns is not None:
+        for name in columns.dtype.names:
+            result[int(name[1:])] = columns[name]
+    return result
+
+def num_rows(rd):
+    """
+    Returns the number of rows of the value sequences of a record dictionary, of its first nested record dictionary
+    with value sequences if it has none itself, or 0
+    """
+    nested = []
+    for handle, value in rd.iteritems():
+        if isinstance(value, dict):
+            nested.append(value)
+        elif handle != COLUMNS_KEY:
+            return value.shape[0]
+    for value in nested:
+        rows = num_rows(value)
+        if rows:
+            return rows
+    return 0
+
+def check_rows(rd, rows):
+    """
+    Raises ValueError if any value sequence of a record dictionary or nested record dictionary does not have the
+    given number of rows
+    """
+    for handle, value in rd.iteritems():
+        if isinstance(value, dict):
+            check_rows(value, rows)
+        elif handle != COLUMNS_KEY and value.shape[0] != rows:
+            raise ValueError('Invalid number of rows "%d" for handle "%s"; expected "%d"' % (value.shape[0], handle, rows))
+
+def concatenate_rd(rds):
+    """
+    Returns a new record dictionary with the rows of the given record dictionaries, which must have the same
+    fields and nesting with the same trailing shapes. Each level of the result is allocated once and each input
+    copied into it once. Levels packed in all inputs with the same layout are concatenated as one buffer and stay
+    packed.
+    """
+    handles = set(handle for handle in rds[0] if handle != COLUMNS_KEY)
+    for rd in rds[1:]:
+        if set(handle for handle in rd if handle != COLUMNS_KEY) != handles:
+            raise ValueError('Can not concatenate record dictionaries with different fields: %s and %s' % (
+                sorted(handles), sorted(handle for handle in rd if handle != COLUMNS_KEY)))
+
+    result = {}
+    columns = [rd.get(COLUMNS_KEY, None) for rd in rds]
+    if all(c is not None and c.dtype == columns[0].dtype for c in columns):
+        result[COLUMNS_KEY] = _concatenate_arrays(columns, COLUMNS_KEY)
+        for name in columns[0].dtype.names:
+            result[int(name[1:])] = result[COLUMNS_KEY][name]
+
+    for handle in handles:
+        if handle in result:
+            continue
+        values = [rd[handle] for rd in rds]
+        if all(isinstance(value, dict) for value in values):
+            result[handle] = concatenate_rd(values)
+        elif any(isinstance(value, dict) for value in values):
+            raise ValueError('Can not concatenate a record dictionary with a value sequence for handle "%s"' % handle)
+        else:
+            result[handle] = _concatenate_arrays(values, handle)
+    return result
+
+def _concatenate_arrays(arrays, handle):
+    shape = arrays[0].shape[1:]
+    for array in arrays:
+        if array.shape[1:] != shape:
+            raise ValueError('Invalid array shape "%s" for handle "%s"; expected "(n,)+%s"' % (array.shape, handle, shape))
+    dtype = arrays[0].dtype if arrays[0].dtype.names else numpy.result_type(*arrays)
+    result = numpy.empty((sum(array.shape[0] for array in arrays),) + shape, dtype=dtype)
+    pos = 0
+    for array in arrays:
+        result[pos:pos + array.shape[0]] = array
+        pos += array.shape[0]
+    return result
@@ -11,8 +11,12 @@
 
 
 import yaml
+from collections import OrderedDict
+from pyon.core import bootstrap
+from pyon.core.exception import NotFound, BadRequest
 from pyon.core.object import ion_serializer, IonObjectDeserializer
 from pyon.core.registry import IonObjectRegistry
+from pyon.util.containers import content_hash
 
 from interface.objects import Taxonomy
 from pyon.util.log import log
@@ -61,13 +65,42 @@ class TaxyTool(object):
 
         self._t = taxonomy
 
+        # Id under which this taxonomy is registered (see TaxonomyCache); reset on modification
+        self._ref_id = None
+        self._modified = False
+        # Set for the TaxyTools held by the TaxonomyCache, which are shared by all granules referring to them
+        self._read_only = False
+
     @classmethod
     def load_from_granule(cls, g):
         """
-        Load a TaxyTool from a granule
+        Load a TaxyTool from a granule. Taxonomies sent by reference are resolved through the taxonomy cache; the
+        cached TaxyTool is shared and read only, use copy() to extend it.
         """
+        if is_taxonomy_reference(g.taxonomy):
+            return taxonomy_cache.get(g.taxonomy._id)
         return cls(g.taxonomy)
 
+    def copy(self):
+        """
+        @brief Returns a new, modifiable TaxyTool with a copy of this taxonomy
+        """
+        if not self._t.map:
+            return TaxyTool()
+        return TaxyTool(Taxonomy(map=dict((h, (nick_name, set(name_set)))
+                                          for h, (nick_name, name_set) in self._t.map.iteritems())))
+
+    def _check_writable(self):
+        if self._read_only:
+            raise BadRequest('This taxonomy is shared through the taxonomy cache and read only, modify a copy()')
+
+    def get_content_hash(self):
+        """
+        @brief Get a hash of the taxonomy content, independent of map and name set ordering
+        """
+        return content_hash(dict((str(h), [nick_name, sorted(name_set, key=str)])
+                                 for h, (nick_name, name_set) in self._t.map.iteritems()), ignore_keys=None)
+
     def _update_inverse(self, h, name_set):
         """
         Utility method to update the inverse index of names to handles
@@ -84,6 +117,7 @@ class TaxyTool(object):
 
 
     def _add_nickname(self, nick_name, h):
+        self._ref_id, self._modified = None, True
         if nick_name not in self._by_nick_names:
             self._by_nick_names[nick_name] = h
         else:
@@ -95,6 +129,7 @@ class TaxyTool(object):
         @param nick_name is the first positional argument, it is unique name in the taxonomy
         @param *args is a list of input arguments. All should be hashable
         """
+        self._check_writable()
         self._cnt += 1
         h = self._cnt
 
@@ -192,12 +227,16 @@ class TaxyTool(object):
         Utility method that does the work of extending the a set and updating the inverse
         """
 
+        self._check_writable()
+
         for item in args:
             assert item.__hash__ is not None
 
         nick_name, tmp_set = self._t.map[handle]
         # handle the key error in the caller!
 
+        self._ref_id, self._modified = None, True
+
         name_set = tmp_set.union(set(args))
 
         self._t.map[handle] = (nick_name, name_set)
@@ -235,14 +274,7 @@ class TaxyTool(object):
         d = yaml.load(input)
         t = ion_deserializer.deserialize(d)
 
-        # We know the structure - turn the lists back into sets!
-        try:
-            for k, v in t.map.iteritems():
-                t.map[k] = (v[0], set(v[1]))
-        except IndexError:
-            log.exception("Invalid taxonomy object structure: should be Key:(nickname, {alias',})")
-
-        return cls(t)
+        return cls(_fix_taxonomy(t))
 
     def __eq__(self, other):
 
@@ -261,3 +293,95 @@ class TaxyTool(object):
         return False
 
 
+
+
+def _fix_taxonomy(t):
+    """
+    Restores the structure of a taxonomy after persistence: integer handles and name sets
+    """
+    # We know the structure - turn the lists back into sets!
+    try:
+        t.map = dict((int(k), (v[0], set(v[1]))) for k, v in t.map.iteritems())
+    except IndexError:
+        log.exception("Invalid taxonomy object structure: should be Key:(nickname, {alias',})")
+    return t
+
+def is_taxonomy_reference(taxonomy):
+    """
+    Returns True if the given Taxonomy only refers to a registered taxonomy by its id
+    """
+    return bool(getattr(taxonomy, '_id', None)) and not taxonomy.map
+
+
+class TaxonomyCache(object):
+    """
+    Bounded cache of TaxyTools by taxonomy id, so that granules can carry a taxonomy by reference
+    instead of the full taxonomy. Taxonomies not in the cache are read from the resource registry. The cached
+    TaxyTools are shared by all granules referring to them and are read only.
+    """
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._taxys = OrderedDict()     # taxonomy id -> TaxyTool, least recently used first
+        self._ids_by_hash = {}          # content hash -> taxonomy id
+
+    def register(self, tx, persist=True):
+        """
+        @brief Register a TaxyTool so that granules built with it carry only a reference
+        @param tx is a TaxyTool. The cache keeps a copy; modifying tx after registration ends sending it
+                by reference.
+        @param persist if True and a container is available, the taxonomy is stored in the resource
+                registry (unless it was read from there), so that subscribers in other processes can
+                resolve it. Otherwise the reference is the content hash, valid in this process only.
+        @return the taxonomy id
+        """
+        tx_hash = tx.get_content_hash()
+        taxonomy_id = self._ids_by_hash.get(tx_hash, None)
+        if taxonomy_id is None:
+            # A taxonomy read from the resource registry and not modified can be referred to by its id
+            taxonomy_id = None if tx._modified else getattr(tx._t, '_id', None)
+            if taxonomy_id is None:
+                container = bootstrap.container_instance
+                if persist and container and getattr(container, 'resource_registry', None):
+                    # Name sets are stored as lists
+                    taxonomy = Taxonomy(name=tx_hash, map=dict((h, (nick_name, sorted(name_set, key=str)))
+                                        for h, (nick_name, name_set) in tx._t.map.iteritems()))
+                    taxonomy_id, _ = container.resource_registry.create(taxonomy)
+                else:
+                    taxonomy_id = tx_hash
+            self._ids_by_hash[tx_hash] = taxonomy_id
+
+        # Cache a copy, so that later changes to tx do not alter the registered taxonomy
+        tx_copy = tx.copy()
+        tx_copy._ref_id, tx_copy._read_only = taxonomy_id, True
+        self._put(taxonomy_id, tx_copy)
+        tx._ref_id = taxonomy_id
+        return taxonomy_id
+
+    def get(self, taxonomy_id):
+        """
+        @brief Get the TaxyTool for a taxonomy id, from the cache or the resource registry
+        """
+        tx = self._taxys.pop(taxonomy_id, None)
+        if tx is None:
+            container = bootstrap.container_instance
+            if not (container and getattr(container, 'resource_registry', None)):
+                raise NotFound("Taxonomy %s not registered" % taxonomy_id)
+            log.debug("Reading taxonomy %s from resource registry", taxonomy_id)
+            tx = TaxyTool(_fix_taxonomy(container.resource_registry.read(taxonomy_id)))
+            tx._ref_id, tx._read_only = taxonomy_id, True
+        self._put(taxonomy_id, tx)
+        return tx
+
+    def clear(self):
+        self._taxys.clear()
+        self._ids_by_hash.clear()
+
+    def _put(self, taxonomy_id, tx):
+        self._taxys.pop(taxonomy_id, None)
+        self._taxys[taxonomy_id] = tx
+        while len(self._taxys) > self.max_size:
+            self._taxys.popitem(last=False)
+
+# Taxonomy cache of this process
+taxonomy_cache = TaxonomyCache()
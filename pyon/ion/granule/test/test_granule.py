@@ -11,15 +11,24 @@
 
 import unittest
 import numpy
+from msgpack import packb, unpackb
 from nose.plugins.attrib import attr
-from pyon.ion.granule.taxonomy import TaxyTool
-from pyon.ion.granule.granule import build_granule
-from pyon.ion.granule.record_dictionary import RecordDictionaryTool
+from pyon.core.exception import BadRequest
+from pyon.core.interceptor.encode import encode_ion, decode_ion
+from pyon.ion.granule.taxonomy import TaxyTool, taxonomy_cache, is_taxonomy_reference
+from pyon.ion.granule.granule import build_granule, concatenate, slice_granule, rebatch
+from pyon.ion.granule.record_dictionary import RecordDictionaryTool, num_rows
 
 
 @attr('UNIT', group='dm')
 class GranuleTestCase(unittest.TestCase):
 
+    def setUp(self):
+        taxonomy_cache.clear()
+
+    def tearDown(self):
+        taxonomy_cache.clear()
+
     def test_build_granule_and_load_from_granule(self):
 
 
@@ -76,3 +85,153 @@ class GranuleTestCase(unittest.TestCase):
             else:
                 self.assertEquals(v._rd, rdt[k]._rd)
 
+    def test_build_granule_taxonomy_reference(self):
+
+        tx = TaxyTool()
+        tx.add_taxonomy_set('temp', 'long_temp_name')
+        tx.add_taxonomy_set('cond', 'long_cond_name')
+
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['temp'] = numpy.arange(10)
+        rdt['cond'] = numpy.arange(10)
+
+        # Not registered: the granule carries the full taxonomy
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+        self.assertFalse(is_taxonomy_reference(g.taxonomy))
+
+        taxonomy_id = taxonomy_cache.register(tx, persist=False)
+        self.assertEquals(taxonomy_id, tx.get_content_hash())
+
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+        self.assertTrue(is_taxonomy_reference(g.taxonomy))
+        self.assertEquals(g.taxonomy._id, taxonomy_id)
+        self.assertEquals(g.taxonomy.map, {})
+
+        # Subscribers get the cached TaxyTool, no rebuild. It is shared and can not be modified; a copy can
+        l_tx = TaxyTool.load_from_granule(g)
+        self.assertEquals(l_tx, tx)
+        self.assertRaises(BadRequest, l_tx.add_taxonomy_set, 'pres', 'long_pres_name')
+        self.assertRaises(BadRequest, l_tx.extend_names_by_nick_name, 'temp', 'other_temp_name')
+        tx_ext = l_tx.copy()
+        tx_ext.add_taxonomy_set('pres', 'long_pres_name')
+        self.assertEquals(TaxyTool.load_from_granule(g), tx)
+        l_rd = RecordDictionaryTool.load_from_granule(g)
+        self.assertTrue((l_rd['temp'] == rdt['temp']).all())
+
+        # Same content registers under the same id
+        tx2 = TaxyTool(tx._t)
+        self.assertEquals(taxonomy_cache.register(tx2, persist=False), taxonomy_id)
+
+        # Modified taxonomies are sent in full again
+        tx.add_taxonomy_set('pres', 'long_pres_name')
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+        self.assertFalse(is_taxonomy_reference(g.taxonomy))
+        self.assertNotEquals(tx.get_content_hash(), taxonomy_id)
+
+    def test_build_granule_packed(self):
+
+        tx = TaxyTool()
+        tx.add_taxonomy_set('temp', 'long_temp_name')
+        tx.add_taxonomy_set('cond', 'long_cond_name')
+        tx.add_taxonomy_set('rdt')
+
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['temp'] = numpy.random.standard_normal(100)
+        rdt['cond'] = numpy.arange(100)
+        rdt2 = RecordDictionaryTool(taxonomy=tx)
+        rdt2['temp'] = numpy.random.standard_normal(10)
+        rdt['rdt'] = rdt2
+        rdt.pack()
+
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+
+        # Only the buffers go in the granule
+        handle = tx.get_handle('temp')
+        self.assertNotIn(handle, g.record_dictionary)
+        self.assertNotIn(handle, g.record_dictionary[tx.get_handle('rdt')])
+        self.assertIn(handle, rdt._rd)
+
+        g.record_dictionary = unpackb(packb(g.record_dictionary, default=encode_ion), object_hook=decode_ion)
+
+        l_rd = RecordDictionaryTool.load_from_granule(g)
+        self.assertEquals(set(l_rd), set(['temp', 'cond', 'rdt']))
+        self.assertTrue((l_rd['temp'] == rdt['temp']).all())
+        self.assertTrue((l_rd['cond'] == rdt['cond']).all())
+        self.assertTrue((l_rd['rdt']['temp'] == rdt2['temp']).all())
+
+    def _make_granule(self, tx, start, stop, pack=False):
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['temp'] = numpy.arange(start, stop, dtype='float64')
+        rdt['cond'] = numpy.arange(2 * start, 2 * stop, dtype='int32').reshape(stop - start, 2)
+        rdt2 = RecordDictionaryTool(taxonomy=tx)
+        rdt2['temp'] = numpy.arange(start, stop, dtype='float32')
+        rdt['rdt'] = rdt2
+        if pack:
+            rdt.pack()
+        return build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+
+    def test_concatenate_slice_rebatch(self):
+
+        tx = TaxyTool()
+        tx.add_taxonomy_set('temp', 'long_temp_name')
+        tx.add_taxonomy_set('cond', 'long_cond_name')
+        tx.add_taxonomy_set('rdt')
+
+        for pack in (False, True):
+            granules = [self._make_granule(tx, 0, 3, pack), self._make_granule(tx, 3, 10, pack), self._make_granule(tx, 10, 12, pack)]
+
+            l_rd = RecordDictionaryTool.load_from_granule(concatenate(granules))
+            self.assertTrue((l_rd['temp'] == numpy.arange(12)).all())
+            self.assertEquals(l_rd['cond'].shape, (12, 2))
+            self.assertEquals(l_rd['cond'].dtype, numpy.dtype('int32'))
+            self.assertTrue((l_rd['cond'].ravel() == numpy.arange(24)).all())
+            self.assertTrue((l_rd['rdt']['temp'] == numpy.arange(12)).all())
+            self.assertEquals('__columns__' in l_rd._rd, pack)
+
+            l_rd = RecordDictionaryTool.load_from_granule(slice_granule(granules[1], 2, 4))
+            self.assertTrue((l_rd['temp'] == numpy.arange(5, 7)).all())
+            self.assertTrue((l_rd['rdt']['temp'] == numpy.arange(5, 7)).all())
+
+            batches = list(rebatch(iter(granules), 5))
+            self.assertEquals(len(batches), 3)
+            for i, batch in enumerate(batches):
+                l_rd = RecordDictionaryTool.load_from_granule(batch)
+                rows = min(5, 12 - 5 * i)
+                self.assertTrue((l_rd['temp'] == numpy.arange(5 * i, 5 * i + rows)).all())
+                self.assertTrue((l_rd['rdt']['temp'] == numpy.arange(5 * i, 5 * i + rows)).all())
+                self.assertEquals(l_rd['cond'].shape, (rows, 2))
+
+            # Granules of the batch size pass through
+            self.assertIs(list(rebatch(granules[1:2], 7))[0], granules[1])
+
+        # Shape checks
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['temp'] = numpy.arange(3.0)
+        rdt['cond'] = numpy.arange(3)
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+        self.assertRaises(ValueError, concatenate, [granules[0], g])
+
+        rdt = RecordDictionaryTool(taxonomy=tx)
+        rdt['temp'] = numpy.arange(3.0)
+        g = build_granule(data_producer_id='john', taxonomy=tx, record_dictionary=rdt)
+        self.assertRaises(ValueError, concatenate, [granules[0], g])
+        self.assertRaises(ValueError, concatenate, [])
+        self.assertRaises(ValueError, list, rebatch(granules, 0))
+
+        # Taxonomy checks: equal content is fine, different handles are not
+        g0 = self._make_granule(tx, 0, 3)
+        tx_copy = TaxyTool()
+        tx_copy.add_taxonomy_set('temp', 'long_temp_name')
+        tx_copy.add_taxonomy_set('cond', 'long_cond_name')
+        tx_copy.add_taxonomy_set('rdt')
+        self.assertEquals(num_rows(RecordDictionaryTool.load_from_granule(
+            concatenate([g0, self._make_granule(tx_copy, 0, 2)]))._rd), 5)
+
+        tx_other = TaxyTool()
+        tx_other.add_taxonomy_set('cond', 'long_cond_name')
+        tx_other.add_taxonomy_set('temp', 'long_temp_name')
+        tx_other.add_taxonomy_set('rdt')
+        g = self._make_granule(tx_other, 0, 2)
+        self.assertRaises(ValueError, concatenate, [g0, g])
+        self.assertRaises(ValueError, list, rebatch([g0, g], 5))
+        self.assertEquals(len(list(rebatch([g0, g], 3))), 2)
@@ -287,3 +287,72 @@ class RecordDictionaryToolTestCase(unittest.TestCase):
 
 
 
+
+    def test_pack(self):
+        temp_array = numpy.random.standard_normal(100)
+        cond_array = numpy.arange(100, dtype='int32')
+        self._rdt['temp'] = temp_array
+        self._rdt['cond'] = cond_array
+
+        rdt = RecordDictionaryTool(taxonomy=self._tx)
+        rdt['pres'] = numpy.arange(10)
+        self._rdt['rdt'] = rdt
+
+        self.assertIs(self._rdt.pack(), self._rdt)
+
+        # The API is unchanged
+        self.assertEquals(len(self._rdt), 3)
+        self.assertEquals(set(self._rdt), set(['temp', 'cond', 'rdt']))
+        self.assertTrue((self._rdt['temp'] == temp_array).all())
+        self.assertTrue((self._rdt['cond'] == cond_array).all())
+        self.assertEquals(self._rdt['cond'].dtype, cond_array.dtype)
+        self.assertTrue((self._rdt['rdt']['pres'] == numpy.arange(10)).all())
+
+        # Columns are views of one buffer
+        columns = self._rdt._rd['__columns__']
+        self.assertTrue(numpy.may_share_memory(self._rdt['temp'], columns))
+        self.assertTrue(numpy.may_share_memory(self._rdt['cond'], columns))
+        self.assertIn('__columns__', self._rdt['rdt']._rd)
+
+        # Setting an item drops the packing
+        self._rdt['pres'] = numpy.ones(100)
+        self.assertNotIn('__columns__', self._rdt._rd)
+        self.assertTrue((self._rdt['temp'] == temp_array).all())
+
+        # Multi dimensional value sequences
+        rdt = RecordDictionaryTool(taxonomy=self._tx, shape=(5, 3))
+        rdt['temp'] = numpy.arange(15.0).reshape(5, 3)
+        rdt['cond'] = numpy.zeros((5, 3))
+        rdt.pack()
+        self.assertEquals(rdt['temp'].shape, (5, 3))
+        self.assertTrue((rdt['temp'] == numpy.arange(15.0).reshape(5, 3)).all())
+
+        # Object arrays are not packed
+        rdt = RecordDictionaryTool(taxonomy=self._tx)
+        rdt['temp'] = numpy.array(['a', None], dtype=object)
+        rdt.pack()
+        self.assertNotIn('__columns__', rdt._rd)
+
+    def test_slice_rows(self):
+        temp_array = numpy.random.standard_normal(100)
+        cond_array = numpy.random.standard_normal(100)
+
+        for pack in (False, True):
+            rdt = RecordDictionaryTool(taxonomy=self._tx)
+            rdt['temp'] = temp_array
+            rdt['cond'] = cond_array
+            if pack:
+                rdt.pack()
+
+            sliced = rdt.slice_rows(10, 20)
+            self.assertEquals(sliced._shp, (10,))
+            self.assertTrue((sliced['temp'] == temp_array[10:20]).all())
+            self.assertTrue((sliced['cond'] == cond_array[10:20]).all())
+            self.assertEquals('__columns__' in sliced._rd, pack)
+
+            # Views, not copies
+            sliced['temp'][0] = 42.0
+            self.assertEquals(rdt['temp'][10], 42.0)
+            temp_array[10] = 42.0
+
+            self.assertTrue((rdt.slice_rows(0, None, 10)['cond'] == cond_array[::10]).all())
@@ -11,11 +11,18 @@
 
 import unittest
 from nose.plugins.attrib import attr
-from pyon.ion.granule.taxonomy import Taxonomy, TaxyTool
+from pyon.ion.granule.taxonomy import Taxonomy, TaxyTool, TaxonomyCache, taxonomy_cache
+from pyon.core.exception import NotFound, BadRequest
 
 @attr('UNIT', group='dm')
 class TaxonomyToolTestCase(unittest.TestCase):
 
+    def setUp(self):
+        taxonomy_cache.clear()
+
+    def tearDown(self):
+        taxonomy_cache.clear()
+
     def test_init(self):
         """
         test initialization of the TaxyCab
@@ -202,4 +209,31 @@ class TaxonomyToolTestCase(unittest.TestCase):
         self.assertEquals(tc.get_names_by_handle(0),{'1','x','a','z',})
         self.assertEquals(tc.get_names_by_handle(1),{'2','b','c',})
 
-
+    def test_taxonomy_cache(self):
+
+        cache = TaxonomyCache(max_size=2)
+        txs = []
+        for i in xrange(3):
+            tx = TaxyTool()
+            tx.add_taxonomy_set('nick%s' % i, 'a')
+            txs.append(tx)
+
+        ids = [cache.register(tx, persist=False) for tx in txs]
+        self.assertEquals(len(set(ids)), 3)
+
+        # Least recently used taxonomy was evicted; no container to fall back to
+        self.assertEquals(cache.get(ids[2]), txs[2])
+        self.assertEquals(cache.get(ids[1]), txs[1])
+        self.assertRaises(NotFound, cache.get, ids[0])
+
+        # The cache keeps a copy; changing the registered TaxyTool does not change it
+        txs[2].add_taxonomy_set('other', 'b')
+        self.assertIsNot(cache.get(ids[2]), txs[2])
+        self.assertEquals(cache.get(ids[2]).get_handles('other'), {-1,})
+        self.assertEquals(cache.get(ids[2])._ref_id, ids[2])
+        self.assertRaises(BadRequest, cache.get(ids[2]).add_taxonomy_set, 'other', 'b')
+
+        # Content hash does not depend on name set ordering
+        tx1 = TaxyTool(Taxonomy(map={1:('nick_name',{'nick_name','a','b','c'})}))
+        tx2 = TaxyTool(Taxonomy(map={1:('nick_name',{'c','b','a','nick_name'})}))
+        self.assertEquals(tx1.get_content_hash(), tx2.get_content_hash())
@@ -128,6 +128,7 @@ class ResourceLifeCycleSM(object):
         self.transitions = {}
         self.initial_state = kwargs.get('initial_state', None)
         self._kwargs = kwargs
+        self._successor_table = {}
 
     @classmethod
     def is_in_state(cls, current_state, query_state):
@@ -147,6 +148,7 @@ class ResourceLifeCycleSM(object):
                 if a_state in self.illegal_states or a_newstate in self.illegal_states:
                     del trans_new[(a_state, a_transition)]
             self.transitions = trans_new
+            self._build_successor_table()
 
     def get_successor(self, current_state, transition_event):
         """
@@ -159,13 +161,25 @@ class ResourceLifeCycleSM(object):
         """
         For a given state, return a dict of possible transition events => successor states
         """
-        ret = {}
-        for (a_state, a_transition), a_newstate in self.transitions.iteritems():
-            if a_state == some_state:
-                #keyed on transition because they are unique with respect to origin state
-                ret[a_transition] = a_newstate
+        return dict(self.get_successor_table().get(some_state, {}))
 
-        return ret
+    def get_successor_table(self):
+        """
+        Returns the transitions precompiled into a dict of state => dict of transition
+        events => successor states. Do not modify.
+        """
+        return self._successor_table
+
+    def _build_successor_table(self):
+        """
+        Precompiles the transitions for get_successor_table. Called when the FSM is
+        constructed and restricted; the transitions must not change afterwards.
+        """
+        table = {}
+        for (a_state, a_transition), a_newstate in self.transitions.iteritems():
+            #keyed on transition because they are unique with respect to origin state
+            table.setdefault(a_state, {})[a_transition] = a_newstate
+        self._successor_table = table
 
     def get_predecessors(self, some_state):
         """
@@ -268,6 +282,7 @@ class CommonResourceLifeCycleSM(ResourceLifeCycleSM):
             else:
                 self.transitions[(s0,ev)] = s1
         #import pprint; pprint.pprint(self.transitions)
+        self._build_successor_table()
 
     def _create_basic_transitions(self):
         pass
@@ -10,12 +10,12 @@ import base64
 
 from pyon.core import bootstrap
 from pyon.core.bootstrap import CFG
-from pyon.core.exception import BadRequest, NotFound, Inconsistent
+from pyon.core.exception import BadRequest, NotFound, Inconsistent, Conflict
 from pyon.core.object import IonObjectBase
 from pyon.datastore.datastore import DataStore
 from pyon.event.event import EventPublisher
 from pyon.ion.resource import LCS, PRED, AT, RT, get_restype_lcsm, is_resource
-from pyon.util.containers import get_ion_ts
+from pyon.util.containers import get_ion_ts, content_hash
 from pyon.util.log import log
 
 from interface.objects import Attachment, AttachmentType, ServiceDefinition, ResourceModificationType
@@ -85,7 +85,42 @@ class ResourceRegistry(object):
 
         return res
 
-    def _create_mult(self, res_list):
+    def create_mult(self, res_list=None, actor_id=None):
+        """
+        Creates a list of resources with one bulk write. Sets initial lifecycle state and
+        timestamps as create does. Owner associations of the created resources are created
+        with one bulk create_association_mult and their ResourceModifiedEvents are published in bulk.
+        @retval list of (success, resource_id, rev or error) tuples, in order of res_list
+        """
+        if not res_list or type(res_list) is not list:
+            raise BadRequest("Resource list not present")
+        for resobj in res_list:
+            if not isinstance(resobj, IonObjectBase):
+                raise BadRequest("Object is not an IonObject")
+            if not is_resource(resobj):
+                raise BadRequest("Object is not a Resource")
+
+        self._prepare_create_mult(res_list)
+        res = self.rr_store.create_mult(res_list)
+        created = [(rid, resobj) for (success, rid, rrv), resobj in zip(res, res_list) if success]
+
+        if actor_id and actor_id != 'anonymous' and created:
+            log.debug("Associate %s resources with owner=%s" % (len(created), actor_id))
+            assoc_res = self.rr_store.create_association_mult([(rid, PRED.hasOwner, actor_id) for rid, resobj in created])
+            for success, assoc_id, error in assoc_res:
+                if not success:
+                    log.error("Failed to associate resource with owner=%s: %s" % (actor_id, error))
+
+        if created:
+            self.event_pub.publish_event_mult([dict(event_type="ResourceModifiedEvent",
+                                                    origin=rid, origin_type=resobj._get_type(),
+                                                    sub_type="CREATE",
+                                                    mod_type=ResourceModificationType.CREATE)
+                                               for rid, resobj in created])
+
+        return res
+
+    def _prepare_create_mult(self, res_list):
         cur_time = get_ion_ts()
         for resobj in res_list:
             lcsm = get_restype_lcsm(resobj._get_type())
@@ -93,14 +128,13 @@ class ResourceRegistry(object):
             resobj.ts_created = cur_time
             resobj.ts_updated = cur_time
 
+    def _create_mult(self, res_list):
+        self._prepare_create_mult(res_list)
+
         res = self.rr_store.create_mult(res_list)
         res_list = [(rid,rrv) for success,rid,rrv in res]
 
-        # TODO: Publish events (skipped, because this is inefficent one by one for a large list
-#        for rid,rrv in res_list:
-#            self.event_pub.publish_event(event_type="ResourceModifiedEvent",
-#                origin=res_id, origin_type=object._get_type(),
-#                mod_type=ResourceModificationType.CREATE)
+        # Note: No events are published here. Use create_mult to publish events in bulk.
 
         return res_list
 
@@ -123,12 +157,16 @@ class ResourceRegistry(object):
             # Do an check whether LCS has been modified
         res_obj = self.read(object._id)
 
-        object.ts_updated = get_ion_ts()
         if res_obj.lcstate != object.lcstate:
             log.warn("Cannot modify life cycle state in update current=%s given=%s. DO NOT REUSE THE SAME OBJECT IN CREATE THEN UPDATE" % (
                 res_obj.lcstate, object.lcstate))
             object.lcstate = res_obj.lcstate
 
+        if object._rev == res_obj._rev and self._get_content_hash(object) == self._get_content_hash(res_obj):
+            log.debug("Resource %s not modified, skipping update" % object._id)
+            return (object._id, object._rev)
+
+        object.ts_updated = get_ion_ts()
         self.event_pub.publish_event(event_type="ResourceModifiedEvent",
                                      origin=object._id, origin_type=object._get_type(),
                                      sub_type="UPDATE",
@@ -136,6 +174,42 @@ class ResourceRegistry(object):
 
         return self.rr_store.update(object)
 
+    def _get_content_hash(self, resobj):
+        # Content excluding id, revision and update timestamp
+        return content_hash(self.rr_store._ion_object_to_persistence_dict(resobj),
+                            ignore_keys=("_id", "_rev", "ts_updated"))
+
+    def update_mult(self, res_list=None):
+        """
+        Updates a list of resources with one bulk read and one bulk write. Life cycle states
+        cannot be modified, as in update. The ResourceModifiedEvents of successful
+        updates are published in bulk.
+        @retval list of (success, resource_id, rev or error) tuples, in order of res_list
+        """
+        if not res_list or type(res_list) is not list:
+            raise BadRequest("Resource list not present")
+        if not all([hasattr(resobj, "_id") and hasattr(resobj, "_rev") for resobj in res_list]):
+            raise BadRequest("Object does not have required '_id' or '_rev' attribute")
+
+        cur_objs = self.rr_store.read_mult([resobj._id for resobj in res_list])
+        cur_time = get_ion_ts()
+        for resobj, cur_obj in zip(res_list, cur_objs):
+            resobj.ts_updated = cur_time
+            if cur_obj.lcstate != resobj.lcstate:
+                log.warn("Cannot modify life cycle state in update current=%s given=%s. DO NOT REUSE THE SAME OBJECT IN CREATE THEN UPDATE" % (
+                    cur_obj.lcstate, resobj.lcstate))
+                resobj.lcstate = cur_obj.lcstate
+
+        res = self.rr_store.update_mult(res_list)
+
+        self.event_pub.publish_event_mult([dict(event_type="ResourceModifiedEvent",
+                                                origin=resobj._id, origin_type=resobj._get_type(),
+                                                sub_type="UPDATE",
+                                                mod_type=ResourceModificationType.UPDATE)
+                                           for resobj, (success, rid, rrv) in zip(res_list, res) if success])
+
+        return res
+
     def delete(self, object_id=''):
         res_obj = self.read(object_id)
         if not res_obj:
@@ -205,6 +279,89 @@ class ResourceRegistry(object):
                                      sub_type=target_lcstate,
                                      old_state=old_state, new_state=target_lcstate)
 
+    def execute_lifecycle_transition_mult(self, resource_ids=None, transition_event=''):
+        """
+        Executes a lifecycle transition for a list of resources with one bulk read and one
+        bulk update. The ResourceLifecycleEvents are published in bulk.
+        @retval list of (success, resource_id, new_state or exception) tuples, in order of resource_ids
+        """
+        def get_new_state(res_obj, restype_workflow):
+            new_state = restype_workflow.get_successor_table().get(res_obj.lcstate, {}).get(transition_event, None)
+            if not new_state:
+                raise BadRequest("Resource id=%s, type=%s, lcstate=%s has no transition for event %s" % (
+                    res_obj._id, res_obj._get_type(), res_obj.lcstate, transition_event))
+            return new_state
+
+        return self._change_lifecycle_mult(resource_ids, get_new_state, dict(transition_event=transition_event))
+
+    def set_lifecycle_state_mult(self, resource_ids=None, target_lcstate=''):
+        """
+        Sets the lifecycle state for a list of resources with one bulk read and one
+        bulk update. The ResourceLifecycleEvents are published in bulk.
+        @retval list of (success, resource_id, new_state or exception) tuples, in order of resource_ids
+        """
+        if not target_lcstate or target_lcstate not in LCS:
+            raise BadRequest("Unknown life-cycle state %s" % target_lcstate)
+
+        def get_new_state(res_obj, restype_workflow):
+            # Check that target state is allowed
+            if not target_lcstate in restype_workflow.get_successor_table().get(res_obj.lcstate, {}).values():
+                raise BadRequest("Target state %s not reachable for resource in state %s" % (target_lcstate, res_obj.lcstate))
+            return target_lcstate
+
+        return self._change_lifecycle_mult(resource_ids, get_new_state)
+
+    def _change_lifecycle_mult(self, resource_ids, get_new_state, event_args=None):
+        if not resource_ids or type(resource_ids) is not list:
+            raise BadRequest("The resource_ids parameter is empty")
+
+        res_objs = self.rr_store.read_mult_existing(list(set(resource_ids)))
+
+        results = [None] * len(resource_ids)
+        changes = []
+        changed_ids = set()
+        for i, resource_id in enumerate(resource_ids):
+            try:
+                res_obj = res_objs.get(resource_id, None)
+                if res_obj is None:
+                    raise NotFound("Object with id %s does not exist." % resource_id)
+                if resource_id in changed_ids:
+                    raise Conflict("Resource id=%s is given more than once" % resource_id)
+
+                restype = res_obj._get_type()
+                restype_workflow = get_restype_lcsm(restype)
+                if not restype_workflow:
+                    raise BadRequest("Resource id=%s type=%s has no lifecycle" % (resource_id, restype))
+
+                changes.append((i, res_obj, res_obj.lcstate, get_new_state(res_obj, restype_workflow)))
+                changed_ids.add(resource_id)
+            except (BadRequest, NotFound, Conflict) as ex:
+                results[i] = (False, resource_id, ex)
+
+        if not changes:
+            return results
+
+        cur_time = get_ion_ts()
+        for i, res_obj, old_state, new_state in changes:
+            res_obj.lcstate = new_state
+            res_obj.ts_updated = cur_time
+        upd_res = self.rr_store.update_mult([res_obj for i, res_obj, old_state, new_state in changes])
+
+        event_list = []
+        for (i, res_obj, old_state, new_state), (success, resource_id, rev) in zip(changes, upd_res):
+            if success:
+                results[i] = (True, resource_id, new_state)
+                event_list.append(dict(event_args or {}, event_type="ResourceLifecycleEvent",
+                                       origin=resource_id, origin_type=res_obj._get_type(),
+                                       sub_type=new_state,
+                                       old_state=old_state, new_state=new_state))
+            else:
+                results[i] = (False, resource_id, Conflict("Object not based on most current version"))
+
+        self.event_pub.publish_event_mult(event_list)
+
+        return results
+
     def create_attachment(self, resource_id='', attachment=None):
         if attachment is None:
             raise BadRequest("Object not present")
@@ -265,6 +422,9 @@ class ResourceRegistry(object):
     def create_association(self, subject=None, predicate=None, object=None, assoc_type=None):
         return self.rr_store.create_association(subject, predicate, object, assoc_type)
 
+    def create_association_mult(self, assoc_list=None):
+        return self.rr_store.create_association_mult(assoc_list)
+
     def delete_association(self, association=''):
         return self.rr_store.delete_association(association)
 
@@ -311,6 +471,9 @@ class ResourceRegistry(object):
     def find_associations_mult(self, subjects=[], id_only=False):
         return self.rr_store.find_associations_mult(subjects=subjects, id_only=id_only)
 
+    def traverse(self, start="", path=None, reverse=False, id_only=False):
+        return self.rr_store.traverse(start, path, reverse=reverse, id_only=id_only)
+
     def get_association(self, subject="", predicate="", object="", assoc_type=None, id_only=False):
         if predicate:
             assoc_type = assoc_type or AT.H2H
@@ -325,3 +488,6 @@ class ResourceRegistry(object):
 
     def find_resources(self, restype="", lcstate="", name="", id_only=False):
         return self.rr_store.find_resources(restype, lcstate, name, id_only=id_only)
+
+    def find_res_by_subtypes(self, restype="", id_only=False):
+        return self.rr_store.find_res_by_subtypes(restype, id_only=id_only)
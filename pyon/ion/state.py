@@ -5,9 +5,14 @@
 __author__ = 'Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+from copy import deepcopy
+
+import gevent
+
 from pyon.core import bootstrap
-from pyon.core.exception import NotFound, BadRequest
+from pyon.core.exception import NotFound, BadRequest, Conflict
 from pyon.datastore.datastore import DataStore
+from pyon.util.async import spawn
 from pyon.util.containers import get_ion_ts
 from pyon.util.log import log
 
@@ -17,35 +22,199 @@ from interface.objects import ProcessState
 class StateRepository(object):
     """
     Class that uses a data store to provide a persistent state repository for ION processes.
+
+    Configuration (container.state_repository or config argument):
+    - optimistic: cache the last known revision per key and update without prior read;
+      re-read only on conflict
+    - write_behind: seconds to delay writes, coalescing rapid checkpoints of a key into one
+      write (0 disables). Implies optimistic
+    - delta: store checkpoints as deltas (changed and removed keys only) in separate docs,
+      compacted into the full state every compact_every deltas. Implies optimistic.
+      Assumes a single writer per key, as is the case for process state
     """
 
-    def __init__(self, datastore_manager=None):
+    def __init__(self, datastore_manager=None, config=None):
 
         # Get an instance of datastore configured as directory.
         # May be persistent or mock, forced clean, with indexes
         datastore_manager = datastore_manager or bootstrap.container_instance.datastore_manager
         self.state_store = datastore_manager.get_datastore("state", DataStore.DS_PROFILE.STATE)
 
+        state_cfg = dict(bootstrap.CFG.get_safe('container.state_repository', None) or {})
+        state_cfg.update(config or {})
+        self.write_behind = float(state_cfg.get('write_behind', 0))
+        self.delta = bool(state_cfg.get('delta', False))
+        self.compact_every = int(state_cfg.get('compact_every', 20))
+        self.optimistic = bool(state_cfg.get('optimistic', False)) or self.delta or self.write_behind > 0
+
+        self._revs = {}         # key -> last known rev of the state doc
+        self._states = {}       # key -> last written state (delta mode)
+        self._delta_seq = {}    # key -> number of deltas written on top of the state doc
+        self._pending = {}      # key -> state not yet written (write-behind mode)
+        self._flush_gl = None
+
     def close(self):
         """
-        Pass-through method to close the underlying datastore.
+        Pass-through method to close the underlying datastore. Writes pending states first.
         """
+        if self._flush_gl:
+            self._flush_gl.kill()
+            self._flush_gl = None
+        self.flush()
+        if self._flush_gl:
+            self._flush_gl.kill()
+            self._flush_gl = None
+        if self._pending:
+            log.error("Persistent state for keys=%s could not be stored and is lost" % self._pending.keys())
         self.state_store.close()
 
     def put_state(self, key, state):
         log.debug("Store persistent state for key=%s" % key)
         if not isinstance(state, dict):
             raise BadRequest("state must be type dict, not %s" % type(state))
-        try:
-            state_obj = self.state_store.read(key)
-            state_obj.state = state
-            state_obj.ts = get_ion_ts()
-            self.state_store.update(state_obj)
-        except NotFound as nf:
-            state_obj = ProcessState(state=state, ts=get_ion_ts())
-            self.state_store.create(state_obj, object_id=key)
+        if not self.optimistic:
+            try:
+                state_obj = self.state_store.read(key)
+                state_obj.state = state
+                state_obj.ts = get_ion_ts()
+                self.state_store.update(state_obj)
+            except NotFound as nf:
+                state_obj = ProcessState(state=state, ts=get_ion_ts())
+                self.state_store.create(state_obj, object_id=key)
+        elif self.write_behind > 0:
+            self._pending[key] = deepcopy(state)
+            if not self._flush_gl:
+                self._flush_gl = spawn(self._flush_later)
+        else:
+            self._write_state(key, state)
 
     def get_state(self, key):
         log.debug("Retrieving persistent state for key=%s" % key)
+        if key in self._pending:
+            return deepcopy(self._pending[key])
+        if self.delta:
+            return self._read_state(key)
         state_obj = self.state_store.read(key)
+        if self.optimistic:
+            self._revs[key] = state_obj._rev
         return state_obj.state
+
+    def flush(self):
+        """
+        Writes all pending states (write-behind mode). States that fail to be written stay
+        pending, unless a newer state was put meanwhile, and are retried with the next flush.
+        """
+        pending, self._pending = self._pending, {}
+        failed = False
+        for key, state in pending.iteritems():
+            try:
+                self._write_state(key, state)
+            except Exception:
+                log.exception("Failed to store persistent state for key=%s, will retry" % key)
+                self._pending.setdefault(key, state)
+                failed = True
+        if failed and not self._flush_gl:
+            self._flush_gl = spawn(self._flush_later)
+
+    def _flush_later(self):
+        gevent.sleep(self.write_behind)
+        self._flush_gl = None
+        self.flush()
+
+    def _write_state(self, key, state):
+        if self.delta and key in self._states and self._delta_seq.get(key, 0) < self.compact_every:
+            self._write_delta(key, state)
+        else:
+            self._write_full(key, state)
+
+    def _write_full(self, key, state):
+        if self.delta and key not in self._delta_seq:
+            # Not read or written before: find the deltas on top of the current state doc,
+            # so that compaction removes them
+            try:
+                cur_obj = self.state_store.read(key)
+                self._revs[key] = cur_obj._rev
+                self._delta_seq[key] = self._count_deltas(key, cur_obj._rev)
+            except NotFound:
+                pass
+
+        old_rev, old_seq = self._revs.get(key, None), self._delta_seq.get(key, 0)
+        state_obj = ProcessState(state=state, ts=get_ion_ts())
+        try:
+            if old_rev is None:
+                _, new_rev = self.state_store.create(state_obj, object_id=key)
+            else:
+                state_obj._id, state_obj._rev = key, old_rev
+                _, new_rev = self.state_store.update(state_obj)
+        except (BadRequest, Conflict, NotFound):
+            # Cached revision is stale or state doc exists/was removed: re-read and retry once
+            log.debug("Revision of state key=%s not current, re-reading" % key)
+            try:
+                cur_obj = self.state_store.read(key)
+                state_obj._id, state_obj._rev = key, cur_obj._rev
+                _, new_rev = self.state_store.update(state_obj)
+            except NotFound:
+                state_obj = ProcessState(state=state, ts=get_ion_ts())
+                _, new_rev = self.state_store.create(state_obj, object_id=key)
+        self._revs[key] = new_rev
+
+        if self.delta:
+            # This was a compaction: remove the deltas of the previous revision
+            self._states[key] = deepcopy(state)
+            self._delta_seq[key] = 0
+            for seq in xrange(1, old_seq + 1):
+                try:
+                    self.state_store.delete_doc(self._get_delta_id(key, old_rev, seq))
+                except Exception:
+                    log.warn("Could not delete state delta %s of key=%s" % (seq, key))
+
+    def _write_delta(self, key, state):
+        old_state = self._states[key]
+        delta = dict(set=dict((k, v) for k, v in state.iteritems() if k not in old_state or old_state[k] != v),
+                     unset=[k for k in old_state if k not in state])
+        if not delta['set'] and not delta['unset']:
+            return
+        seq = self._delta_seq[key] + 1
+        try:
+            self.state_store.create(ProcessState(state=delta, ts=get_ion_ts()),
+                                    object_id=self._get_delta_id(key, self._revs[key], seq))
+        except BadRequest:
+            # Delta exists already, e.g. written by another instance: fall back to full state
+            self._write_full(key, state)
+            return
+        self._states[key] = deepcopy(state)
+        self._delta_seq[key] = seq
+
+    def _read_state(self, key):
+        """
+        Reads the state doc and applies all deltas written on top of its revision.
+        """
+        state_obj = self.state_store.read(key)
+        state = deepcopy(state_obj.state)
+        seq = 0
+        while True:
+            try:
+                delta = self.state_store.read(self._get_delta_id(key, state_obj._rev, seq + 1)).state
+            except NotFound:
+                break
+            seq += 1
+            state.update(delta.get('set', {}))
+            for k in delta.get('unset', []):
+                state.pop(k, None)
+
+        self._revs[key] = state_obj._rev
+        self._states[key] = deepcopy(state)
+        self._delta_seq[key] = seq
+        return state
+
+    def _count_deltas(self, key, rev):
+        seq = 0
+        while True:
+            try:
+                self.state_store.read_doc(self._get_delta_id(key, rev, seq + 1))
+            except NotFound:
+                return seq
+            seq += 1
+
+    def _get_delta_id(self, key, rev, seq):
+        return "%s_delta_%s_%s" % (key, rev, seq)
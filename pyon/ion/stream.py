@@ -6,9 +6,13 @@ from pyon.util import log
 __author__ = 'Michael Meisinger, David Stuebe, Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
+import time
+from Queue import Empty
+
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.ion.endpoint import ProcessPublisher, ProcessSubscriber, PublisherError
-from pyon.net.channel import PublisherChannel, SubscriberChannel, ChannelError
+from pyon.net.channel import PublisherChannel, SubscriberChannel, ChannelError, ChannelClosedError
+from pyon.net.endpoint import ListeningBaseEndpoint
 from pyon.util.async import  spawn
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceProcessClient
 from pyon.core import bootstrap
@@ -86,6 +90,10 @@ class StreamPublisherRegistrar(object):
 class StreamSubscriber(ProcessSubscriber):
     """
     Data management abstraction of the subscriber endpoint
+
+    In micro-batch mode (batch_size > 1), the subscriber drains up to batch_size messages, waiting at most
+    batch_timeout ms after the first one, and routes them as one list to the process' call_process_batch.
+    The batch is acked at once when the call succeeds.
     """
     class NoBindSubscriberChannel(SubscriberChannel):
 
@@ -101,18 +109,22 @@ class StreamSubscriber(ProcessSubscriber):
     channel_type = NoBindSubscriberChannel
 
 
-    def __init__(self, **kwargs):
+    def __init__(self, batch_size=None, batch_timeout=None, **kwargs):
         """
         @param name is a tuple (xp, exchange_name)
         @param callback is a call back function
         @param Process is the subscribing process
         @param node is cc.node
+        @param batch_size is the maximum number of messages per batch; None or 1 delivers messages one by one
+        @param batch_timeout is the maximum time in ms to wait for a batch to fill after its first message
         """
         if not kwargs.get('callback', None):
             kwargs = kwargs.copy()
             kwargs['callback'] = self._callback
 
         self._routing_call = None
+        self._batch_size = batch_size if batch_size and batch_size > 1 else None
+        self._batch_timeout = batch_timeout or 0
 
         ProcessSubscriber.__init__(self, **kwargs)
 
@@ -130,6 +142,68 @@ class StreamSubscriber(ProcessSubscriber):
         """
         self._routing_call(self._process.call_process, {'packet':m})
 
+    def listen(self, binding=None):
+        """
+        Listen loop; in micro-batch mode consumes messages in batches
+        """
+        if not self._batch_size:
+            return ProcessSubscriber.listen(self, binding=binding)
+
+        self.prepare_listener(binding=binding)
+        self._ready_event.set()
+
+        while True:
+            try:
+                self.get_batch()
+            except ChannelClosedError:
+                log.debug('Channel was closed during StreamSubscriber.listen')
+                break
+
+    def get_batch(self):
+        """
+        Retrieves up to batch_size messages, waiting at most batch_timeout ms after the first one for more to arrive,
+        and routes them to the process' call_process_batch. Messages already queued are taken up to batch_size
+        even if the batch_timeout is 0 or has passed. Acks the batch if the call succeeds, rejects it otherwise.
+        Messages received before the channel is closed are not acked and will be redelivered.
+
+        @raises ChannelClosedError  If the channel has been closed.
+        @returns                    The number of messages processed.
+        """
+        assert self._chan, "get_batch needs a channel setup"
+
+        packets, delivery_tags = [], []
+        collect = lambda m, h: packets.append(m)
+        deadline = None
+        while len(delivery_tags) < self._batch_size:
+            # After the deadline, only take messages that are already there
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                with self._chan.accept(timeout=timeout) as newchan:
+                    msg, headers, delivery_tag = newchan.recv()
+                    try:
+                        e = ListeningBaseEndpoint.create_endpoint(self, callback=collect, existing_channel=newchan)
+                        e._message_received(msg, headers)
+                    except Exception:
+                        log.exception("Unhandled error while handling received message")
+                        newchan.reject(delivery_tag)
+                    else:
+                        delivery_tags.append(delivery_tag)
+            except Empty:
+                break
+            if deadline is None:
+                deadline = time.time() + self._batch_timeout / 1000.0
+
+        if not packets:
+            return 0
+
+        ar = self._routing_call(self._process.call_process_batch, {'packets':packets})
+        if ar.get():
+            self._chan.ack(delivery_tags[-1], multiple=True)
+        else:
+            for delivery_tag in delivery_tags:
+                self._chan.reject(delivery_tag)
+        return len(packets)
+
     def start(self):
         """
         Start consuming from the queue
@@ -189,9 +263,10 @@ class StreamSubscriberRegistrar(object):
             raise PublisherError('Invalid CFG for core_xps.science_data: "%s"; must have "xs.xp" structure' % xs_dot_xp)
 
 
-    def create_subscriber(self, exchange_name=None, callback=None):
+    def create_subscriber(self, exchange_name=None, callback=None, batch_size=None, batch_timeout=None):
         """
         This method creates a new subscriber, a new exchange_name if it does not already exist.
+        batch_size and batch_timeout (ms) enable the micro-batch mode of the StreamSubscriber.
         """
 
         if not exchange_name:
@@ -201,6 +276,7 @@ class StreamSubscriberRegistrar(object):
             exchange_name =  '%s_subscriber_%d' % (self.process.id, self._subscriber_cnt)
             self._subscriber_cnt += 1
 
-        return StreamSubscriber(from_name=(self.XP, exchange_name), process=self.process, callback=callback, node=self.node)
+        return StreamSubscriber(from_name=(self.XP, exchange_name), process=self.process, callback=callback, node=self.node,
+                                batch_size=batch_size, batch_timeout=batch_timeout)
 
 
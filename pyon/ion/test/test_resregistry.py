@@ -3,10 +3,11 @@
 __author__ = 'Michael Meisinger'
 
 from unittest import SkipTest
+from mock import Mock, patch
 
 from pyon.core.bootstrap import IonObject
-from pyon.core.exception import NotFound, Inconsistent
-from pyon.ion.resource import PRED, RT
+from pyon.core.exception import BadRequest, Conflict, NotFound, Inconsistent
+from pyon.ion.resource import PRED, RT, LCS, LCE
 from pyon.util.int_test import IonIntegrationTestCase
 from nose.plugins.attrib import attr
 
@@ -69,3 +70,96 @@ class TestResourceRegistry(IonIntegrationTestCase):
         aid4,_ = self.rr.create_association(rid1, PRED.hasResource, rid5)
 
         read_obj5 = self.rr.read_object(rid1, PRED.hasResource, RT.PlatformDevice)
+
+    def test_rr_update_unmodified(self):
+        rid, rev = self.rr.create(IonObject(RT.InstrumentDevice, name="ID1"))
+        res_obj = self.rr.read(rid)
+
+        # Update without modification does not write
+        upd_id, upd_rev = self.rr.update(res_obj)
+        self.assertEquals((upd_id, upd_rev), (rid, rev))
+        self.assertEquals(self.rr.read(rid)._rev, rev)
+
+        res_obj.description = "updated"
+        upd_id, upd_rev = self.rr.update(res_obj)
+        self.assertNotEquals(upd_rev, rev)
+        res_obj = self.rr.read(rid)
+        self.assertEquals(res_obj.description, "updated")
+
+        events = self.container.event_repository.find_events(origin=rid, event_type="ResourceModifiedEvent")
+        self.assertEquals(sorted([event.sub_type for _, _, event in events]), ["CREATE", "UPDATE"])
+
+    def test_rr_create_update_mult(self):
+        actor_id,_ = self.rr.create(IonObject(RT.ActorIdentity, name="actor1"))
+
+        res_list = [IonObject(RT.InstrumentDevice, name="ID%s" % i) for i in xrange(3)]
+        res = self.rr.create_mult(res_list, actor_id=actor_id)
+        self.assertEquals([success for success, _, _ in res], [True, True, True])
+        res_ids = [rid for _, rid, _ in res]
+
+        res_objs = self.rr.read_mult(res_ids)
+        self.assertEquals([res_obj.name for res_obj in res_objs], ["ID0", "ID1", "ID2"])
+        self.assertTrue(all([res_obj.lcstate and res_obj.ts_created for res_obj in res_objs]))
+
+        owned_ids, _ = self.rr.find_subjects(RT.InstrumentDevice, PRED.hasOwner, actor_id, id_only=True)
+        self.assertEquals(set(owned_ids), set(res_ids))
+
+        for res_obj in res_objs:
+            res_obj.description = "updated"
+        upd_res = self.rr.update_mult(res_objs)
+        self.assertEquals([success for success, _, _ in upd_res], [True, True, True])
+        self.assertEquals(self.rr.read(res_ids[0]).description, "updated")
+
+        # Objects still have the old revision
+        upd_res = self.rr.update_mult(res_objs)
+        self.assertEquals([success for success, _, _ in upd_res], [False, False, False])
+
+        events = self.container.event_repository.find_events(origin=res_ids[0], event_type="ResourceModifiedEvent")
+        self.assertEquals(sorted([event.sub_type for _, _, event in events]), ["CREATE", "UPDATE"])
+
+    def test_rr_create_mult_failure(self):
+        actor_id,_ = self.rr.create(IonObject(RT.ActorIdentity, name="actor1"))
+
+        # The last create fails in the datastore
+        real_store = self.rr.rr_store
+        rr_store = Mock(wraps=real_store)
+        def create_mult_fail_last(objects, *args, **kwargs):
+            return real_store.create_mult(objects[:-1]) + [(False, "failed_id", "conflict")]
+        rr_store.create_mult.side_effect = create_mult_fail_last
+
+        res_list = [IonObject(RT.InstrumentDevice, name="ID%s" % i) for i in xrange(3)]
+        with patch.object(self.rr, 'rr_store', rr_store):
+            res = self.rr.create_mult(res_list, actor_id=actor_id)
+        self.assertEquals([success for success, _, _ in res], [True, True, False])
+        self.assertEquals(res[2], (False, "failed_id", "conflict"))
+
+        owned_ids, _ = self.rr.find_subjects(RT.InstrumentDevice, PRED.hasOwner, actor_id, id_only=True)
+        self.assertEquals(set(owned_ids), set([rid for _, rid, _ in res[:2]]))
+
+        events = self.container.event_repository.find_events(origin="failed_id", event_type="ResourceModifiedEvent")
+        self.assertEquals(len(events), 0)
+
+    def test_rr_lifecycle_mult(self):
+        res_list = [IonObject(RT.InstrumentDevice, name="ID%s" % i) for i in xrange(3)]
+        res_ids = [rid for _, rid, _ in self.rr.create_mult(res_list)]
+
+        lc_res = self.rr.execute_lifecycle_transition_mult(res_ids + ["Non_Existent"], LCE.PLAN)
+        self.assertEquals([success for success, _, _ in lc_res], [True, True, True, False])
+        self.assertEquals([new_state for _, _, new_state in lc_res[:3]], [LCS.PLANNED_PRIVATE] * 3)
+        self.assertIsInstance(lc_res[3][2], NotFound)
+        self.assertEquals([res_obj.lcstate for res_obj in self.rr.read_mult(res_ids)], [LCS.PLANNED_PRIVATE] * 3)
+
+        lc_res = self.rr.execute_lifecycle_transition_mult(res_ids[:1], LCE.PLAN)
+        self.assertFalse(lc_res[0][0])
+        self.assertIsInstance(lc_res[0][2], BadRequest)
+
+        lc_res = self.rr.set_lifecycle_state_mult([res_ids[0], res_ids[1], res_ids[1]], LCS.PLANNED_AVAILABLE)
+        self.assertEquals([success for success, _, _ in lc_res], [True, True, False])
+        self.assertIsInstance(lc_res[2][2], Conflict)
+        self.assertEquals(self.rr.read(res_ids[1]).lcstate, LCS.PLANNED_AVAILABLE)
+
+        lc_res = self.rr.set_lifecycle_state_mult(res_ids[:1], LCS.DRAFT_PRIVATE)
+        self.assertIsInstance(lc_res[0][2], BadRequest)
+
+        events = self.container.event_repository.find_events(origin=res_ids[0], event_type="ResourceLifecycleEvent")
+        self.assertEquals(len(events), 2)
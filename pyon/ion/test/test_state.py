@@ -3,6 +3,9 @@
 __author__ = 'Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+from mock import Mock, patch
+
+from pyon.core.exception import NotFound
 from pyon.ion.state import StateRepository
 from pyon.util.unit_test import IonUnitTestCase
 from unittest import SkipTest
@@ -29,3 +32,69 @@ class TestState(IonUnitTestCase):
 
         state4 = state_repo.get_state("id1")
         self.assertEquals(state3, state4)
+
+    def test_state_optimistic(self):
+        dsm = DatastoreManager()
+        state_repo = StateRepository(dsm, config=dict(optimistic=True))
+        state_repo1 = StateRepository(dsm)
+
+        state_repo.put_state("id2", {'key':'value1'})
+        state_repo.put_state("id2", {'key':'value2'})
+        self.assertEquals(state_repo1.get_state("id2"), {'key':'value2'})
+
+        # Update through other repository makes cached revision stale
+        state_repo1.put_state("id2", {'key':'value3'})
+        state_repo.put_state("id2", {'key':'value4'})
+        self.assertEquals(state_repo1.get_state("id2"), {'key':'value4'})
+
+    def test_state_delta(self):
+        dsm = DatastoreManager()
+        state_repo = StateRepository(dsm, config=dict(delta=True, compact_every=3))
+
+        state = {'key1':'value1', 'key2':'value2'}
+        state_repo.put_state("id3", state)
+        for i in xrange(5):
+            state = dict(state, count=i)
+            if i == 2:
+                del state['key2']
+            state_repo.put_state("id3", state)
+            self.assertEquals(StateRepository(dsm, config=dict(delta=True)).get_state("id3"), state)
+
+        # Deltas of the previous revision are removed by compaction
+        self.assertEquals(state_repo._delta_seq["id3"], 1)
+        self.assertEquals(len([doc_id for doc_id in state_repo.state_store.list_objects() if doc_id.startswith("id3_delta")]), 1)
+
+        # Plain repositories only see the last compacted state
+        self.assertEquals(StateRepository(dsm).get_state("id3"), {'key1':'value1', 'count':3})
+
+        # Compaction by a repository that did not read the state removes the deltas as well
+        StateRepository(dsm, config=dict(delta=True)).put_state("id3", {'key1':'value5'})
+        self.assertEquals(len([doc_id for doc_id in state_repo.state_store.list_objects() if doc_id.startswith("id3_delta")]), 0)
+        self.assertEquals(StateRepository(dsm, config=dict(delta=True)).get_state("id3"), {'key1':'value5'})
+
+    def test_state_write_behind(self):
+        dsm = DatastoreManager()
+        state_repo = StateRepository(dsm, config=dict(write_behind=10))
+        state_repo1 = StateRepository(dsm)
+
+        for i in xrange(5):
+            state_repo.put_state("id4", {'count':i})
+        self.assertEquals(state_repo.get_state("id4"), {'count':4})
+        with self.assertRaises(NotFound):
+            state_repo1.get_state("id4")
+
+        state_repo.flush()
+        self.assertEquals(state_repo1.get_state("id4"), {'count':4})
+        rev = state_repo._revs["id4"]
+
+        # States that fail to be written stay pending and are retried
+        state_repo.put_state("id4", {'count':5})
+        with patch.object(state_repo, '_write_state', Mock(side_effect=Exception("datastore down"))):
+            state_repo.flush()
+        self.assertEquals(state_repo.get_state("id4"), {'count':5})
+        self.assertTrue(state_repo._flush_gl)
+        self.assertEquals(state_repo1.get_state("id4"), {'count':4})
+
+        state_repo.close()
+        self.assertEquals(state_repo1.get_state("id4"), {'count':5})
+        self.assertNotEquals(state_repo._revs["id4"], rev)
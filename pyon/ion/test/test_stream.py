@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from contextlib import contextmanager
+from Queue import Empty
+
+from mock import Mock, sentinel, patch, call
+from nose.plugins.attrib import attr
+
+from pyon.ion.stream import StreamSubscriber
+from pyon.util.unit_test import PyonTestCase
+
+
+@attr('UNIT')
+class TestStreamSubscriber(PyonTestCase):
+
+    def _make_subscriber(self, messages, batch_size, success=True, batch_timeout=50):
+        sub = StreamSubscriber(from_name=('xp', 'queue'), process=sentinel.process, node=sentinel.node,
+                               batch_size=batch_size, batch_timeout=batch_timeout)
+        pending = list(messages)
+        sub.accept_timeouts = []
+
+        @contextmanager
+        def accept(timeout=None):
+            sub.accept_timeouts.append(timeout)
+            if not pending:
+                raise Empty
+            newchan = Mock()
+            newchan.recv.return_value = pending.pop(0)
+            yield newchan
+
+        sub._chan = Mock()
+        sub._chan.accept = accept
+        sub._process = Mock()
+        sub.routing_call = Mock(return_value=Mock(get=Mock(return_value=success)))
+        return sub
+
+    @patch('pyon.net.endpoint.ListeningBaseEndpoint.create_endpoint')
+    def test_get_batch(self, mockce):
+        mockce.side_effect = lambda ep, callback=None, existing_channel=None: Mock(_message_received=callback)
+        messages = [(sentinel.msg1, {}, 1), (sentinel.msg2, {}, 2), (sentinel.msg3, {}, 3)]
+
+        # Drains what is there, up to the batch size
+        sub = self._make_subscriber(messages, 5)
+        self.assertEquals(sub.get_batch(), 3)
+        sub.routing_call.assert_called_once_with(sub._process.call_process_batch,
+                                                 {'packets': [sentinel.msg1, sentinel.msg2, sentinel.msg3]})
+        sub._chan.ack.assert_called_once_with(3, multiple=True)
+
+        sub = self._make_subscriber(messages, 2)
+        self.assertEquals(sub.get_batch(), 2)
+        sub._chan.ack.assert_called_once_with(2, multiple=True)
+        self.assertEquals(sub.get_batch(), 1)
+        self.assertEquals(sub.get_batch(), 0)
+
+        # Without a timeout, messages already there are still batched
+        sub = self._make_subscriber(messages, 5, batch_timeout=None)
+        self.assertEquals(sub.get_batch(), 3)
+        self.assertEquals(sub.accept_timeouts, [None, 0, 0, 0])
+
+        # Failed batches are rejected
+        sub = self._make_subscriber(messages, 5, success=False)
+        self.assertEquals(sub.get_batch(), 3)
+        self.assertFalse(sub._chan.ack.called)
+        self.assertEquals(sub._chan.reject.call_args_list, [call(1), call(2), call(3)])
+
+    def test_no_batch(self):
+        sub = StreamSubscriber(from_name=('xp', 'queue'), process=sentinel.process, node=sentinel.node, batch_size=1)
+        self.assertIsNone(sub._batch_size)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from StringIO import StringIO
+
+from pyon.ion.transform import TransformChain, TransformFunction
+from pyon.ion.transform_bench import TransformBenchmark, percentile, write_results, RESULT_FIELDS
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+
+
+def add_one(packet):
+    return [x + 1 for x in packet]
+
+def drop_empty(packet):
+    return packet or None
+
+class DoubleTransform(TransformFunction):
+    def execute(self, input):
+        return [x * 2 for x in input]
+
+class ReverseTransform(TransformFunction):
+    def process(self, packet):
+        if isinstance(packet, list):
+            self.publish(packet[::-1])
+
+
+@attr('UNIT')
+class TestTransformChain(PyonTestCase):
+
+    def _make_chain(self, stages, subscribed):
+        chain = TransformChain()
+        chain.CFG = DotDict({'process': {'publish_streams': {'l1_stream': 'l1_id', 'output': 'output_id'},
+                                         'chain': {'stages': stages}}})
+        chain.container = Mock()
+        chain.container.resource_registry.find_subjects.return_value = (['sub_id'] if subscribed else [], [])
+        chain.l1_stream = Mock()
+        chain.output = Mock()
+        chain.on_start()
+        return chain
+
+    def test_process(self):
+        stages = [{'transform': 'pyon.ion.test.test_transform.add_one', 'name': 'L1', 'publish_stream': 'l1_stream'},
+                  'pyon.ion.test.test_transform.DoubleTransform']
+
+        # Intermediate stream without subscription is not published
+        chain = self._make_chain(stages, False)
+        chain.process([1, 2])
+        chain.process([3])
+        self.assertFalse(chain.l1_stream.publish.called)
+        self.assertEquals(chain.output.publish.call_args_list[0][0][0], [4, 6])
+        self.assertEquals(chain.output.publish.call_args_list[1][0][0], [8])
+        self.assertEquals(chain.container.resource_registry.find_subjects.call_count, 1)
+
+        stats = chain.get_stage_stats()
+        self.assertEquals([stage['name'] for stage in stats], ['L1', 'DoubleTransform'])
+        self.assertEquals([stage['count'] for stage in stats], [2, 2])
+        self.assertEquals([stage['published'] for stage in stats], [0, 2])
+
+        # Subscribed intermediate stream
+        chain = self._make_chain(stages, True)
+        chain.process([1, 2])
+        chain.l1_stream.publish.assert_called_once_with([2, 3])
+        chain.output.publish.assert_called_once_with([4, 6])
+
+    def test_filter(self):
+        chain = self._make_chain([drop_empty, add_one], False)
+        chain.process([])
+        self.assertFalse(chain.output.publish.called)
+        self.assertEquals([stage['count'] for stage in chain.get_stage_stats()], [1, 0])
+
+        self.assertRaises(KeyError, chain.add_stage, add_one, publish_stream='unknown')
+
+
+@attr('UNIT')
+class TestTransformBenchmark(PyonTestCase):
+
+    def test_run_local(self):
+        bench = TransformBenchmark(ReverseTransform, message_type='list', granule_size=10, num_messages=20, fanout=3,
+                                   encode=False)
+        result = bench.run()
+        self.assertEquals(set(result), set(RESULT_FIELDS))
+        self.assertEquals(result['processed'], 60)
+        self.assertEquals(result['published'], 60)
+        self.assertEquals(result['errors'], 0)
+        self.assertGreater(result['throughput'], 0)
+        self.assertTrue(0 <= result['latency_p50'] <= result['latency_p95'] <= result['latency_p99'] <= result['latency_max'])
+
+        fid = StringIO()
+        write_results([result], fid, 'csv')
+        lines = fid.getvalue().splitlines()
+        self.assertEquals(len(lines), 2)
+        self.assertEquals(lines[0].split(','), list(RESULT_FIELDS))
+
+        self.assertRaises(ValueError, TransformBenchmark, ReverseTransform, transport='carrier_pigeon')
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEquals(percentile(values, 50), 50)
+        self.assertEquals(percentile(values, 95), 95)
+        self.assertEquals(percentile(values, 99), 99)
+        self.assertEquals(percentile([7], 99), 7)
+        self.assertEquals(percentile([], 50), 0.0)
@@ -13,12 +13,17 @@ from pyon.container.cc import Container
 from pyon.core.bootstrap import get_sys_name
 from pyon.event.event import EventPublisher
 
+from pyon.ion.granule.granule import concatenate
+from pyon.ion.resource import RT, PRED
 from pyon.ion.streamproc import StreamProcess
 from pyon.net.endpoint import Subscriber, Publisher
 from pyon.net.transport import NameTrio
 from pyon.util.async import spawn
+from pyon.util.containers import named_any
 from pyon.util.log import log
 
+from interface.objects import Granule
+
 class TransformBase(StreamProcess):
     """
 
@@ -73,6 +78,9 @@ class TransformProcessAdaptor(TransformBase):
 class TransformDataProcess(TransformBase):
     """Model for a TransformDataProcess
 
+    With process.batch.size > 1 in the config, the stream subscriber delivers messages in batches of up to that
+    size, waiting at most process.batch.timeout ms for a batch to fill, to process_batch. With
+    process.batch.concatenate, batches of granules are concatenated into one granule first.
     """
     def __init__(self):
         super(TransformDataProcess,self).__init__()
@@ -80,10 +88,38 @@ class TransformDataProcess(TransformBase):
 
     def on_start(self):
         super(TransformDataProcess,self).on_start()
+        self._batch_concatenate = self.CFG.get_safe('process.batch.concatenate', False)
 
     def process(self, packet):
         pass
 
+    def call_process_batch(self, packets):
+        """
+        Called by the stream subscriber in micro-batch mode. Returns True if the batch was processed, which acks it
+        """
+        try:
+            if self._batch_concatenate and len(packets) > 1 and all(isinstance(packet, Granule) for packet in packets):
+                try:
+                    packets = [concatenate(packets)]
+                except ValueError as ve:
+                    log.warn('Can not concatenate batch of granules, processing them one by one: %s', ve)
+            self.process_batch(packets)
+        except Exception as e:
+            log.exception('Unhandled caught in transform process_batch')
+            event_publisher = EventPublisher()
+            event_publisher.publish_event(origin=self._transform_id, event_type='ExceptionEvent',
+                exception_type=str(type(e)), exception_message=e.message)
+            return False
+        return True
+
+    def process_batch(self, packets):
+        """
+        Processes a list of messages received in one batch. Override to amortize per message overhead, e.g.
+        by vectorizing over the concatenated granules. The default calls process for each message.
+        """
+        for packet in packets:
+            self.process(packet)
+
     def callback(self):
         pass
 
@@ -110,67 +146,17 @@ class TransformDataProcess(TransformBase):
 
 class TransformBenchTesting(TransformDataProcess):
     """
-    Easiest way to run:
-    from pyon.util.containers import DotDict
-    tbt=cc.proc_manager._create_service_instance('55', 'tbt', 'pyon.ion.transform', 'TransformBenchTesting', DotDict({'process':{'name':'tbt', 'transform_id':'55'}}))
-    tbt.init()
-    tbt.start()
+    Base of the benchmark transforms in prototype/transforms. Counts published messages.
+    Benchmarks are run with scripts/bench_transforms.py (see pyon.ion.transform_bench), which drives these
+    transforms in-process or through the broker and reports throughput and latency percentiles.
+    When spawned as a process, consumes from the bench_queue and publishes to an anonymous exchange.
     """
     transform_number = 0
-    message_length = 0
     def __init__(self):
         super(TransformBenchTesting,self).__init__()
         self.count = 0
         TransformBenchTesting.transform_number += 1
 
-        
-    def perf(self):
-
-        with open('/tmp/pyon_performance.dat','a') as f:
-            then = time.time()
-            ocount = self.count
-            while True:
-                gevent.sleep(2.)
-                now = time.time()
-                count = self.count
-                delta_t = now - then
-                delta_c = count - ocount
-
-                f.write('%s|%s\t%s\t%s\t%3.3f\n' % (get_sys_name(),time.strftime("%H:%M:%S", time.gmtime()),TransformBenchTesting.message_length,TransformBenchTesting.transform_number, float(delta_c) / delta_t))
-                then = now
-                ocount = count
-                f.flush()
-            
-        
-        
-
-    @staticmethod
-    def launch_benchmark(transform_number=1, primer=1,message_length=4):
-        import gevent
-        from gevent.greenlet import Greenlet
-        from pyon.util.containers import DotDict
-        from pyon.net.transport import NameTrio
-        from pyon.net.endpoint import Publisher
-        import uuid
-        num = transform_number
-        msg_len = message_length
-        transforms = list()
-        pids = 1
-        TransformBenchTesting.message_length = message_length
-        cc = Container.instance
-        pub = Publisher(to_name=NameTrio(get_sys_name(),str(uuid.uuid4())[0:6]))
-        for i in xrange(num):
-            tbt=cc.proc_manager._create_service_instance(str(pids), 'tbt', 'prototype.transforms.linear', 'TransformInPlace', DotDict({'process':{'name':'tbt%d' % pids, 'transform_id':pids}}))
-            tbt.init()
-            tbt.start()
-            gevent.sleep(0.2)
-            for i in xrange(primer):
-                pub.publish(list(xrange(msg_len)))
-            g = Greenlet(tbt.perf)
-            g.start()
-            transforms.append(tbt)
-            pids += 1
-
     def on_start(self):
         TransformDataProcess.on_start(self)
 
@@ -207,11 +193,7 @@ class TransformBenchTesting(TransformDataProcess):
 
 class TransformBenchNewGranuleTesting(TransformBenchTesting):
     """
-    Easiest way to run:
-    from pyon.util.containers import DotDict
-    tbt=cc.proc_manager._create_service_instance('55', 'tbt', 'pyon.ion.transform', 'TransformBenchTesting', DotDict({'process':{'name':'tbt', 'transform_id':'55'}}))
-    tbt.init()
-    tbt.start()
+    Benchmark transform base for granule messages, see TransformBenchTesting
     """
 
     def __init__(self):
@@ -220,52 +202,6 @@ class TransformBenchNewGranuleTesting(TransformBenchTesting):
         TransformBenchNewGranuleTesting.transform_number += 1
 
 
-
-
-    @staticmethod
-    def launch_benchmark(transform_number=1, primer=1,message_length=4):
-        import gevent
-        from gevent.greenlet import Greenlet
-        from pyon.util.containers import DotDict
-        from pyon.net.transport import NameTrio
-        from pyon.net.endpoint import Publisher
-        import numpy
-        from pyon.ion.granule.record_dictionary import RecordDictionaryTool
-        from pyon.ion.granule.taxonomy import TaxyTool
-        from pyon.ion.granule.granule import build_granule
-
-        tt = TaxyTool()
-        tt.add_taxonomy_set('a')
-
-        import uuid
-        num = transform_number
-        msg_len = message_length
-        transforms = list()
-        pids = 1
-        TransformBenchTesting.message_length = message_length
-        cc = Container.instance
-        pub = Publisher(to_name=NameTrio(get_sys_name(),str(uuid.uuid4())[0:6]))
-        for i in xrange(num):
-            tbt=cc.proc_manager._create_service_instance(str(pids), 'tbt', 'prototype.transforms.linear', 'TransformInPlaceNewGranule', DotDict({'process':{'name':'tbt%d' % pids, 'transform_id':pids}}))
-            tbt.init()
-            tbt.start()
-            gevent.sleep(0.2)
-            for i in xrange(primer):
-                rd = RecordDictionaryTool(tt, message_length)
-                rd['a'] = numpy.arange(message_length)
-                gran = build_granule(data_producer_id='dp_id',taxonomy=tt, record_dictionary=rd)
-                pub.publish(gran)
-
-            g = Greenlet(tbt.perf)
-            g.start()
-            transforms.append(tbt)
-            pids += 1
-
-
-
-
-
-
 class TransformFunction(TransformDataProcess):
     """ Represents a transform function
     Input is given to the transform, it runs until the transform is complete
@@ -285,3 +221,121 @@ class TransformFunction(TransformDataProcess):
             self.publish(ret)
 
 
+class TransformChain(TransformDataProcess):
+    """
+    Runs an ordered list of transforms back-to-back in one process on the same in-memory granule, instead of
+    deploying them as separate processes connected through the broker.
+
+    Configuration (process.chain):
+    - stages: list of stages, each a dotted path of a transform function or of a TransformFunction class, or a dict
+      with transform (dotted path), optional name and optional publish_stream, the name of one of the
+      process.publish_streams to publish the stage's output on. Functions are called with the stage input and
+      return its output; classes are instantiated and their execute is called. A stage returning None ends the chain
+      for that message.
+    - subscription_check_interval: seconds to cache whether an intermediate stream has subscriptions (default 10)
+
+    Intermediate outputs are only published if their stream has a subscription. The output of the last stage is
+    published on all publish streams not used by intermediate stages.
+    """
+    def __init__(self):
+        super(TransformChain,self).__init__()
+        self.stages = []
+        self._subscribed = {}       # stream_id -> (time checked, has subscription)
+
+    def on_start(self):
+        super(TransformChain,self).on_start()
+        chain_cfg = self.CFG.get_safe('process.chain', None) or {}
+        self.subscription_check_interval = float(chain_cfg.get('subscription_check_interval', 10))
+        for stage in chain_cfg.get('stages', None) or []:
+            if isinstance(stage, dict):
+                self.add_stage(**stage)
+            else:
+                self.add_stage(stage)
+
+    def on_quit(self):
+        for stage in self.stages:
+            if stage['instance'] is not None:
+                stage['instance'].on_quit()
+        super(TransformChain,self).on_quit()
+
+    def add_stage(self, transform, name=None, publish_stream=None):
+        """
+        Appends a stage to the chain. transform is a function, a TransformFunction class or a dotted path to one.
+        """
+        if isinstance(transform, basestring):
+            transform = named_any(transform)
+        instance = None
+        if isinstance(transform, type):
+            instance = transform()
+            instance.CFG = self.CFG
+            instance.container = self.container
+            instance.on_start()
+            execute = instance.execute
+        elif callable(transform):
+            execute = transform
+        else:
+            raise TypeError('Invalid transform chain stage "%s"' % transform)
+        if publish_stream is not None and publish_stream not in self.streams:
+            raise KeyError('Transform chain stage "%s" publish stream "%s" is not a publish stream' % (name, publish_stream))
+
+        self.stages.append(dict(name=name or getattr(transform, '__name__', str(transform)), execute=execute,
+                                instance=instance, publish_stream=publish_stream,
+                                count=0, time=0.0, time_max=0.0, published=0))
+        self._pub_init = False
+
+    def process(self, packet):
+        for stage in self.stages:
+            start_time = time.time()
+            packet = stage['execute'](packet)
+            stage_time = time.time() - start_time
+            stage['count'] += 1
+            stage['time'] += stage_time
+            if stage_time > stage['time_max']:
+                stage['time_max'] = stage_time
+            if packet is None:
+                return
+
+            if stage['publish_stream'] and stage is not self.stages[-1]:
+                if self._is_subscribed(self.streams[stage['publish_stream']]):
+                    getattr(self, stage['publish_stream']).publish(packet)
+                    stage['published'] += 1
+
+        if self.stages:
+            self.stages[-1]['published'] += 1
+        self.publish(packet)
+
+    def _publish_all(self, msg):
+        # The output of the last stage goes to all publish streams not used by intermediate stages
+        if not self._pub_init:
+            self._pub_init = True
+            intermediate = set(stage['publish_stream'] for stage in self.stages[:-1])
+            self.publishers = [getattr(self, stream) for stream in self.streams if stream not in intermediate]
+
+        for publisher in self.publishers:
+            publisher.publish(msg)
+
+    def _is_subscribed(self, stream_id):
+        """
+        Returns whether the stream has a subscription, checked through the resource registry and cached for
+        subscription_check_interval seconds. Assumes a subscription if the check fails.
+        """
+        checked = self._subscribed.get(stream_id, None)
+        now = time.time()
+        if checked is None or now - checked[0] > self.subscription_check_interval:
+            try:
+                sub_ids, _ = self.container.resource_registry.find_subjects(RT.Subscription, PRED.hasStream, stream_id, id_only=True)
+                subscribed = bool(sub_ids)
+            except Exception as ex:
+                log.debug("Could not check subscriptions of stream %s: %s", stream_id, ex)
+                subscribed = True
+            checked = (now, subscribed)
+            self._subscribed[stream_id] = checked
+        return checked[1]
+
+    def get_stage_stats(self):
+        """
+        Returns a list with a dict per stage: name, count, time, time_avg, time_max (sec) and published
+        """
+        return [dict(name=stage['name'], count=stage['count'], time=stage['time'], time_max=stage['time_max'],
+                     time_avg=stage['time'] / stage['count'] if stage['count'] else 0.0, published=stage['published'])
+                for stage in self.stages]
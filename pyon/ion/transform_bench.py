@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+"""Transform benchmark harness: drives messages through transform processes and reports throughput and latency"""
+
+__license__ = 'Apache 2.0'
+
+import csv
+import math
+import simplejson
+import time
+import uuid
+
+import gevent
+from gevent.queue import Queue
+import msgpack
+import numpy
+
+from pyon.core.bootstrap import get_obj_registry, get_sys_name
+from pyon.core.interceptor.encode import encode_ion, decode_ion
+from pyon.core.object import IonObjectSerializer, IonObjectDeserializer
+from pyon.ion.granule.granule import build_granule
+from pyon.ion.granule.record_dictionary import RecordDictionaryTool
+from pyon.ion.granule.taxonomy import TaxyTool
+from pyon.util.containers import DotDict, named_any
+from pyon.util.log import log
+
+
+# Fields of a benchmark result, in CSV column order
+RESULT_FIELDS = ('transform', 'transport', 'message_type', 'granule_size', 'rate', 'fanout', 'encode', 'num_messages',
+                 'processed', 'published', 'errors', 'elapsed', 'throughput',
+                 'latency_p50', 'latency_p95', 'latency_p99', 'latency_max')
+
+
+class TransformBenchmark(object):
+    """
+    Sends num_messages messages at a given rate (messages/sec, 0 for as fast as possible) to fanout instances of a
+    transform class and measures, for each delivered message, the time from send until the transform's process
+    returned. Transforms are instantiated in this process; their publish is replaced by a counting sink.
+
+    Transports:
+    - local: in-process queues, optionally with the encode/decode (IonObject serialization and msgpack) of the
+      messaging interceptors applied to every message
+    - amqp: Publisher/Subscriber endpoints through the broker (CFG.server.amqp), one queue per transform instance
+    """
+
+    def __init__(self, transform, message_type='granule', granule_size=1000, num_messages=1000, rate=0, fanout=1,
+                 transport='local', encode=True, timeout=300):
+        if transport not in ('local', 'amqp'):
+            raise ValueError('Invalid transport "%s"; should be local or amqp' % transport)
+        if message_type not in ('granule', 'list'):
+            raise ValueError('Invalid message type "%s"; should be granule or list' % message_type)
+        self.transform = transform
+        self.transform_cls = named_any(transform) if isinstance(transform, basestring) else transform
+        self.message_type = message_type
+        self.granule_size = granule_size
+        self.num_messages = num_messages
+        self.rate = rate
+        self.fanout = fanout
+        self.transport = transport
+        self.encode = encode or transport == 'amqp'
+        self.timeout = timeout
+
+        self._serializer = IonObjectSerializer()
+        self._deserializer = IonObjectDeserializer(obj_registry=get_obj_registry())
+        self._taxonomy = TaxyTool()
+        self._taxonomy.add_taxonomy_set('a')
+
+    def run(self):
+        """
+        Runs the benchmark and returns a result dict with the RESULT_FIELDS. Times are in sec, latencies in msec.
+        """
+        self.latencies = []
+        self.processed = 0
+        self.published = 0
+        self.errors = 0
+
+        transforms = [self._create_transform(i) for i in xrange(self.fanout)]
+        if self.transport == 'local':
+            elapsed = self._run_local(transforms)
+        else:
+            elapsed = self._run_amqp(transforms)
+
+        latencies = sorted(self.latencies)
+        return dict(transform=self.transform_cls.__name__, transport=self.transport, message_type=self.message_type,
+                    granule_size=self.granule_size, rate=self.rate, fanout=self.fanout, encode=self.encode,
+                    num_messages=self.num_messages, processed=self.processed, published=self.published,
+                    errors=self.errors, elapsed=elapsed,
+                    throughput=self.processed / elapsed if elapsed else 0.0,
+                    latency_p50=percentile(latencies, 50) * 1000,
+                    latency_p95=percentile(latencies, 95) * 1000,
+                    latency_p99=percentile(latencies, 99) * 1000,
+                    latency_max=(latencies[-1] if latencies else 0.0) * 1000)
+
+    def _create_transform(self, num):
+        transform = self.transform_cls()
+        transform.CFG = DotDict({'process': {'name': 'bench_transform_%s' % num, 'transform_id': 'bench_transform_%s' % num}})
+        transform.publish = self._sink
+        return transform
+
+    def make_message(self):
+        if self.message_type == 'list':
+            return [float(x) for x in xrange(self.granule_size)]
+        rdt = RecordDictionaryTool(self._taxonomy, self.granule_size)
+        rdt['a'] = numpy.arange(self.granule_size, dtype='float64')
+        return build_granule(data_producer_id='bench', taxonomy=self._taxonomy, record_dictionary=rdt)
+
+    def _sink(self, msg):
+        if self.encode:
+            self._encode(msg)
+        self.published += 1
+
+    def _encode(self, msg):
+        return msgpack.packb(self._serializer.serialize(msg), default=encode_ion)
+
+    def _decode(self, data):
+        return self._deserializer.deserialize(msgpack.unpackb(data, object_hook=decode_ion))
+
+    def _process(self, transform, msg):
+        try:
+            transform.process(msg['packet'])
+        except Exception:
+            log.exception("Transform failed to process benchmark message")
+            self.errors += 1
+        self.latencies.append(time.time() - msg['ts'])
+        self.processed += 1
+
+    def _send_all(self, send):
+        """
+        Calls send(num) for each message number, paced to the rate
+        """
+        start_time = time.time()
+        for num in xrange(self.num_messages):
+            if self.rate:
+                delay = start_time + float(num) / self.rate - time.time()
+                gevent.sleep(max(delay, 0))
+            else:
+                gevent.sleep(0)
+            send(num)
+
+    def _run_local(self, transforms):
+        queues = [Queue() for transform in transforms]
+
+        def send(num):
+            for queue in queues:
+                packet = self.make_message()
+                send_time = time.time()
+                msg = dict(ts=send_time, packet=packet)
+                queue.put(self._encode(msg) if self.encode else msg)
+
+        def consume(transform, queue):
+            for msg in queue:
+                self._process(transform, self._decode(msg) if self.encode else msg)
+
+        start_time = time.time()
+        consumers = [gevent.spawn(consume, transform, queue) for transform, queue in zip(transforms, queues)]
+        self._send_all(send)
+        for queue in queues:
+            queue.put(StopIteration)
+        gevent.joinall(consumers, timeout=self.timeout)
+        return time.time() - start_time
+
+    def _run_amqp(self, transforms):
+        from pyon.net.endpoint import Publisher, Subscriber
+        from pyon.net.messaging import make_node
+        from pyon.net.transport import NameTrio
+
+        node, ioloop = make_node()
+        routing_key = 'bench_%s' % uuid.uuid4().hex[:8]
+        subscribers, listeners = [], []
+        for num, transform in enumerate(transforms):
+            callback = lambda m, h, transform=transform: self._process(transform, m)
+            sub = Subscriber(node=node, callback=callback,
+                             from_name=NameTrio(get_sys_name(), '%s_%s' % (routing_key, num), routing_key))
+            listeners.append(gevent.spawn(sub.listen))
+            sub.get_ready_event().wait(timeout=10)
+            subscribers.append(sub)
+        pub = Publisher(node=node, to_name=NameTrio(get_sys_name(), routing_key))
+
+        def send(num):
+            pub.publish(dict(ts=time.time(), packet=self.make_message()))
+
+        start_time = time.time()
+        try:
+            self._send_all(send)
+            expected = self.num_messages * self.fanout
+            while self.processed < expected and time.time() - start_time < self.timeout:
+                gevent.sleep(0.01)
+            return time.time() - start_time
+        finally:
+            pub.close()
+            for sub in subscribers:
+                sub.close()
+            gevent.joinall(listeners, timeout=2)
+            node.stop_node()
+            ioloop.join(timeout=5)
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the nearest-rank percentile of a sorted list, or 0.0 if empty
+    """
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+def write_results(results, fid, output_format='json'):
+    """
+    Writes a list of benchmark results to a file object as a JSON list or CSV with a header row
+    """
+    if output_format == 'csv':
+        writer = csv.DictWriter(fid, RESULT_FIELDS)
+        writer.writerow(dict(zip(RESULT_FIELDS, RESULT_FIELDS)))
+        writer.writerows(results)
+    else:
+        fid.write(simplejson.dumps(results, indent=2))
+        fid.write("\n")
@@ -608,14 +608,17 @@ class RecvChannel(BaseChannel):
         # put body, headers, delivery tag (for acking) in the recv queue
         self._recv_queue.put((body, header_frame.headers, delivery_tag))
 
-    def ack(self, delivery_tag):
+    def ack(self, delivery_tag, multiple=False):
         """
-        Acks a message using the delivery tag.
+        Acks a message using the delivery tag, or with multiple all unacked messages up to it.
         Should be called by the EP layer.
         """
-        log.debug("RecvChannel.ack: %s", delivery_tag)
+        log.debug("RecvChannel.ack: %s (multiple=%s)", delivery_tag, multiple)
         self._ensure_amq_chan()
-        self._amq_chan.basic_ack(delivery_tag)
+        if multiple:
+            self._amq_chan.basic_ack(delivery_tag, multiple=True)
+        else:
+            self._amq_chan.basic_ack(delivery_tag)
 
     def reject(self, delivery_tag, requeue=False):
         """
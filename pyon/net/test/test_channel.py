@@ -589,6 +589,14 @@ class TestRecvChannel(PyonTestCase):
 
         ac.basic_ack.assert_called_once_with(sentinel.delivery_tag)
 
+    def test_ack_multiple(self):
+        ac = Mock(spec=pchannel.Channel)
+        self.ch._amq_chan = ac
+
+        self.ch.ack(sentinel.delivery_tag, multiple=True)
+
+        ac.basic_ack.assert_called_once_with(sentinel.delivery_tag, multiple=True)
+
     def test_reject(self):
         ac = Mock(spec=pchannel.Channel)
         self.ch._amq_chan = ac
@@ -5,6 +5,7 @@ __license__ = 'Apache 2.0'
 
 import collections
 import datetime
+import hashlib
 import string
 import time
 import simplejson
@@ -359,6 +360,23 @@ def make_json(data):
     result = simplejson.dumps(data, default=ion_object_encoder, indent=2)
     return result
 
+# Canonical encoding for content hashes: sorted keys, no whitespace, ASCII only
+_hash_encoder = simplejson.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=True,
+                                       default=ion_object_encoder)
+
+def content_hash(doc, ignore_keys=("_id", "_rev")):
+    """
+    Returns a SHA1 hex digest of the content of a document (dict), independent of key order.
+    The canonical JSON encoding is fed to the hasher in chunks, not built as one string.
+    Top level keys in ignore_keys are excluded (by default the id and revision).
+    """
+    if ignore_keys:
+        doc = dict((k, v) for k, v in doc.iteritems() if k not in ignore_keys)
+    sha1 = hashlib.sha1()
+    for chunk in _hash_encoder.iterencode(doc):
+        sha1.update(chunk)
+    return sha1.hexdigest()
+
 
 #Global utility functions for generating unique names and UUIDs
 # get a UUID - URL safe, Base64
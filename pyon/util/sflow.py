@@ -89,6 +89,8 @@ class SFlowManager(object):
             # get a cpu times sample
             res = resource.getrusage(resource.RUSAGE_SELF)
 
+            conn_open, conn_max, ds_totals = self._get_datastore_counters()
+
             # build and send counter structure
             csample = { 'counters_sample': {
                             'app_name': str(self._container.id),
@@ -99,8 +101,8 @@ class SFlowManager(object):
                                 'mem_max': res.ru_maxrss * 1024,
                                 'fd_open': 0,   # @TODO do we care?
                                 'fd_max': 0,    # @TODO ""
-                                'conn_open': 0, # @TODO couch/rabbit connection summary somehow
-                                'conn_max': 0
+                                'conn_open': conn_open,     # CouchDB connection pool(s)
+                                'conn_max': conn_max
                             }
                         },
                         'app_workers':{
@@ -112,10 +114,36 @@ class SFlowManager(object):
                         }
                       }
 
+            if ds_totals:
+                # Datastore calls as operation counters
+                csample['app_operations'] = {
+                    'success': ds_totals['count'] - ds_totals['errors'],
+                    'internal_error': ds_totals['errors'],
+                }
+
             log.debug("Publishing counter stats: %s" % csample)
 
             self._publish(csample)
 
+    def _get_datastore_counters(self):
+        """
+        Returns open and max CouchDB connections and the datastore call totals, if
+        datastore instrumentation is enabled.
+        """
+        conn_open, conn_max = 0, 0
+        if CFG.get_safe('container.datastore.server_type', 'couchdb') == 'couchdb':
+            from pyon.datastore.couchdb.couchdb_pool import get_pool_stats
+            for pool_stats in get_pool_stats().itervalues():
+                conn_open += pool_stats['active'] + pool_stats['idle']
+                conn_max += pool_stats['max_connections']
+
+        ds_totals = None
+        ds_stats = getattr(getattr(self._container, 'datastore_manager', None), 'ds_stats', None)
+        if ds_stats:
+            ds_totals = ds_stats.get_totals()
+
+        return conn_open, conn_max, ds_totals
+
     def _read_interval_time(self):
         """
         Reads the hsflowd conf file to determine what time should be used.
@@ -3,7 +3,7 @@
 __author__ = 'Thomas R. Lennan'
 __license__ = 'Apache 2.0'
 
-from pyon.util.containers import DictModifier, DotDict, create_unique_identifier, make_json, is_valid_identifier, is_basic_identifier, NORMAL_VALID
+from pyon.util.containers import DictModifier, DotDict, create_unique_identifier, make_json, is_valid_identifier, is_basic_identifier, NORMAL_VALID, content_hash
 from pyon.util.int_test import IonIntegrationTestCase
 from nose.plugins.attrib import attr
 
@@ -95,6 +95,18 @@ class Test_Containers(IonIntegrationTestCase):
         ]'''.split()))
 
 
+    def test_content_hash(self):
+        doc1 = {'_id': 'id1', '_rev': '1', 'name': 'abc', 'values': [1, 2.5, None], 'sub': {'b': u'\xe9', 'a': True}}
+        doc2 = {'sub': {'a': True, 'b': u'\xe9'}, 'values': [1, 2.5, None], 'name': 'abc', '_rev': '2', '_id': 'id2'}
+        self.assertEqual(content_hash(doc1), content_hash(doc2))
+        self.assertEqual(len(content_hash(doc1)), 40)
+
+        doc2['values'].append(3)
+        self.assertNotEqual(content_hash(doc1), content_hash(doc2))
+        self.assertNotEqual(content_hash(doc1), content_hash(doc1, ignore_keys=None))
+        self.assertEqual(content_hash(dict(doc1, ts='1'), ignore_keys=('_id', '_rev', 'ts')),
+                         content_hash(dict(doc1, ts='2'), ignore_keys=('_id', '_rev', 'ts')))
+
     def test_create_unique_identifier(self):
         id = create_unique_identifier('abc123')
         self.assertIn('abc123', id)
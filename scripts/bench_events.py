@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for EventRepository.find_events query planning. Fills an events datastore
+on the SQLite back-end with synthetic events and reports the time of typical queries.
+
+Usage: bin/python scripts/bench_events.py [-n 1000000] [-p /tmp/bench_events]
+"""
+
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EventRepository query benchmark")
+    parser.add_argument('-n', '--num_events', type=int, default=1000000, help='Number of synthetic events')
+    parser.add_argument('-b', '--batch_size', type=int, default=5000, help='Events per bulk write')
+    parser.add_argument('-p', '--path', type=str, default=None, help='SQLite data directory (default: temp dir)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Repetitions per query')
+    opts = parser.parse_args()
+
+    from pyon.core import bootstrap
+    from pyon.util.containers import dict_merge
+    bootstrap.bootstrap_pyon()
+
+    path = opts.path or tempfile.mkdtemp(prefix="bench_events_")
+    dict_merge(bootstrap.CFG, dict(container=dict(datastore=dict(server_type='sqlite')),
+                                   server=dict(sqlite=dict(path=path))), inplace=True)
+
+    from pyon.datastore.datastore import DatastoreManager
+    from pyon.event.event import EventRepository
+
+    event_repo = EventRepository(DatastoreManager(), buffered=False)
+
+    event_types = ["ResourceEvent", "ResourceLifecycleEvent", "ResourceModifiedEvent"]
+    origin_types = ["InstrumentDevice", "PlatformDevice", "DataProduct", "Org"]
+    sub_types = ["CREATE", "UPDATE", "DELETE", "DEPLOYED", "RETIRED"]
+    num_origins = max(opts.num_events / 100, 1)
+    ts_base = 1330000000000
+
+    print "Creating %s events in %s" % (opts.num_events, path)
+    t1 = time.time()
+    for start in xrange(0, opts.num_events, opts.batch_size):
+        events = []
+        for i in xrange(start, min(start + opts.batch_size, opts.num_events)):
+            origin_num = random.randint(0, num_origins - 1)
+            events.append(bootstrap.IonObject(random.choice(event_types),
+                origin="origin_%s" % origin_num,
+                origin_type=origin_types[origin_num % len(origin_types)],
+                sub_type=random.choice(sub_types),
+                ts_created=str(ts_base + i)))
+        event_repo.put_events(events)
+    event_repo.event_store._update_views()
+    t2 = time.time()
+    print "Created %s events in %.1f sec (%.0f events/sec)" % (opts.num_events, t2 - t1, opts.num_events / (t2 - t1))
+
+    ts_mid = str(ts_base + opts.num_events / 2)
+    ts_hour = str(ts_base + opts.num_events / 2 + 3600)
+    queries = [
+        ("origin", dict(origin="origin_42")),
+        ("origin+type", dict(origin="origin_42", event_type="ResourceLifecycleEvent")),
+        ("origin+sub_type", dict(origin="origin_42", sub_type="DEPLOYED")),
+        ("type+sub_type+time", dict(event_type="ResourceLifecycleEvent", sub_type="DEPLOYED", start_ts=ts_mid, end_ts=ts_hour)),
+        ("origin_type+type+time", dict(origin_type="DataProduct", event_type="ResourceEvent", start_ts=ts_mid, end_ts=ts_hour)),
+        ("origin_type+time", dict(origin_type="Org", start_ts=ts_mid, end_ts=ts_hour)),
+        ("time range", dict(start_ts=ts_mid, end_ts=ts_hour)),
+        ("latest 100", dict(descending=True, limit=100)),
+        ("latest 10 by sub_type", dict(sub_type="RETIRED", descending=True, limit=10)),
+    ]
+
+    print "%-25s %-20s %8s %10s" % ("query", "view", "results", "msec")
+    for title, query in queries:
+        criteria = dict((attr, query[key]) for key, attr in (('origin', 'origin'), ('event_type', 'type_'),
+                        ('origin_type', 'origin_type'), ('sub_type', 'sub_type')) if key in query)
+        view_name, _ = event_repo._plan_event_query(criteria)
+        t1 = time.time()
+        for i in xrange(opts.repeat):
+            events = event_repo.find_events(**query)
+        t2 = time.time()
+        print "%-25s %-20s %8s %10.2f" % (title, view_name, len(events), (t2 - t1) * 1000 / opts.repeat)
+
+    event_repo.close()
+    if not opts.path:
+        shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
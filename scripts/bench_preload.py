@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for DataStore.bulk_preload. Writes a JSON lines file with synthetic resources and
+associations and loads it into a fresh datastore, once doc by doc through _preload_create_doc
+(the current path) and once with bulk_preload. Uses the configured datastore server type.
+
+Usage: bin/python scripts/bench_preload.py [-n 10000] [-b 1000] [-c 4] [-s couchdb|sqlite]
+"""
+
+import argparse
+import os
+import shutil
+import simplejson
+import tempfile
+import time
+from uuid import uuid4
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataStore bulk preload benchmark")
+    parser.add_argument('-n', '--num_resources', type=int, default=10000, help='Number of synthetic resources')
+    parser.add_argument('-b', '--batch_size', type=int, default=1000, help='Docs per bulk write')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='Bulk writes in flight')
+    parser.add_argument('-s', '--server_type', type=str, default=None, help='Datastore server type (default: configured)')
+    opts = parser.parse_args()
+
+    from pyon.core import bootstrap
+    from pyon.util.containers import dict_merge
+    bootstrap.bootstrap_pyon()
+
+    sqlite_path = None
+    if opts.server_type:
+        dict_merge(bootstrap.CFG, dict(container=dict(datastore=dict(server_type=opts.server_type))), inplace=True)
+    if bootstrap.CFG.get_safe('container.datastore.server_type', 'couchdb') == 'sqlite':
+        sqlite_path = tempfile.mkdtemp(prefix="bench_preload_")
+        dict_merge(bootstrap.CFG, dict(server=dict(sqlite=dict(path=sqlite_path))), inplace=True)
+
+    from pyon.datastore.datastore import DataStore, DatastoreManager, iter_preload_file
+    from pyon.ion.resource import RT, PRED, LCS, AT
+
+    fd, filename = tempfile.mkstemp(prefix="bench_preload_", suffix=".jsonl")
+    with os.fdopen(fd, "w") as f:
+        res_ids = []
+        for i in xrange(opts.num_resources):
+            res_id = uuid4().hex
+            f.write(simplejson.dumps(dict(_id=res_id, type_=RT.InstrumentDevice, name="Device%s" % i,
+                                          lcstate=LCS.DRAFT, description="Synthetic resource %s" % i)) + "\n")
+            res_ids.append(res_id)
+        for i in xrange(1, opts.num_resources):
+            f.write(simplejson.dumps(dict(type_="Association", at=AT.H2H, srv="", orv="", retired=False,
+                                          s=res_ids[i], st=RT.InstrumentDevice, p=PRED.hasResource,
+                                          o=res_ids[i - 1], ot=RT.InstrumentDevice)) + "\n")
+        num_docs = 2 * opts.num_resources - 1
+    print "Preloading %s docs from %s" % (num_docs, filename)
+
+    results = []
+    for mode in ("single", "bulk"):
+        ds_name = "bench_preload_%s" % mode
+        data_store = DatastoreManager.get_datastore_instance(ds_name, DataStore.DS_PROFILE.RESOURCES)
+        scoped_name = DatastoreManager.get_scoped_name(ds_name)
+        if data_store.datastore_exists(scoped_name):
+            data_store.delete_datastore(scoped_name)
+        data_store.create_datastore(scoped_name, create_indexes=True, profile=DataStore.DS_PROFILE.RESOURCES)
+
+        t1 = time.time()
+        if mode == "single":
+            for doc in iter_preload_file(filename):
+                doc["_id"] = str(doc.get("_id", None) or uuid4().hex)
+                data_store._preload_create_doc(doc)
+            t2 = time.time()
+            data_store.warm_views()
+            t3 = time.time()
+            write_time, view_time = t2 - t1, t3 - t2
+        else:
+            stats = data_store.bulk_preload(iter_preload_file(filename), batch_size=opts.batch_size,
+                                            concurrency=opts.concurrency)
+            write_time, view_time = stats['write_time'], stats['view_time']
+        results.append((mode, write_time, view_time))
+
+        data_store.delete_datastore(scoped_name)
+        data_store.close()
+
+    print "%-8s %12s %12s %12s %12s" % ("mode", "write sec", "views sec", "total sec", "docs/sec")
+    for mode, write_time, view_time in results:
+        total_time = write_time + view_time
+        print "%-8s %12.2f %12.2f %12.2f %12.0f" % (mode, write_time, view_time, total_time, num_docs / total_time)
+    print "Speedup: %.1fx" % ((results[0][1] + results[0][2]) / (results[1][1] + results[1][2]))
+
+    os.remove(filename)
+    if sqlite_path:
+        shutil.rmtree(sqlite_path, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+Benchmark for stream transforms. Sends granules or lists of configurable sizes, at a configurable rate,
+to one or more instances (fan-out) of each given transform and reports throughput and p50/p95/p99 latency
+as JSON or CSV, one result per transform and message size. Uses in-process queues by default
+(with message encoding unless --no_encode) or the configured AMQP broker.
+
+Usage: bin/python scripts/bench_transforms.py [-t prototype.transforms.linear.TransformInPlaceNewGranule,...]
+       [-s 10,1000,100000] [-n 1000] [-r 0] [-f 1] [-m granule|list] [-x local|amqp] [-o json|csv] [--out file]
+"""
+
+import argparse
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream transform benchmark")
+    parser.add_argument('-t', '--transforms', type=str, default='prototype.transforms.linear.TransformInPlaceNewGranule',
+                        help='Comma separated dotted paths of transform classes')
+    parser.add_argument('-s', '--sizes', type=str, default='1000', help='Comma separated granule sizes (values per message)')
+    parser.add_argument('-n', '--num_messages', type=int, default=1000, help='Messages per run')
+    parser.add_argument('-r', '--rate', type=float, default=0, help='Messages/sec (0: as fast as possible)')
+    parser.add_argument('-f', '--fanout', type=int, default=1, help='Transform instances receiving each message')
+    parser.add_argument('-m', '--message_type', type=str, default='granule', help='granule or list')
+    parser.add_argument('-x', '--transport', type=str, default='local', help='local (in-process) or amqp')
+    parser.add_argument('--no_encode', action='store_true', help='Skip message encoding with the local transport')
+    parser.add_argument('-o', '--output_format', type=str, default='json', help='json or csv')
+    parser.add_argument('--out', type=str, default=None, help='Output file (default: stdout)')
+    opts = parser.parse_args()
+
+    from pyon.core import bootstrap
+    bootstrap.bootstrap_pyon()
+
+    from pyon.ion.transform_bench import TransformBenchmark, write_results
+
+    results = []
+    for transform in opts.transforms.split(','):
+        for size in opts.sizes.split(','):
+            bench = TransformBenchmark(transform, message_type=opts.message_type, granule_size=int(size),
+                                       num_messages=opts.num_messages, rate=opts.rate, fanout=opts.fanout,
+                                       transport=opts.transport, encode=not opts.no_encode)
+            result = bench.run()
+            sys.stderr.write("%s size=%s: %.0f msgs/sec, p50=%.2f p95=%.2f p99=%.2f msec\n" % (
+                result['transform'], size, result['throughput'], result['latency_p50'], result['latency_p95'],
+                result['latency_p99']))
+            results.append(result)
+
+    if opts.out:
+        with open(opts.out, "w") as f:
+            write_results(results, f, opts.output_format)
+    else:
+        write_results(results, sys.stdout, opts.output_format)
+
+if __name__ == '__main__':
+    main()